@@ -1,23 +1,30 @@
 # -*- encoding: UTF-8 -
 
+import hashlib
+import json
 import logging
 import filecmp
 import os
 from PIL import Image
 import re
 import shutil
-from time import sleep
+from io import BytesIO
+from multiprocessing import Pool
+from tempfile import NamedTemporaryFile
+from time import sleep, time
 from zipfile import ZipFile
 import cairosvg
 
 from django.conf import settings
 from django.contrib.auth.models import AnonymousUser
-from django.core.management.base import BaseCommand, CommandError
+from django.core.management.base import BaseCommand, CommandError, OutputWrapper
+from django.db import connections
 from django.db.models import Q
 from django.http import StreamingHttpResponse
 from django.test.client import RequestFactory
 from django.utils import translation
 from django.utils.translation import ugettext as _
+import geotrek
 from geotrek.common.models import FileType  # NOQA
 from geotrek.common import models as common_models
 from geotrek.flatpages.models import FlatPage
@@ -25,7 +32,9 @@ from geotrek.tourism import models as tourism_models
 from geotrek.trekking import models as trekking_models
 from geotrek.api.mobile.views.trekking import TrekViewSet
 from geotrek.api.mobile.views.common import FlatPageViewSet, SettingsView
-from geotrek.trekking.management.commands.sync_rando import ZipTilesBuilder
+from geotrek.trekking.management.commands.sync_rando import (ZipTilesBuilder, MBTilesBuilder, SyncZipFile,
+                                                             fix2028_chunks, precompress, init_worker,
+                                                             run_worker_job, SyncReport, SyncManifestMixin)
 # Register mapentity models
 from geotrek.trekking import urls  # NOQA
 from geotrek.tourism import urls  # NOQA
@@ -34,25 +43,41 @@ from geotrek.tourism import urls  # NOQA
 logger = logging.getLogger(__name__)
 
 
-class Command(BaseCommand):
+class Command(SyncManifestMixin, BaseCommand):
+    manifest_name = 'sync_mobile.json'
+    deltas_index_name = os.path.join('nolang', 'deltas', 'index.json')
+    # Settings used by packages of every trek (see ``incremental``)
+    fingerprint_settings = ('THUMBNAIL_COPYRIGHT_FORMAT', 'THUMBNAIL_COPYRIGHT_SIZE', 'MOBILE_TILES_URL',
+                            'MOBILE_TILES_EXTENSION', 'MOBILE_TILES_RADIUS_LARGE', 'MOBILE_TILES_RADIUS_SMALL',
+                            'MOBILE_TILES_GLOBAL_ZOOMS', 'MOBILE_TILES_LOW_ZOOMS', 'MOBILE_TILES_HIGH_ZOOMS')
+
     def add_arguments(self, parser):
         parser.add_argument('path')
         parser.add_argument('--languages', '-l', dest='languages', default='', help='Languages to sync')
         parser.add_argument('--portal', '-P', dest='portal', default=None, help='Filter by portal(s)')
         parser.add_argument('--skip-tiles', '-t', action='store_true', dest='skip_tiles', default=False,
                             help='Skip inclusion of tiles in zip files')
+        parser.add_argument('--mbtiles', '-m', action='store_true', dest='mbtiles', default=False,
+                            help='Generate MBTiles files (nolang/tiles/) instead of including tiles in zip files. '
+                                 'Trek files only contain tiles missing from global file')
         parser.add_argument('--url', '-u', dest='url', default='http://localhost', help='Base url')
         parser.add_argument('--indent', '-i', default=0, type=int, help='Indent json files')
-
-    def mkdirs(self, name):
-        dirname = os.path.dirname(name)
-        if not os.path.exists(dirname):
-            os.makedirs(dirname)
+        parser.add_argument('--precompress', '-z', action='store_true', dest='precompress', default=False,
+                            help='Write gzip (and brotli if installed) compressed copies of json files, '
+                                 'for nginx gzip_static')
+        parser.add_argument('--workers', '-W', dest='workers', type=int, default=1,
+                            help='Number of processes building packages of treks (default 1)')
+        parser.add_argument('--incremental', '-I', action='store_true', dest='incremental', default=False,
+                            help='Only build packages of treks which changed since last incremental sync, '
+                                 'link other ones from previous sync')
+        parser.add_argument('--report', '-R', dest='report', default=None,
+                            help='Write timings and sizes of sync steps in this JSON file')
 
     def sync_view(self, lang, view, name, url='/', params=None, headers={}, zipfile=None, fix2028=False, **kwargs):
         if self.verbosity == 2:
             self.stdout.write(u"\x1b[36m{lang}\x1b[0m \x1b[1m{name}\x1b[0m ...".format(lang=lang, name=name), ending="")
             self.stdout.flush()
+        start = time()
         fullname = os.path.join(self.tmp_root, name)
         self.mkdirs(fullname)
         request = self.factory.get(url, params, **headers)
@@ -66,26 +91,28 @@ class Command(BaseCommand):
             self.successfull = False
             if self.verbosity == 2:
                 self.stdout.write(u"\x1b[3D\x1b[31mfailed ({})\x1b[0m".format(e))
+            self.report.add('view', name, start, 'failed')
             return
         if response.status_code != 200:
             self.successfull = False
             if self.verbosity == 2:
                 self.stdout.write(u"\x1b[3D\x1b[31;1mfailed (HTTP {code})\x1b[0m".format(code=response.status_code))
+            self.report.add('view', name, start, 'failed')
             return
-        f = open(fullname, 'w')
         if isinstance(response, StreamingHttpResponse):
-            content = b''.join(response.streaming_content)
+            chunks = response.streaming_content
         else:
-            content = response.content
+            chunks = [response.content]
         # Fix strange unicode characters 2028 and 2029 that make Geotrek-mobile crash
         if fix2028:
-            content = content.replace('\\u2028', '\\n')
-            content = content.replace('\\u2029', '\\n')
-        f.write(content)
-        f.close()
+            chunks = fix2028_chunks(chunks)
+        with open(fullname, 'w') as f:
+            for chunk in chunks:
+                f.write(chunk)
         oldfilename = os.path.join(self.dst_root, name)
         # If new file is identical to old one, don't recreate it. This will help backup
-        if os.path.isfile(oldfilename) and filecmp.cmp(fullname, oldfilename):
+        unchanged = os.path.isfile(oldfilename) and filecmp.cmp(fullname, oldfilename)
+        if unchanged:
             os.unlink(fullname)
             os.link(oldfilename, fullname)
             if self.verbosity == 2:
@@ -93,6 +120,9 @@ class Command(BaseCommand):
         else:
             if self.verbosity == 2:
                 self.stdout.write(u"\x1b[3D\x1b[32mgenerated\x1b[0m")
+        if self.precompress:
+            precompress(fullname, oldfilename if unchanged else None)
+        self.report.add('view', name, start, 'unchanged' if unchanged else 'generated', os.path.getsize(fullname))
 
     def sync_json(self, lang, viewset, name, zipfile=None, params={}, as_view_args=[], **kwargs):
         view = viewset.as_view(*as_view_args)
@@ -139,14 +169,17 @@ class Command(BaseCommand):
         self.sync_view(lang, view, name, params=params, pk=trek.pk)
 
     def sync_file(self, name, src_root, url, directory='', zipfile=None):
+        start = time()
         url = url.strip('/')
         src = os.path.join(src_root, name)
         dst = os.path.join(self.tmp_root, directory, url, name)
         self.mkdirs(dst)
         if not os.path.isfile(dst):
             os.link(src, dst)
-        if zipfile and os.path.join(url, name) not in zipfile.namelist():
+        self.record(os.path.join(directory, url, name))
+        if zipfile:
             zipfile.write(dst, os.path.join(url, name))
+        self.report.add('file', os.path.join(directory, url, name), start, 'copied', os.path.getsize(dst))
         if self.verbosity == 2:
             self.stdout.write(
                 u"\x1b[36m**\x1b[0m \x1b[1m{directory}/{url}/{name}\x1b[0m \x1b[32mcopied\x1b[0m".format(
@@ -157,10 +190,42 @@ class Command(BaseCommand):
             url_media = '/%s%s' % (prefix, settings.MEDIA_URL) if prefix else settings.MEDIA_URL
             self.sync_file(field.name, settings.MEDIA_ROOT, url_media, directory=directory, zipfile=zipfile)
 
+    def resized_pictogram(self, path, size=None):
+        """
+        Return the pictogram converted to PNG if SVG, and resized. Results are cached on disk
+        by hash of source file and size, and shared by syncs.
+        """
+        file_extension = os.path.splitext(path)[1]
+        extension = '.png' if file_extension == '.svg' else file_extension
+        with open(path, 'rb') as f:
+            digest = hashlib.sha1(f.read()).hexdigest()
+        cached = os.path.join(settings.CACHE_ROOT, 'pictograms', digest[:2],
+                              '{}-{}{}'.format(digest, size or 0, extension))
+        if os.path.isfile(cached):
+            return cached
+        self.mkdirs(cached)
+        # Written in a temporary file and renamed, since cache is shared by syncs
+        with NamedTemporaryFile(dir=os.path.dirname(cached), suffix=extension, delete=False) as f:
+            tmpname = f.name
+        # Convert SVG to PNG and open it
+        if file_extension == '.svg':
+            cairosvg.svg2png(url=path, write_to=tmpname)
+            image = Image.open(tmpname)
+        else:
+            image = Image.open(path)
+        # Resize
+        if size:
+            image = image.resize((size, size), Image.ANTIALIAS)
+        # Save
+        image.save(tmpname, optimize=True, quality=95)
+        os.rename(tmpname, cached)
+        return cached
+
     def sync_pictograms(self, model, directory='', zipfile=None, size=None):
         for obj in model.objects.all():
             if not obj.pictogram:
                 continue
+            start = time()
             file_name, file_extension = os.path.splitext(obj.pictogram.name)
             if file_extension == '.svg':
                 name = os.path.join(settings.MEDIA_URL.strip('/'), '%s.png' % file_name)
@@ -168,19 +233,9 @@ class Command(BaseCommand):
                 name = os.path.join(settings.MEDIA_URL.strip('/'), obj.pictogram.name)
             dst = os.path.join(self.tmp_root, directory, name)
             self.mkdirs(dst)
-            # Convert SVG to PNG and open it
-            if file_extension == '.svg':
-                cairosvg.svg2png(url=obj.pictogram.path, write_to=dst)
-                image = Image.open(dst)
-            else:
-                image = Image.open(obj.pictogram.path)
-            # Resize
-            if size:
-                image = image.resize((size, size), Image.ANTIALIAS)
-            # Save
-            image.save(dst, optimize=True, quality=95)
-            if name not in zipfile.namelist():
-                zipfile.write(dst, name)
+            shutil.copyfile(self.resized_pictogram(obj.pictogram.path, size), dst)
+            zipfile.write(dst, name)
+            self.report.add('file', os.path.join(directory, name), start, 'copied', os.path.getsize(dst))
             if self.verbosity == 2:
                 self.stdout.write(
                     u"\x1b[36m**\x1b[0m \x1b[1m{directory}{url}/{name}\x1b[0m \x1b[32mcopied\x1b[0m".format(
@@ -191,22 +246,28 @@ class Command(BaseCommand):
             self.stdout.write(u"\x1b[36m**\x1b[0m \x1b[1m{name}\x1b[0m ...".format(name=name), ending="")
             self.stdout.flush()
 
+        start = time()
         oldzipfilename = os.path.join(self.dst_root, name)
         zipfilename = os.path.join(self.tmp_root, name)
+        old = None
+        new = set([(zi.filename, zi.CRC) for zi in zipfile.infolist()])
         try:
             oldzipfile = ZipFile(oldzipfilename, 'r')
         except IOError:
             uptodate = False
         else:
             old = set([(zi.filename, zi.CRC) for zi in oldzipfile.infolist()])
-            new = set([(zi.filename, zi.CRC) for zi in zipfile.infolist()])
             uptodate = (old == new)
             oldzipfile.close()
 
         zipfile.close()
+        self.record(name)
         if uptodate:
             stat = os.stat(oldzipfilename)
             os.utime(zipfilename, (stat.st_atime, stat.st_mtime))
+        if settings.MOBILE_DELTAS_KEPT:
+            self.sync_deltas(name, old, new)
+        self.report.add('zip', name, start, 'unchanged' if uptodate else 'generated', os.path.getsize(zipfilename))
 
         if self.verbosity == 2:
             if uptodate:
@@ -214,6 +275,70 @@ class Command(BaseCommand):
             else:
                 self.stdout.write(u"\x1b[3D\x1b[32mzipped\x1b[0m")
 
+    def sync_deltas(self, name, old, new):
+        """
+        Write the delta package of a zip file since previous sync: entries added or changed,
+        according to their CRC. Entries removed are listed in deltas index. Deltas of previous
+        versions are kept, to be applied in turn by clients more than one version behind.
+        ``old`` is None if there was no previous zip file.
+        """
+        key = os.path.basename(name)
+        previous = self.previous_deltas.get(key)
+        if old is not None and old == new and previous is not None:
+            self.keep_deltas(key, previous)
+            return
+        version = previous['version'] + 1 if previous is not None else 1
+        deltas = []
+        if old is not None and previous is not None:
+            delta_name = os.path.join('nolang', 'deltas', os.path.splitext(key)[0],
+                                      '{}-{}.zip'.format(previous['version'], version))
+            delta_fullname = os.path.join(self.tmp_root, delta_name)
+            self.mkdirs(delta_fullname)
+            changed = sorted(set(filename for filename, crc in new - old))
+            removed = sorted(set(filename for filename, crc in old) - set(filename for filename, crc in new))
+            src = ZipFile(os.path.join(self.tmp_root, name), 'r')
+            delta = SyncZipFile(delta_fullname, 'w')
+            for filename in changed:
+                delta.writestr(filename, src.read(filename))
+            delta.close()
+            src.close()
+            deltas.append({'from': previous['version'], 'url': delta_name,
+                           'size': os.path.getsize(delta_fullname), 'removed': removed})
+            deltas += self.link_deltas(previous['deltas'][:settings.MOBILE_DELTAS_KEPT - 1])
+        self.deltas[key] = {'version': version, 'deltas': deltas}
+
+    def keep_deltas(self, key, previous):
+        """Keep version and deltas of previous sync for an unchanged zip file"""
+        self.deltas[key] = {'version': previous['version'], 'deltas': self.link_deltas(previous['deltas'])}
+
+    def link_deltas(self, deltas):
+        """Link delta packages from previous sync, return those found"""
+        found = []
+        for delta in deltas:
+            fullname = os.path.join(self.tmp_root, delta['url'])
+            oldfullname = os.path.join(self.dst_root, delta['url'])
+            if not os.path.isfile(oldfullname):
+                continue
+            self.mkdirs(fullname)
+            if not os.path.isfile(fullname):
+                os.link(oldfullname, fullname)
+            found.append(delta)
+        return found
+
+    def load_deltas(self):
+        """Return deltas index of previous sync"""
+        try:
+            with open(os.path.join(self.dst_root, self.deltas_index_name)) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def save_deltas(self):
+        fullname = os.path.join(self.tmp_root, self.deltas_index_name)
+        self.mkdirs(fullname)
+        with open(fullname, 'w') as f:
+            json.dump(self.deltas, f, sort_keys=True)
+
     def sync_flatpage(self, lang):
         flatpages = FlatPage.objects.order_by('pk').filter(target__in=['mobile', 'all']).filter(
             **{'published_{lang}'.format(lang=lang): True})
@@ -227,6 +352,16 @@ class Command(BaseCommand):
 
     def sync_trekking(self, lang):
         self.sync_geojson(lang, TrekViewSet, 'treks.geojson', type_view={'get': 'list'})
+
+        for trek in self.published_treks(lang):
+            self.sync_geojson(lang, TrekViewSet, '{pk}/trek.geojson'.format(pk=trek.pk), pk=trek.pk,
+                              type_view={'get': 'retrieve'})
+            self.sync_trek_pois(lang, trek)
+            self.sync_trek_touristic_contents(lang, trek)
+            self.sync_trek_touristic_events(lang, trek)
+            self.progress(units=1)
+
+    def published_treks(self, lang):
         treks = trekking_models.Trek.objects.existing().order_by('pk')
         treks = treks.filter(
             Q(**{'published_{lang}'.format(lang=lang): True})
@@ -237,28 +372,16 @@ class Command(BaseCommand):
         if self.portal:
             treks = treks.filter(Q(portal__name__in=self.portal) | Q(portal=None))
 
-        for trek in treks:
-            self.sync_geojson(lang, TrekViewSet, '{pk}/trek.geojson'.format(pk=trek.pk), pk=trek.pk,
-                              type_view={'get': 'retrieve'})
-            self.sync_trek_pois(lang, trek)
-            self.sync_trek_touristic_contents(lang, trek)
-            self.sync_trek_touristic_events(lang, trek)
+        return treks
 
     def sync_settings_json(self, lang):
         self.sync_json(lang, SettingsView, 'settings')
 
     def sync_medias(self):
-        if self.celery_task:
-            self.celery_task.update_state(
-                state='PROGRESS',
-                meta={
-                    'name': self.celery_task.name,
-                    'current': 10,
-                    'total': 100,
-                    'infos': u"{}".format(_(u"Medias syncing ..."))
-                }
-            )
+        self.report.units_total += 1
+        self.progress(u"{}".format(_(u"Medias syncing ...")))
         self.sync_global_media()
+        self.progress(units=1)
         self.sync_treks_media()
 
     def sync_trek_by_pk_media(self, trek):
@@ -266,7 +389,7 @@ class Command(BaseCommand):
         zipname_trekid = os.path.join(url_trek, "{}.zip".format(trek.pk))
         zipfullname_trekid = os.path.join(self.tmp_root, zipname_trekid)
         self.mkdirs(zipfullname_trekid)
-        trekid_zipfile = ZipFile(zipfullname_trekid, 'w')
+        trekid_zipfile = SyncZipFile(zipfullname_trekid, 'w')
 
         if not self.skip_tiles:
             self.sync_trek_tiles(trek, trekid_zipfile)
@@ -302,15 +425,118 @@ class Command(BaseCommand):
                    'trek_parents__parent__deleted': False})
         )
 
+        self.run_jobs(treks)
+
+    def run_jobs(self, treks):
+        """
+        Build packages of treks, in worker processes if any. Output of workers is written
+        by the parent process, in treks order. In incremental mode, files of unchanged
+        treks are linked from previous sync.
+        """
+        jobs = []
+        pending = []
+        keys = set()
         for trek in treks:
+            key = str(trek.pk)
+            # Treks published through their parents may be listed twice
+            if key in keys:
+                continue
+            keys.add(key)
+            fingerprint = self.fingerprint(trek) if self.incremental else None
+            reusable = self.reusable(key, fingerprint)
+            jobs.append((trek, key, fingerprint, reusable))
+            if not reusable:
+                pending.append(trek)
+
+        self.report.units_total += len(jobs)
+        pool = None
+        if self.workers > 1 and len(pending) > 1:
+            # Workers open their own database connections. Pool is created once global
+            # tiles are known, since trek MBTiles files exclude them
+            connections.close_all()
+            pool = Pool(self.workers, init_worker, (self, ))
+        try:
+            if pool is None:
+                results = (('', ) + self.call_job(trek) + ({}, {}) for trek in pending)
+            else:
+                results = pool.imap(run_worker_job, [(trek.pk, ) for trek in pending])
+
+            for trek, key, fingerprint, reusable in jobs:
+                if reusable:
+                    start = time()
+                    files = self.reuse_job(key)
+                    successfull = True
+                    self.report.add('job', key, start, 'unchanged')
+                    previous = self.previous_deltas.get('{}.zip'.format(key))
+                    if settings.MOBILE_DELTAS_KEPT and previous is not None:
+                        self.keep_deltas('{}.zip'.format(key), previous)
+                else:
+                    output, files, deltas, successfull, steps, slowest = next(results)
+                    self.stdout.write(output, ending='')
+                    self.successfull = self.successfull and successfull
+                    self.deltas.update(deltas)
+                    self.report.merge(steps, slowest)
+                if self.incremental and successfull:
+                    self.manifest[key] = {'fingerprint': fingerprint, 'files': files}
+                self.progress(units=1)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+    def call_job(self, trek):
+        """Build the package of the trek, return files written, deltas index entries and success"""
+        successfull, self.successfull = self.successfull, True
+        deltas, self.deltas = self.deltas, {}
+        self.written = []
+        start = time()
+        try:
             self.sync_trek_by_pk_media(trek)
+            return self.written, self.deltas, self.successfull
+        finally:
+            self.report.add('job', str(trek.pk), start, 'generated' if self.successfull else 'failed')
+            self.successfull = successfull and self.successfull
+            self.deltas = deltas
+            self.written = None
+
+    def run_job(self, pk):
+        """Run one job of ``run_jobs()`` in a worker process"""
+        output = BytesIO()
+        self.stdout = OutputWrapper(output)
+        self.report.clear()
+        files, deltas, successfull = self.call_job(trekking_models.Trek.objects.get(pk=pk))
+        return output.getvalue(), files, deltas, successfull, self.report.steps, self.report.slowest
+
+    def fingerprint(self, trek):
+        """Hash of the trek, of objects its package depends on, of their attachments and of tiles coverage"""
+        deps = [trek]
+        deps += list(trek.published_pois)
+        deps += list(trek.published_touristic_contents)
+        deps += list(trek.published_touristic_events)
+        deps += list(trek.information_desks.all())
+        return self.objects_fingerprint(deps, trek.geom.ewkt)
+
+    def global_fingerprint(self, options):
+        """Hash of options and settings used by packages of every trek"""
+        names = ('url', 'portal', 'skip_tiles', 'mbtiles')
+        state = [geotrek.__version__, self.languages, settings.LEAFLET_CONFIG['SPATIAL_EXTENT']]
+        state += [(name, options.get(name)) for name in names]
+        state += [(name, getattr(settings, name, None)) for name in self.fingerprint_settings]
+        return hashlib.md5(repr(state)).hexdigest()
+
+    def reuse_job(self, key):
+        """Link files of the job from previous sync, return them"""
+        previous = self.link_previous_files(key)
+        if self.verbosity == 2:
+            self.stdout.write(u"\x1b[36m**\x1b[0m \x1b[1mnolang/{}.zip\x1b[0m \x1b[32munchanged\x1b[0m".format(key))
+        return previous['files']
 
     def sync_global_media(self):
         url_media_nolang = os.path.join('nolang')
         zipname_settings = os.path.join('nolang', 'global.zip')
         zipfullname_settings = os.path.join(self.tmp_root, zipname_settings)
         self.mkdirs(zipfullname_settings)
-        self.zipfile_settings = ZipFile(zipfullname_settings, 'w')
+        self.zipfile_settings = SyncZipFile(zipfullname_settings, 'w')
 
         if not self.skip_tiles:
             self.sync_global_tiles(self.zipfile_settings)
@@ -346,7 +572,15 @@ class Command(BaseCommand):
             return (lng - radius, lat - radius,
                     lng + radius, lat + radius)
 
-        tiles = ZipTilesBuilder(zipfile, prefix='/{}/tiles/'.format(trek.pk), **self.builder_args)
+        start = time()
+        if self.mbtiles:
+            name = os.path.join('nolang', 'tiles', '{}.mbtiles'.format(trek.pk))
+            filename = os.path.join(self.tmp_root, name)
+            self.mkdirs(filename)
+            tiles = MBTilesBuilder(filename, exclude=self.global_tiles, **self.builder_args)
+            self.record(name)
+        else:
+            tiles = ZipTilesBuilder(zipfile, prefix='/{}/tiles/'.format(trek.pk), **self.builder_args)
 
         geom = trek.geom
         if geom.geom_type == 'MultiLineString':
@@ -360,6 +594,7 @@ class Command(BaseCommand):
             tiles.add_coverage(bbox=small, zoomlevels=settings.MOBILE_TILES_HIGH_ZOOMS)
 
         tiles.run()
+        self.report.add('tiles', 'nolang/{}/tiles/'.format(trek.pk), start, 'generated', tiles.bytes)
 
         if self.verbosity == 2:
             self.stdout.write(u"\x1b[3D\x1b[32mdownloaded\x1b[0m")
@@ -376,32 +611,49 @@ class Command(BaseCommand):
         logger.info("Global extent is %s" % unicode(global_extent))
         logger.info("Build global tiles file...")
 
-        tiles = ZipTilesBuilder(zipfile, prefix='tiles/', **self.builder_args)
+        start = time()
+        if self.mbtiles:
+            filename = os.path.join(self.tmp_root, 'nolang', 'tiles', 'global.mbtiles')
+            self.mkdirs(filename)
+            tiles = MBTilesBuilder(filename, **self.builder_args)
+        else:
+            tiles = ZipTilesBuilder(zipfile, prefix='tiles/', **self.builder_args)
         tiles.add_coverage(bbox=global_extent,
                            zoomlevels=settings.MOBILE_TILES_GLOBAL_ZOOMS)
         tiles.run()
+        self.report.add('tiles', 'tiles/', start, 'generated', tiles.bytes)
+        self.global_tiles = frozenset(tiles.tiles)
 
         if self.verbosity == 2:
             self.stdout.write(u"\x1b[3D\x1b[32mdownloaded\x1b[0m")
 
+    def progress(self, infos=None, units=0):
+        """Count work units done, and update progress of celery task"""
+        self.report.units_done += units
+        if infos is not None:
+            self.progress_infos = infos
+        if self.celery_task:
+            self.celery_task.update_state(
+                state='PROGRESS',
+                meta={
+                    'name': self.celery_task.name,
+                    'current': self.report.progress(),
+                    'total': 100,
+                    'infos': self.progress_infos
+                }
+            )
+
     def sync(self):
-        step_value = int(50 / len(settings.MODELTRANSLATION_LANGUAGES))
-        current_value = 30
+        # Work units of a language: one by trek, plus one
+        units = {lang: 1 + self.published_treks(lang).count() for lang in self.languages}
+        self.report.units_total += sum(units.values())
 
         self.sync_medias()
 
         for lang in self.languages:
-            if self.celery_task:
-                self.celery_task.update_state(
-                    state='PROGRESS',
-                    meta={
-                        'name': self.celery_task.name,
-                        'current': current_value + step_value,
-                        'total': 100,
-                        'infos': u"{} : {} ...".format(_(u"Language"), lang)
-                    }
-                )
-                current_value = current_value + step_value
+            units_done = self.report.units_done + units[lang]
+            self.progress(u"{} : {} ...".format(_(u"Language"), lang))
+            start = time()
 
             translation.activate(lang)
             self.sync_settings_json(lang)
@@ -410,11 +662,19 @@ class Command(BaseCommand):
             self.sync_trekking(lang)
             translation.deactivate()
 
+            self.report.languages[lang] = time() - start
+            self.report.units_done = units_done
+
+        if self.incremental:
+            self.save_manifest()
+        if settings.MOBILE_DELTAS_KEPT:
+            self.save_deltas()
+
     def check_dst_root_is_empty(self):
         if not os.path.exists(self.dst_root):
             return
         existing = set([os.path.basename(p) for p in os.listdir(self.dst_root)])
-        remaining = existing - {'nolang'} - set(settings.MODELTRANSLATION_LANGUAGES)
+        remaining = existing - {'nolang', self.manifest_name} - set(settings.MODELTRANSLATION_LANGUAGES)
         if remaining:
             raise CommandError(u"Destination directory contains extra data")
 
@@ -431,8 +691,12 @@ class Command(BaseCommand):
         self.successfull = True
         self.verbosity = options['verbosity']
         self.skip_tiles = options['skip_tiles']
+        self.mbtiles = options.get('mbtiles', False)
         self.indent = options['indent']
+        self.precompress = options.get('precompress', False)
         self.factory = RequestFactory()
+        self.report = SyncReport()
+        self.progress_infos = u""
         self.dst_root = options["path"].rstrip('/')
         self.abs_path = os.path.abspath(options["path"])
         self.check_dst_root_is_empty()
@@ -446,6 +710,18 @@ class Command(BaseCommand):
         else:
             self.languages = settings.MODELTRANSLATION_LANGUAGES
         self.celery_task = options.get('task', None)
+        self.workers = options.get('workers', 1)
+        if self.workers < 1:
+            raise CommandError('workers parameter should be at least 1')
+        self.written = None
+        self.incremental = options.get('incremental', False)
+        self.manifest = {}
+        self.previous_manifest = {}
+        if self.incremental:
+            self.manifest_fingerprint = self.global_fingerprint(options)
+            self.previous_manifest = self.load_manifest(self.manifest_fingerprint)
+        self.deltas = {}
+        self.previous_deltas = self.load_deltas()
 
         if options['portal'] is not None:
             self.portal = options['portal'].split(',')
@@ -478,6 +754,8 @@ class Command(BaseCommand):
             )
         try:
             self.sync()
+            if options.get('report'):
+                self.report.save(options['report'])
         except Exception:
             shutil.rmtree(self.tmp_root)
             raise
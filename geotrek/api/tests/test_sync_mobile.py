@@ -13,17 +13,18 @@ from django.core import management
 from django.core.management.base import CommandError
 from django.db.models import Q
 from django.http import HttpResponse, StreamingHttpResponse
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase
 from django.test.utils import override_settings
 from django.utils import translation
 
 from geotrek.common.factories import RecordSourceFactory, TargetPortalFactory, AttachmentFactory
 from geotrek.common.tests import TranslationResetMixin
-from geotrek.common.utils.testdata import get_dummy_uploaded_image_svg, get_dummy_uploaded_image, get_dummy_uploaded_file
+from geotrek.common.utils.testdata import (get_dummy_uploaded_image_svg, get_dummy_uploaded_image, get_dummy_uploaded_file,
+                                           SyncWorkersTestMixin)
 from geotrek.flatpages.factories import FlatPageFactory
 from geotrek.flatpages.models import FlatPage
 from geotrek.trekking.models import Trek, POI
-from geotrek.trekking.factories import TrekWithPublishedPOIsFactory, PracticeFactory
+from geotrek.trekking.factories import TrekFactory, TrekWithPublishedPOIsFactory, PracticeFactory
 from geotrek.tourism.factories import InformationDeskFactory, InformationDeskTypeFactory
 
 
@@ -128,6 +129,12 @@ class SyncMobileFailTest(TestCase):
                                     skip_tiles=True, verbosity=2)
         self.assertEqual(e.exception.message, "url parameter should start with http:// or https://")
 
+    def test_fail_workers(self):
+        with self.assertRaises(CommandError) as e:
+            management.call_command('sync_mobile', 'tmp', url='http://localhost:8000',
+                                    skip_tiles=True, workers=0, verbosity=2)
+        self.assertEqual(e.exception.message, "workers parameter should be at least 1")
+
     def test_language_not_in_db(self):
         with self.assertRaises(CommandError) as e:
             management.call_command('sync_mobile', 'tmp', url='http://localhost:8000',
@@ -312,6 +319,17 @@ class SyncMobileSettingsTest(TranslationResetMixin, TestCase):
         shutil.rmtree('tmp')
 
 
+class SyncMobileWorkersTest(SyncWorkersTestMixin, TransactionTestCase):
+    command = 'sync_mobile'
+    options = {'languages': 'en,fr', 'skip_tiles': True}
+
+    def setUp(self):
+        trek = TrekWithPublishedPOIsFactory.create(published=True)
+        AttachmentFactory.create(content_object=trek, attachment_file=get_dummy_uploaded_image())
+        TrekFactory.create(published=True)
+        TrekFactory.create(published=True)
+
+
 class SyncMobileTreksTest(TranslationResetMixin, TestCase):
     @classmethod
     def setUpClass(cls):
@@ -390,6 +408,53 @@ class SyncMobileTreksTest(TranslationResetMixin, TestCase):
         self.assertTrue(os.path.exists(os.path.join('tmp', 'nolang', str(self.trek_1.pk), 'media',
                                                     'paperclip', 'trekking_trek')))
 
+    def test_sync_incremental(self):
+        management.call_command('sync_mobile', 'tmp', url='http://localhost:8000', languages='en',
+                                incremental=True, skip_tiles=True, verbosity=2, stdout=BytesIO())
+        self.assertTrue(os.path.exists(os.path.join('tmp', 'sync_mobile.json')))
+        self.trek_2.save()
+        output = BytesIO()
+        management.call_command('sync_mobile', 'tmp', url='http://localhost:8000', languages='en',
+                                incremental=True, skip_tiles=True, verbosity=2, stdout=output)
+        self.assertIn('nolang/{}.zip\x1b[0m \x1b[32munchanged'.format(self.trek_1.pk), output.getvalue())
+        self.assertIn('nolang/{}.zip\x1b[0m ...'.format(self.trek_2.pk), output.getvalue())
+        self.assertTrue(os.path.exists(os.path.join('tmp', 'nolang', '{}.zip'.format(self.trek_1.pk))))
+        self.assertTrue(os.path.exists(os.path.join('tmp', 'nolang', str(self.trek_1.pk), 'media',
+                                                    'paperclip', 'trekking_trek')))
+
+    def test_sync_report(self):
+        report = 'tmp_report.json'
+        management.call_command('sync_mobile', 'tmp', url='http://localhost:8000', languages='en',
+                                report=report, skip_tiles=True, verbosity=0)
+        with open(report) as f:
+            data = json.load(f)
+        os.remove(report)
+        self.assertEqual(list(data['languages'].keys()), ['en'])
+        self.assertGreater(data['steps']['view']['generated'], 0)
+        self.assertEqual(data['steps']['job']['count'], 3)
+        self.assertEqual(data['steps']['zip']['count'], 4)
+        self.assertIn('en/treks.geojson', [view['name'] for view in data['slowest']['view']])
+
+    def test_sync_deltas(self):
+        management.call_command('sync_mobile', 'tmp', url='http://localhost:8000', languages='en',
+                                skip_tiles=True, verbosity=0)
+        attachment = AttachmentFactory.create(content_object=self.trek_1, attachment_file=get_dummy_uploaded_image())
+        management.call_command('sync_mobile', 'tmp', url='http://localhost:8000', languages='en',
+                                skip_tiles=True, verbosity=0)
+        with open(os.path.join('tmp', 'nolang', 'deltas', 'index.json'), 'r') as f:
+            index = json.load(f)
+        self.assertEqual(index['global.zip'], {'version': 1, 'deltas': []})
+        self.assertEqual(index['{}.zip'.format(self.trek_2.pk)], {'version': 1, 'deltas': []})
+        trek_index = index['{}.zip'.format(self.trek_1.pk)]
+        self.assertEqual(trek_index['version'], 2)
+        self.assertEqual(len(trek_index['deltas']), 1)
+        self.assertEqual(trek_index['deltas'][0]['from'], 1)
+        self.assertEqual(trek_index['deltas'][0]['removed'], [])
+        with zipfile.ZipFile(os.path.join('tmp', trek_index['deltas'][0]['url'])) as delta:
+            names = delta.namelist()
+        self.assertTrue(any(os.path.splitext(os.path.basename(attachment.attachment_file.name))[0] in name
+                            for name in names))
+
     @mock.patch('geotrek.trekking.views.TrekViewSet.list')
     def test_streaminghttpresponse(self, mocke):
         output = BytesIO()
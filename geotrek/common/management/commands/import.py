@@ -13,6 +13,8 @@ class Command(BaseCommand):
         parser.add_argument('shapefile', nargs="?")
         parser.add_argument('-l', dest='limit', type=int, help='Limit number of lines to import')
         parser.add_argument('--encoding', '-e', default='utf8')
+        parser.add_argument('--batch-size', dest='batch_size', type=int,
+                            help='Parse rows by chunks of this size with bulk queries, 0 to parse them one by one')
 
     def handle(self, *args, **options):
         verbosity = options['verbosity']
@@ -36,6 +38,8 @@ class Command(BaseCommand):
                     line=line, eid=eid, progress=int(100 * progress)))
 
         parser = Parser(progress_cb=progress_cb, encoding=encoding)
+        if options['batch_size'] is not None:
+            parser.batch_size = options['batch_size'] or None
 
         try:
             parser.parse(options['shapefile'], limit=limit)
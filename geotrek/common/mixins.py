@@ -252,11 +252,15 @@ class BasePublishableMixin(models.Model):
         abstract = True
 
     def save(self, *args, **kwargs):
+        self.set_publication_date()
+        super(BasePublishableMixin, self).save(*args, **kwargs)
+
+    def set_publication_date(self):
+        """Set publication date on first publication, reset it when unpublished"""
         if self.publication_date is None and self.any_published:
             self.publication_date = datetime.date.today()
         if self.publication_date is not None and not self.any_published:
             self.publication_date = None
-        super(BasePublishableMixin, self).save(*args, **kwargs)
 
     @property
     def any_published(self):
@@ -408,7 +412,9 @@ OptionalPictogramMixin._meta.get_field('pictogram').blank = True
 class AddPropertyMixin(object):
     @classmethod
     def add_property(cls, name, func, verbose_name):
-        if hasattr(cls, name):
+        # A subclass may specialize a property added to one of its parents
+        inherited = getattr(cls, '%s_verbose_name' % name, None) is not None
+        if name in vars(cls) or (hasattr(cls, name) and not inherited):
             raise AttributeError("%s has already an attribute %s" % (cls, name))
         setattr(cls, name, property(func))
         setattr(cls, '%s_verbose_name' % name, verbose_name)
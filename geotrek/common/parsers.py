@@ -8,15 +8,18 @@ import xlrd
 import xml.etree.ElementTree as ET
 import urllib2
 
+from collections import defaultdict
 from ftplib import FTP
+from itertools import islice
 from os.path import dirname
 from urlparse import urlparse
 
-from django.db import models, connection
+from django.db import models, connection, transaction
 from django.db.utils import DatabaseError
 from django.contrib.auth import get_user_model
 from django.contrib.gis.gdal import DataSource, GDALException, CoordTransform
 from django.contrib.gis.geos import Point
+from django.core.exceptions import FieldDoesNotExist, ValidationError
 from django.core.files.base import ContentFile
 from django.template.loader import render_to_string
 from django.utils import translation
@@ -26,11 +29,13 @@ from django.conf import settings
 from paperclip.models import attachment_upload
 
 from geotrek.authent.models import default_structure
+from geotrek.common.mixins import BasePublishableMixin
 from geotrek.common.models import FileType, Attachment
 
 if 'modeltranslation' in settings.INSTALLED_APPS:
     from modeltranslation.fields import TranslationField
     from modeltranslation.translator import translator, NotRegistered
+    from modeltranslation.utils import build_localized_fieldname
 
 
 class ImportError(Exception):
@@ -69,10 +74,15 @@ class Parser(object):
     non_fields = {}
     natural_keys = {}
     field_options = {}
+    batch_size = None  # Parse rows by chunks with bulk queries, see parse_chunk()
+    lookup_preload_max = 1000  # Tables looked up by filter_fk/m2m are read at once up to this number of rows
 
     def __init__(self, progress_cb=None, user=None, encoding='utf8'):
         self.warnings = {}
         self.line = 0
+        self.m2m_values = None
+        self.m2m_changes = None
+        self.clear_lookups()
         self.nb_success = 0
         self.nb_created = 0
         self.nb_updated = 0
@@ -180,6 +190,10 @@ class Parser(object):
             raise RowImportError(_(u"Blank value not allowed for field '{src}'".format(src=src)))
         if isinstance(field, models.CharField):
             val = val[:256]
+        if self.m2m_changes is not None and isinstance(field, models.ManyToManyField):
+            # Written by save_m2m_changes() at the end of the chunk
+            self.m2m_changes.setdefault(dst, {})[self.obj.pk] = val
+            return
         setattr(self.obj, dst, val)
 
     def parse_real_field(self, dst, src, val):
@@ -190,7 +204,7 @@ class Parser(object):
             val = self.apply_filter(dst, src, val)
         if hasattr(self.obj, dst):
             if dst in self.m2m_fields or dst in self.m2m_constant_fields:
-                old = set(getattr(self.obj, dst).all())
+                old = self.get_m2m_value(dst)
                 val = set(val)
             else:
                 old = getattr(self.obj, dst)
@@ -239,6 +253,11 @@ class Parser(object):
                 continue
         return updated
 
+    def get_m2m_value(self, dst):
+        if self.m2m_values is None or dst not in self.m2m_values:
+            return set(getattr(self.obj, dst).all())
+        return self.m2m_values[dst][self.obj.pk]
+
     def parse_obj(self, row, operation):
         try:
             update_fields = self.parse_fields(row, self.fields)
@@ -250,9 +269,17 @@ class Parser(object):
             self.obj.save()
         else:
             self.obj.save(update_fields=update_fields)
-        update_fields += self.parse_fields(row, self.m2m_fields)
+        update_fields += self.parse_related_fields(row)
+        self.count(operation, update_fields)
+
+    def parse_related_fields(self, row):
+        """Parse fields which need the object to be saved first"""
+        update_fields = self.parse_fields(row, self.m2m_fields)
         update_fields += self.parse_fields(row, self.m2m_constant_fields)
         update_fields += self.parse_fields(row, self.non_fields, non_field=True)
+        return update_fields
+
+    def count(self, operation, update_fields):
         if operation == u"created":
             self.nb_created += 1
         elif update_fields:
@@ -289,10 +316,25 @@ class Parser(object):
                 self.add_warning(unicode(warnings))
                 return
             objects = self.model.objects.filter(**eid_kwargs)
+        objects, operation = self.get_objects(objects, eid_kwargs)
+        if objects is None:
+            return
+        for self.obj in objects:
+            self.parse_obj(row, operation)
+            self.to_delete.discard(self.obj.pk)
+        self.nb_success += 1  # FIXME
+        if self.progress_cb:
+            self.progress_cb(float(self.line) / self.nb, self.line, self.eid_val)
+
+    def get_objects(self, objects, eid_kwargs):
+        """
+        Return objects to update among existing ones with the row eid, or a new object to create,
+        and the operation. Return None if the row must be skipped.
+        """
         if len(objects) == 0 and self.update_only:
             if self.warn_on_missing_objects:
                 self.add_warning(_(u"Bad value '{eid_val}' for field '{eid_src}'. No object with this identifier").format(eid_val=self.eid_val, eid_src=self.eid_src))
-            return
+            return None, None
         elif len(objects) == 0:
             obj = self.model(**eid_kwargs)
             if hasattr(obj, 'structure'):
@@ -301,7 +343,7 @@ class Parser(object):
             operation = u"created"
         elif len(objects) >= 2 and not self.duplicate_eid_allowed:
             self.add_warning(_(u"Bad value '{eid_val}' for field '{eid_src}'. Multiple objects with this identifier").format(eid_val=self.eid_val, eid_src=self.eid_src))
-            return
+            return None, None
         else:
             _objects = []
             for obj in objects:
@@ -312,13 +354,185 @@ class Parser(object):
                     self.add_warning(_(u"Bad ownership '{structure}' for object '{eid_val}'.").format(structure=obj.structure.name, eid_val=self.eid_val))
             objects = _objects
             operation = u"updated"
-        for self.obj in objects:
-            self.parse_obj(row, operation)
-            self.to_delete.discard(self.obj.pk)
-        self.nb_success += 1  # FIXME
+        return objects, operation
+
+    def parse_chunks(self, rows):
+        """Group rows by chunks of ``batch_size``, rows with an eid already in chunk start a new one"""
+        chunk = []
+        eids = set()
+        for row in rows:
+            self.eid_val = None
+            self.line += 1
+            if self.eid is None:
+                eid_kwargs = {}
+            else:
+                try:
+                    eid_kwargs = self.get_eid_kwargs(row)
+                except (ValueImportError, RowImportError) as warnings:
+                    self.add_warning(unicode(warnings))
+                    continue
+            if len(chunk) >= self.batch_size or (self.eid is not None and self.eid_key(self.eid_val) in eids):
+                self.parse_safely(self.parse_chunk, chunk)
+                chunk = []
+                eids = set()
+            chunk.append((self.line, row, eid_kwargs, self.eid_val))
+            if self.eid is not None:
+                eids.add(self.eid_key(self.eid_val))
+        if chunk:
+            self.parse_safely(self.parse_chunk, chunk)
+
+    def eid_key(self, val):
+        return self.model._meta.get_field(self.eid).to_python(val)
+
+    def parse_chunk(self, chunk):
+        """
+        Parse rows of a chunk with bulk queries: existing objects are fetched at once, new ones
+        are bulk created and many to many relations are bulk written. Modified objects are saved
+        one by one. If writing the chunk fails, its rows are written again one by one, each in
+        its own transaction, so that only failing rows are lost.
+        """
+        existing = defaultdict(list)
+        if self.eid is not None:
+            eid_vals = [item[3] for item in chunk]
+            for obj in self.model.objects.filter(**{'{}__in'.format(self.eid): eid_vals}):
+                existing[self.eid_key(getattr(obj, self.eid))].append(obj)
+
+        parsed = []
+        created = []
+        for line, row, eid_kwargs, self.eid_val in chunk:
+            self.line = line
+            objects = existing[self.eid_key(self.eid_val)] if self.eid is not None else []
+            objects, operation = self.get_objects(objects, eid_kwargs)
+            if objects is None:
+                continue
+            entries = []
+            failed = False
+            for self.obj in objects:
+                try:
+                    update_fields = self.parse_fields(row, self.fields)
+                    update_fields += self.parse_fields(row, self.constant_fields)
+                except RowImportError as warnings:
+                    self.add_warning(unicode(warnings))
+                    self.to_delete.discard(self.obj.pk)
+                    failed = True
+                    continue
+                entries.append((self.obj, operation, update_fields))
+                if operation == u"created":
+                    created.append(self.obj)
+            parsed.append((line, row, self.eid_val, entries, failed))
+
+        pks = [obj.pk for obj in created]
+        try:
+            results = self.write_chunk(parsed, created)
+        except Exception:
+            # Everything written by the chunk was rolled back, including related objects
+            # created by get_related()
+            for obj, pk in zip(created, pks):
+                obj.pk = pk
+                obj._state.adding = True
+            self.lookups = {}
+            self.lookup_tables = {}
+            self.lookup_duplicates = set()
+            results = []
+            for line, row, self.eid_val, entries, failed in parsed:
+                self.line = line
+                results.append(self.parse_safely(self.write_row, row, entries))
+
+        for (line, row, eid_val, entries, failed), related in zip(parsed, results):
+            if related is None:
+                continue
+            for (obj, operation, update_fields), related_fields in zip(entries, related):
+                self.to_delete.discard(obj.pk)
+                self.count(operation, update_fields + related_fields)
+            if not failed:
+                self.nb_success += 1
         if self.progress_cb:
             self.progress_cb(float(self.line) / self.nb, self.line, self.eid_val)
 
+    def write_chunk(self, parsed, created):
+        """Write parsed rows in one transaction, return fields of related objects modified by row"""
+        with transaction.atomic():
+            self.create_objects(created)
+            pks = []
+            for line, row, eid_val, entries, failed in parsed:
+                for obj, operation, update_fields in entries:
+                    if operation != u"created":
+                        obj.save(update_fields=update_fields)
+                    pks.append(obj.pk)
+            self.m2m_values = self.get_m2m_values(pks)
+            self.m2m_changes = {}
+            results = []
+            try:
+                for self.line, row, self.eid_val, entries, failed in parsed:
+                    related = []
+                    for self.obj, operation, update_fields in entries:
+                        related.append(self.parse_related_fields(row))
+                    results.append(related)
+                self.save_m2m_changes()
+            finally:
+                self.m2m_values = None
+                self.m2m_changes = None
+        return results
+
+    def write_row(self, row, entries):
+        """Write objects of a parsed row in its own transaction, see write_chunk()"""
+        related = []
+        with transaction.atomic():
+            for self.obj, operation, update_fields in entries:
+                if operation == u"created":
+                    self.obj.save()
+                else:
+                    self.obj.save(update_fields=update_fields)
+                related.append(self.parse_related_fields(row))
+        return related
+
+    def can_bulk_create(self):
+        """Models with a parent table or with save() logic are saved one by one"""
+        if self.model._meta.parents:
+            return False
+        return all('save' not in vars(cls) or cls in (models.Model, BasePublishableMixin) for cls in self.model.__mro__)
+
+    def create_objects(self, objs):
+        if not self.can_bulk_create():
+            for obj in objs:
+                obj.save()
+            return
+        for obj in objs:
+            if isinstance(obj, BasePublishableMixin):
+                obj.set_publication_date()
+        self.model.objects.bulk_create(objs)
+
+    def get_m2m_through(self, dst):
+        """Return the intermediate model of a many to many field, and its columns to object and to related object"""
+        field = self.model._meta.get_field(dst)
+        through = field.rel.through
+        return (through, through._meta.get_field(field.m2m_field_name()).attname,
+                through._meta.get_field(field.m2m_reverse_field_name()).attname)
+
+    def get_m2m_values(self, pks):
+        """Return related objects of each many to many field, by object pk"""
+        values = {}
+        for dst in set(self.m2m_fields) | set(self.m2m_constant_fields):
+            field = self.model._meta.get_field(dst)
+            if not isinstance(field, models.ManyToManyField):
+                continue
+            through, obj_column, related_column = self.get_m2m_through(dst)
+            values[dst] = defaultdict(set)
+            for pk, related_pk in through.objects.filter(**{'{}__in'.format(obj_column): pks}) \
+                                                 .values_list(obj_column, related_column):
+                values[dst][pk].add(field.rel.to(pk=related_pk))
+        return values
+
+    def save_m2m_changes(self):
+        """Replace many to many relations of modified objects, with one delete and one insert by field"""
+        for dst, changes in self.m2m_changes.items():
+            through, obj_column, related_column = self.get_m2m_through(dst)
+            through.objects.filter(**{'{}__in'.format(obj_column): list(changes)}).delete()
+            # Values may repeat related objects (e.g. several source values mapped to the same one)
+            through.objects.bulk_create([through(**{obj_column: pk, related_column: related_pk})
+                                         for pk, objs in changes.items()
+                                         for related_pk in set(related.pk for related in objs)])
+
     def report(self, output_format='txt'):
         context = {
             'nb_success': self.nb_success,
@@ -327,6 +541,8 @@ class Parser(object):
             'nb_updated': self.nb_updated,
             'nb_deleted': len(self.to_delete) if self.delete else None,
             'nb_unmodified': self.nb_unmodified,
+            'nb_lookup_hits': self.nb_lookup_hits,
+            'nb_lookup_misses': self.nb_lookup_misses,
             'warnings': self.warnings,
         }
         return render_to_string('common/parser_report.{output_format}'.format(output_format=output_format), context)
@@ -344,29 +560,117 @@ class Parser(object):
                 return None
         else:
             if mapping is not None:
-                if val not in mapping.keys():
+                if val not in mapping:
                     self.add_warning(_(u"Bad value '{val}' for field {src}. Should be {values}").format(val=val, src=src, separator=self.separator, values=', '.join(mapping.keys())))
                     return None
                 val = mapping[val]
         return val
 
-    def filter_fk(self, src, val, model, field, mapping=None, partial=False, create=False, fk=None, **kwargs):
-        val = self.get_mapping(src, val, mapping, partial)
-        if val is None:
+    def clear_lookups(self):
+        self.lookups = {}
+        self.lookup_tables = {}
+        self.lookup_duplicates = set()
+        self.nb_lookup_hits = 0
+        self.nb_lookup_misses = 0
+
+    def lookup_key(self, model, field, val, fk_val):
+        try:
+            val = model._meta.get_field(field).to_python(val)
+        except (FieldDoesNotExist, ValidationError):
             return None
+        # Translated fields are looked up in current language
+        return (model, field, val, fk_val, translation.get_language())
+
+    def preload_lookups(self, model, field):
+        """Read tables of less than ``lookup_preload_max`` rows at once, return True if table is in cache"""
+        table = (model, field, translation.get_language())
+        if table not in self.lookup_tables:
+            try:
+                preload = not model._meta.get_field(field).is_relation
+            except FieldDoesNotExist:
+                preload = False
+            preload = preload and model.objects.count() <= self.lookup_preload_max
+            if preload:
+                # Read the column of current language, as get() does, without fallback values
+                column = self.lookup_column(model, field)
+                keys = set()
+                for obj in model.objects.all():
+                    key = self.lookup_key(model, field, getattr(obj, column), None)
+                    if key in keys:
+                        # Let get() fail on these values, as without cache
+                        self.lookup_duplicates.add(key)
+                    keys.add(key)
+                    self.lookups[key] = obj
+                for key in self.lookup_duplicates:
+                    self.lookups.pop(key, None)
+            self.lookup_tables[table] = preload
+        return self.lookup_tables[table]
+
+    def lookup_column(self, model, field):
+        try:
+            mto = translator.get_options_for_model(model)
+        except NotRegistered:
+            return field
+        if field not in mto.fields:
+            return field
+        return build_localized_fieldname(field, translation.get_language())
+
+    def invalidate_lookups(self, model):
+        self.lookups = {key: obj for key, obj in self.lookups.items() if key[0] != model}
+        self.lookup_tables = {key: preload for key, preload in self.lookup_tables.items() if key[0] != model}
+        self.lookup_duplicates = set(key for key in self.lookup_duplicates if key[0] != model)
+
+    def lookup(self, model, field, val, fk=None):
+        """
+        Return the object of model whose field is val (and fk is the one of current object),
+        or None if it does not exist. Results are cached during the import.
+        """
         fields = {field: val}
         if fk:
             fields[fk] = getattr(self.obj, fk)
-        if create:
-            val, created = model.objects.get_or_create(**fields)
-            if created:
-                self.add_warning(_(u"{model} '{val}' did not exist in Geotrek-Admin and was automatically created").format(model=model._meta.verbose_name.title(), val=val))
-            return val
+        key = self.lookup_key(model, field, val, fields.get(fk))
+        if key in self.lookups:
+            self.nb_lookup_hits += 1
+            return self.lookups[key]
+        if key is not None and not fk and key not in self.lookup_duplicates:
+            preloaded = (model, field, translation.get_language()) in self.lookup_tables
+            if self.preload_lookups(model, field):
+                # Whole table is in cache, the lookup which read it counts as a miss
+                if preloaded:
+                    self.nb_lookup_hits += 1
+                else:
+                    self.nb_lookup_misses += 1
+                return self.lookups.get(key)
+        self.nb_lookup_misses += 1
         try:
-            return model.objects.get(**fields)
+            obj = model.objects.get(**fields)
         except model.DoesNotExist:
-            self.add_warning(_(u"{model} '{val}' does not exists in Geotrek-Admin. Please add it").format(model=model._meta.verbose_name.title(), val=val))
+            obj = None
+        if key is not None:
+            self.lookups[key] = obj
+        return obj
+
+    def get_related(self, model, field, val, create=False, fk=None):
+        obj = self.lookup(model, field, val, fk)
+        if obj is not None:
+            return obj
+        if create:
+            fields = {field: val}
+            if fk:
+                fields[fk] = getattr(self.obj, fk)
+            obj, created = model.objects.get_or_create(**fields)
+            if created:
+                self.invalidate_lookups(model)
+                self.add_warning(_(u"{model} '{val}' did not exist in Geotrek-Admin and was automatically created").format(model=model._meta.verbose_name.title(), val=obj))
+            return obj
+        self.add_warning(_(u"{model} '{val}' does not exists in Geotrek-Admin. Please add it").format(model=model._meta.verbose_name.title(), val=val))
+        return None
+
+    def filter_fk(self, src, val, model, field, mapping=None, partial=False, create=False, fk=None, **kwargs):
+        val = self.get_mapping(src, val, mapping, partial)
+        if val is None:
             return None
+        return self.get_related(model, field, val, create, fk)
 
     def filter_m2m(self, src, val, model, field, mapping=None, partial=False, create=False, fk=None, **kwargs):
         if not val:
@@ -379,20 +683,9 @@ class Parser(object):
             subval = self.get_mapping(src, subval, mapping, partial)
             if subval is None:
                 continue
-            fields = {field: subval}
-            if fk:
-                fields[fk] = getattr(self.obj, fk)
-            if create:
-                subval, created = model.objects.get_or_create(**fields)
-                if created:
-                    self.add_warning(_(u"{model} '{val}' did not exist in Geotrek-Admin and was automatically created").format(model=model._meta.verbose_name.title(), val=subval))
+            subval = self.get_related(model, field, subval, create, fk)
+            if subval is not None:
                 dst.append(subval)
-                continue
-            try:
-                dst.append(model.objects.get(**fields))
-            except model.DoesNotExist:
-                self.add_warning(_(u"{model} '{val}' does not exists in Geotrek-Admin. Please add it").format(model=model._meta.verbose_name.title(), val=subval))
-                continue
         return dst
 
     def get_to_delete_kwargs(self):
@@ -422,6 +715,7 @@ class Parser(object):
         return kwargs
 
     def start(self):
+        self.clear_lookups()
         kwargs = self.get_to_delete_kwargs()
         if kwargs is None:
             self.to_delete = set()
@@ -440,23 +734,31 @@ class Parser(object):
         if self.filename and not os.path.exists(self.filename):
             raise GlobalImportError(_(u"File does not exists at: {filename}").format(filename=self.filename))
         self.start()
-        for i, row in enumerate(self.next_row()):
-            if limit and i >= limit:
-                break
-            try:
-                self.parse_row(row)
-            except DatabaseError as e:
-                if settings.DEBUG:
-                    raise
-                self.add_warning(str(e).decode('utf8'))
-            except (ValueImportError, RowImportError) as e:
-                self.add_warning(unicode(e))
-            except Exception as e:
-                if settings.DEBUG:
-                    raise
-                self.add_warning(unicode(e))
+        if self.batch_size:
+            rows = self.next_row()
+            self.parse_chunks(islice(rows, limit) if limit else rows)
+        else:
+            for i, row in enumerate(self.next_row()):
+                if limit and i >= limit:
+                    break
+                self.parse_safely(self.parse_row, row)
         self.end()
 
+    def parse_safely(self, method, *args):
+        """Return the result of method, or None if it failed with a warning"""
+        try:
+            return method(*args)
+        except DatabaseError as e:
+            if settings.DEBUG:
+                raise
+            self.add_warning(str(e).decode('utf8'))
+        except (ValueImportError, RowImportError) as e:
+            self.add_warning(unicode(e))
+        except Exception as e:
+            if settings.DEBUG:
+                raise
+            self.add_warning(unicode(e))
+
 
 class ShapeParser(Parser):
     def next_row(self):
@@ -643,6 +945,7 @@ class AttachmentParserMixin(object):
 class TourInSoftParser(AttachmentParserMixin, Parser):
     separator = '#'
     separator2 = '|'
+    batch_size = 100
 
     @property
     def items(self):
@@ -6,15 +6,18 @@ from shutil import rmtree
 from tempfile import mkdtemp
 from StringIO import StringIO
 
+from django.db import DatabaseError
 from django.test import TestCase
 from django.conf import settings
 from django.core.management import call_command
 from django.core.management.base import CommandError
 from django.test.utils import override_settings
 from django.template.exceptions import TemplateDoesNotExist
+from django.utils import translation
 
 from geotrek.trekking.models import Trek
-from geotrek.common.models import Organism, FileType, Attachment
+from geotrek.common.factories import ThemeFactory
+from geotrek.common.models import Organism, FileType, Attachment, Theme
 from geotrek.common.parsers import ExcelParser, AttachmentParserMixin, TourInSoftParser
 
 
@@ -29,6 +32,18 @@ class OrganismEidParser(ExcelParser):
     eid = 'organism'
 
 
+class OrganismBatchParser(OrganismEidParser):
+    batch_size = 2
+
+
+class OrganismFailingBatchParser(OrganismBatchParser):
+    non_fields = {'fail': 'nOm'}
+
+    def save_fail(self, src, val):
+        if val == u"Comité Hippolyte":
+            raise DatabaseError(u"Cannot save Hippolyte")
+
+
 class AttachmentParser(AttachmentParserMixin, OrganismEidParser):
     non_fields = {'attachments': 'photo'}
 
@@ -84,6 +99,30 @@ class ParserTests(TestCase):
         self.assertEqual(organisms[0].organism, u"Comité Théodule")
         self.assertEqual(organisms[1].organism, u"Comité Hippolyte")
 
+    def test_updated_with_eid_by_batch(self):
+        filename = os.path.join(os.path.dirname(__file__), 'data', 'organism.xls')
+        filename2 = os.path.join(os.path.dirname(__file__), 'data', 'organism2.xls')
+        parser = OrganismBatchParser()
+        parser.parse(filename)
+        self.assertEqual(parser.nb_created, 1)
+        parser = OrganismBatchParser()
+        parser.parse(filename2)
+        self.assertEqual(parser.nb_created, 1)
+        self.assertEqual(parser.nb_created + parser.nb_updated + parser.nb_unmodified, parser.nb_success)
+        self.assertEqual(parser.warnings, {})
+        organisms = Organism.objects.order_by('pk')
+        self.assertEqual(organisms[0].organism, u"Comité Théodule")
+        self.assertEqual(organisms[1].organism, u"Comité Hippolyte")
+
+    def test_failing_row_in_batch(self):
+        filename2 = os.path.join(os.path.dirname(__file__), 'data', 'organism2.xls')
+        parser = OrganismFailingBatchParser()
+        parser.parse(filename2)
+        self.assertEqual(parser.nb_success, 1)
+        self.assertEqual(parser.nb_created, 1)
+        self.assertEqual(list(parser.warnings.values()), [[u"Cannot save Hippolyte"]])
+        self.assertQuerysetEqual(Organism.objects.all(), [u"Comité Théodule"], lambda organism: organism.organism)
+
     def test_report_format_text(self):
         parser = OrganismParser()
         self.assertRegexpMatches(parser.report(), '0/0 lines imported.')
@@ -101,6 +140,44 @@ class ParserTests(TestCase):
             parser.report(output_format='toto')
 
 
+class LookupTests(TestCase):
+    def setUp(self):
+        self.filetype = FileType.objects.create(type=u"Photographie")
+        self.parser = OrganismParser()
+
+    def test_lookups_are_cached(self):
+        with self.assertNumQueries(2):
+            self.assertEqual(self.parser.filter_fk('type', u"Photographie", FileType, 'type'), self.filetype)
+            self.assertEqual(self.parser.filter_m2m('type', u"Photographie+Carte", FileType, 'type'), [self.filetype])
+        self.assertEqual(self.parser.nb_lookup_hits, 2)
+        self.assertEqual(self.parser.nb_lookup_misses, 1)
+        warning, = sum(self.parser.warnings.values(), [])
+        self.assertIn(u"'Carte' does not exists in Geotrek-Admin", warning)
+        self.assertIn(u"2 lookups from cache, 1 from database.", self.parser.report())
+
+    def test_translated_lookups_without_fallback(self):
+        theme = ThemeFactory()
+        Theme.objects.filter(pk=theme.pk).update(label_fr=u"Faune", label_en=u"")
+        with translation.override('en'):
+            self.assertIsNone(self.parser.filter_fk('themes', u"Faune", Theme, 'label'))
+        with translation.override('fr'):
+            self.assertEqual(self.parser.filter_fk('themes', u"Faune", Theme, 'label'), theme)
+
+    def test_lookups_invalidated_on_create(self):
+        self.assertIsNone(self.parser.filter_fk('type', u"Carte", FileType, 'type'))
+        filetype = self.parser.filter_fk('type', u"Carte", FileType, 'type', create=True)
+        self.assertEqual(filetype.type, u"Carte")
+        self.assertEqual(self.parser.filter_fk('type', u"Carte", FileType, 'type'), filetype)
+        self.assertEqual(FileType.objects.filter(type=u"Carte").count(), 1)
+
+    def test_large_tables_are_not_preloaded(self):
+        self.parser.lookup_preload_max = 0
+        self.assertEqual(self.parser.filter_fk('type', u"Photographie", FileType, 'type'), self.filetype)
+        self.assertEqual(self.parser.filter_fk('type', u"Photographie", FileType, 'type'), self.filetype)
+        self.assertEqual(self.parser.nb_lookup_hits, 1)
+        self.assertEqual(self.parser.nb_lookup_misses, 1)
+
+
 @override_settings(MEDIA_ROOT=mkdtemp('geotrek_test'))
 class AttachmentParserTests(TestCase):
     def setUp(self):
@@ -101,8 +101,12 @@ def uniquify(values):
     """
     Return unique values, order preserved
     """
+    seen = set()
     unique = []
-    [unique.append(i) for i in values if i not in unique]
+    for value in values:
+        if value not in seen:
+            seen.add(value)
+            unique.append(value)
     return unique
 
 
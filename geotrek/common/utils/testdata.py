@@ -1,6 +1,13 @@
+from io import BytesIO
+import os
+import shutil
+import zipfile
+
+from django.core import management
 from django.core.files.uploadedfile import SimpleUploadedFile
 
 import factory
+import mock
 
 
 # Produce a small red dot
@@ -33,3 +40,55 @@ def get_dummy_uploaded_document(name='dummy_file.odt', size=128):
 def dummy_filefield_as_sequence(toformat_name):
     """Simple helper method to fill a models.FileField"""
     return factory.Sequence(lambda n: get_dummy_uploaded_image(toformat_name % n))
+
+
+def tree_contents(root):
+    """Return contents of files by path relative to root, with entries of zip files"""
+    contents = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            name = os.path.relpath(path, root)
+            if filename.endswith('.zip'):
+                with zipfile.ZipFile(path) as zfile:
+                    contents[name] = {entry: zfile.read(entry) for entry in zfile.namelist()}
+            else:
+                with open(path, 'rb') as f:
+                    contents[name] = f.read()
+    return contents
+
+
+class SyncWorkersTestMixin(object):
+    """Compare the output of a sync command run serially and with workers.
+    Workers have their own database connections: use with a TransactionTestCase."""
+    command = None
+    options = {}
+
+    def tearDown(self):
+        shutil.rmtree('tmp_serial', ignore_errors=True)
+        shutil.rmtree('tmp_workers', ignore_errors=True)
+        super(SyncWorkersTestMixin, self).tearDown()
+
+    def sync(self, path, **options):
+        options = dict(self.options, **options)
+        with mock.patch('geotrek.trekking.models.Trek.prepare_map_image'):
+            management.call_command(self.command, path, url='http://localhost:8000', verbosity=0,
+                                    stdout=BytesIO(), **options)
+        return tree_contents(path)
+
+    def assertSameTrees(self, first, second):
+        self.assertEqual(sorted(first.keys()), sorted(second.keys()))
+        for name, content in second.items():
+            self.assertEqual(first[name], content, name)
+
+    def test_sync_workers(self):
+        serial = self.sync('tmp_serial')
+        workers = self.sync('tmp_workers', workers=2)
+        self.assertSameTrees(workers, serial)
+
+    def test_sync_workers_twice(self):
+        """Second sync compares files with the first one and links unchanged ones"""
+        serial = self.sync('tmp_serial')
+        self.sync('tmp_workers', workers=2)
+        workers = self.sync('tmp_workers', workers=2)
+        self.assertSameTrees(workers, serial)
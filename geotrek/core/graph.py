@@ -1,16 +1,204 @@
+import heapq
 import math
-from collections import defaultdict
+from array import array
+from collections import defaultdict, OrderedDict
 
+from django.core.cache import caches
+from django.db import connection
 
-def path_modifier(path):
-    length = 0.0 if math.isnan(path.length) else path.length
-    return {"id": path.pk, "length": length}
 
+# Path extremities closer than this (in SRID units) share the same graph node
+NODE_GRID_SIZE = 0.001
 
-def get_key_optimizer():
-    next_id = iter(xrange(1, 1000000)).next
-    mapping = defaultdict(next_id)
-    return lambda x: mapping[x]
+
+def path_modifier(pk, length):
+    length = 0.0 if length is None or math.isnan(length) else length
+    return {"id": pk, "length": length}
+
+
+def path_extremities_of_qs(qs):
+    """
+    Yield (id, length, start_key, end_key) for each path of the queryset.
+
+    Extremities are snapped to a grid and computed by PostGIS, so that no
+    geometry has to be fetched nor decoded. Keys are tuples of integers.
+    """
+    geom = '%s.geom' % qs.model._meta.db_table
+    select = OrderedDict([
+        ('start_x', 'ROUND(ST_X(ST_StartPoint(%s)) / %%s)::bigint' % geom),
+        ('start_y', 'ROUND(ST_Y(ST_StartPoint(%s)) / %%s)::bigint' % geom),
+        ('end_x', 'ROUND(ST_X(ST_EndPoint(%s)) / %%s)::bigint' % geom),
+        ('end_y', 'ROUND(ST_Y(ST_EndPoint(%s)) / %%s)::bigint' % geom),
+    ])
+    rows = qs.extra(select=select, select_params=[NODE_GRID_SIZE] * len(select)).values_list(
+        'id', 'length', 'start_x', 'start_y', 'end_x', 'end_y')
+    for pk, length, start_x, start_y, end_x, end_y in rows:
+        yield pk, length, (start_x, start_y), (end_x, end_y)
+
+
+class GraphState(object):
+    """
+    The path graph along with what is needed to keep it up-to-date
+    incrementally: node numbering is stable across versions, and the
+    latest changes are remembered so that deltas can be served.
+
+    The version is the oldest transaction still in progress when the state
+    was updated (see ``graph_version()``): changes of older transactions
+    are all in the state, changes of later ones are read from the path
+    journal (``PathGraphLog``) at next update, whatever their commit order.
+    """
+    history = 1000  # Number of updates kept to compute deltas
+
+    def __init__(self, version=0):
+        self.version = version
+        self.base_version = version  # Oldest version a delta can be computed from
+        self.edges = {}
+        self.nodes = {}
+        self.node_keys = {}
+        self.node_edges = defaultdict(set)
+        self.changes = []
+
+    @property
+    def graph(self):
+        return {
+            'edges': dict(self.edges),
+            'nodes': dict(self.nodes),
+        }
+
+    def _node_id(self, key):
+        if key not in self.node_keys:
+            self.node_keys[key] = len(self.node_keys) + 1
+        return self.node_keys[key]
+
+    def _put_edge(self, pk, length, start_point, end_point):
+        k_start_point, k_end_point = self._node_id(start_point), self._node_id(end_point)
+        v_path = path_modifier(pk, length)
+        v_path['nodes_id'] = [k_start_point, k_end_point]
+        self.edges[pk] = v_path
+        self.node_edges[k_start_point].add(pk)
+        self.node_edges[k_end_point].add(pk)
+        return k_start_point, k_end_point
+
+    def _pop_edge(self, pk):
+        k_start_point, k_end_point = self.edges.pop(pk)['nodes_id']
+        self.node_edges[k_start_point].discard(pk)
+        self.node_edges[k_end_point].discard(pk)
+        return k_start_point, k_end_point
+
+    def _refresh_node(self, node):
+        adjacency = {}
+        for pk in sorted(self.node_edges.get(node, ())):
+            start, end = self.edges[pk]['nodes_id']
+            adjacency[end if start == node else start] = pk
+        if adjacency:
+            self.nodes[node] = adjacency
+        else:
+            self.nodes.pop(node, None)
+            self.node_edges.pop(node, None)
+
+    def build(self, qs):
+        for pk, length, start_point, end_point in path_extremities_of_qs(qs):
+            self._put_edge(pk, length, start_point, end_point)
+        for node in self.node_edges.keys():
+            self._refresh_node(node)
+        return self
+
+    def update(self, qs, version):
+        """
+        Apply paths changes journaled since current version. Changes of transactions
+        committed after the new version are applied again at next update, which is harmless.
+        """
+        from .models import PathGraphLog
+
+        journal = PathGraphLog.objects.filter(txid__gte=self.version)
+        changed = set(journal.values_list('path', flat=True))
+        touched = set()
+        for pk in changed:
+            if pk in self.edges:
+                touched.update(self._pop_edge(pk))
+        for pk, length, start_point, end_point in path_extremities_of_qs(qs.filter(pk__in=changed)):
+            touched.update(self._put_edge(pk, length, start_point, end_point))
+        for node in touched:
+            self._refresh_node(node)
+
+        if changed:
+            self.changes.append((version, changed, touched))
+        if len(self.changes) > self.history:
+            self.base_version = self.changes.pop(0)[0]
+        self.version = version
+        return self
+
+    def delta(self, since):
+        """
+        Edges and nodes changed since the specified version, with ``None``
+        for removed ones. Returns None if the delta cannot be computed.
+        """
+        if since < self.base_version or since > self.version:
+            return None
+        paths, nodes = set(), set()
+        for version, changed, touched in self.changes:
+            if version > since:
+                paths.update(changed)
+                nodes.update(touched)
+        return {
+            'version': self.version,
+            'edges': dict((pk, self.edges.get(pk)) for pk in paths),
+            'nodes': dict((node, self.nodes.get(node)) for node in nodes),
+        }
+
+
+def graph_version():
+    """
+    Oldest transaction still in progress: the path graph can be served up to this version,
+    changes of later transactions may not be committed yet or be committed in any order.
+    """
+    cursor = connection.cursor()
+    cursor.execute("SELECT txid_snapshot_xmin(txid_current_snapshot())")
+    return cursor.fetchone()[0]
+
+
+def graph_changed_since(version, current=None):
+    """Return True if changes newer than the specified version of the graph can be served"""
+    from .models import PathGraphLog
+
+    if current is None:
+        current = graph_version()
+    return current > version and PathGraphLog.objects.filter(txid__gte=version).exists()
+
+
+def prune_graph_journal(before):
+    """
+    Remove changes journaled before the specified date and already applied to the cached
+    graph state, return the number of removed changes.
+    """
+    from .models import PathGraphLog
+
+    state = caches['fat'].get('path_graph_state')
+    version = graph_version() if state is None else state.version
+    deleted, _ = PathGraphLog.objects.filter(date__lt=before, txid__lt=version).delete()
+    return deleted
+
+
+def get_graph_state():
+    """
+    Return the up-to-date graph state of the visible, non-draft network.
+    It is shared through the ``fat`` cache and updated incrementally.
+    """
+    from .models import Path
+
+    cache = caches['fat']
+    key = 'path_graph_state'
+    qs = Path.objects.exclude(draft=True)
+    version = graph_version()
+    state = cache.get(key)
+    if state is None or state.version > version:
+        state = GraphState(version).build(qs)
+    elif graph_changed_since(state.version, version):
+        state.update(qs, version)
+    else:
+        return state
+    cache.set(key, state)
+    return state
 
 
 def graph_edges_nodes_of_qs(qs):
@@ -29,29 +217,217 @@ def graph_edges_nodes_of_qs(qs):
     }
 
 
-    coord_point are tuple of float
+    coord_point are integers, numbered in order of appearance
     """
+    return GraphState().build(qs).graph
 
-    key_modifier = get_key_optimizer()
-    value_modifier = path_modifier
 
-    edges = defaultdict(dict)
-    nodes = defaultdict(dict)
+def compact_graph(graph):
+    """
+    Same graph as ``graph_edges_nodes_of_qs``, as parallel arrays:
+    edge ``i`` is path ``id[i]``, of length ``length[i]``, going from
+    node ``start[i]`` to node ``end[i]``.
+    """
+    compact = {'id': [], 'length': [], 'start': [], 'end': []}
+    for edge_id in sorted(graph['edges']):
+        edge = graph['edges'][edge_id]
+        compact['id'].append(edge['id'])
+        compact['length'].append(edge['length'])
+        compact['start'].append(edge['nodes_id'][0])
+        compact['end'].append(edge['nodes_id'][1])
+    return compact
 
-    for path in qs:
-        coords = path.geom.coords
-        start_point, end_point = coords[0], coords[-1]
-        k_start_point, k_end_point = key_modifier(start_point), key_modifier(end_point)
 
-        v_path = value_modifier(path)
-        v_path['nodes_id'] = [k_start_point, k_end_point]
-        edge_id = v_path['id']
+class RoutingGraph(object):
+    """
+    Compact, read-only view of the path network for server-side routing.
 
-        nodes[k_start_point][k_end_point] = edge_id
-        nodes[k_end_point][k_start_point] = edge_id
-        edges[edge_id] = v_path
+    Built from the output of ``graph_edges_nodes_of_qs``: adjacency is stored
+    in CSR form (one offset array indexed by node, and parallel arrays of
+    neighbour nodes, edge ids and lengths) so that a whole territory fits in
+    a few flat arrays. Parallel edges between two nodes are kept.
+    """
 
-    return {
-        'edges': dict(edges),
-        'nodes': dict(nodes),
-    }
+    def __init__(self, graph):
+        edges = graph['edges']
+        self.edge_nodes = {}
+        self.edge_length = {}
+        degrees = defaultdict(int)
+        for edge_id, edge in edges.items():
+            start, end = edge['nodes_id']
+            self.edge_nodes[edge_id] = (start, end)
+            self.edge_length[edge_id] = edge['length']
+            degrees[start] += 1
+            if end != start:
+                degrees[end] += 1
+
+        nb_nodes = max(degrees.keys()) + 1 if degrees else 0
+        self.indptr = array('l', [0] * (nb_nodes + 1))
+        for node in xrange(nb_nodes):
+            self.indptr[node + 1] = self.indptr[node] + degrees.get(node, 0)
+
+        nb_slots = self.indptr[nb_nodes]
+        self.neighbours = array('l', [0] * nb_slots)
+        self.edge_ids = array('l', [0] * nb_slots)
+        self.lengths = array('d', [0.0] * nb_slots)
+        cursor = array('l', self.indptr[:nb_nodes])
+        for edge_id, (start, end) in self.edge_nodes.items():
+            length = self.edge_length[edge_id]
+            for node, other in ((start, end), (end, start)) if end != start else ((start, end),):
+                slot = cursor[node]
+                self.neighbours[slot] = other
+                self.edge_ids[slot] = edge_id
+                self.lengths[slot] = length
+                cursor[node] += 1
+
+    def adjacent(self, node):
+        """ Yield (neighbour, edge_id, length) for each edge leaving ``node``.
+        """
+        for slot in xrange(self.indptr[node], self.indptr[node + 1]):
+            yield self.neighbours[slot], self.edge_ids[slot], self.lengths[slot]
+
+    def shortest_path(self, sources, targets):
+        """
+        Bidirectional Dijkstra between two sets of nodes.
+
+        ``sources`` and ``targets`` map node ids to their initial cost (e.g.
+        the distance from a waypoint to the extremities of its path).
+        Returns (cost, source node, target node, steps) where steps is a list of
+        (edge_id, from_node, to_node), or None if targets are unreachable.
+        """
+        inf = float('inf')
+        dist = ({}, {})
+        prev = ({}, {})
+        heaps = ([], [])
+        settled = (set(), set())
+        for side, seeds in enumerate((sources, targets)):
+            for node, cost in seeds.items():
+                if cost < dist[side].get(node, inf):
+                    dist[side][node] = cost
+                    prev[side][node] = None
+                    heapq.heappush(heaps[side], (cost, node))
+
+        best, meeting = inf, None
+        for node, cost in dist[0].items():
+            if node in dist[1] and cost + dist[1][node] < best:
+                best, meeting = cost + dist[1][node], node
+
+        while heaps[0] or heaps[1]:
+            top = [heap[0][0] if heap else 0.0 for heap in heaps]
+            if top[0] + top[1] >= best:
+                break
+            if not heaps[1] or (heaps[0] and top[0] <= top[1]):
+                side = 0
+            else:
+                side = 1
+            cost, node = heapq.heappop(heaps[side])
+            if node in settled[side]:
+                continue
+            settled[side].add(node)
+            for neighbour, edge_id, length in self.adjacent(node):
+                new_cost = cost + length
+                if new_cost < dist[side].get(neighbour, inf):
+                    dist[side][neighbour] = new_cost
+                    prev[side][neighbour] = (node, edge_id)
+                    heapq.heappush(heaps[side], (new_cost, neighbour))
+                    other = dist[1 - side].get(neighbour)
+                    if other is not None and new_cost + other < best:
+                        best, meeting = new_cost + other, neighbour
+
+        if meeting is None:
+            return None
+
+        steps = []
+        node = meeting
+        while prev[0][node] is not None:
+            parent, edge_id = prev[0][node]
+            steps.append((edge_id, parent, node))
+            node = parent
+        source = node
+        steps.reverse()
+        node = meeting
+        while prev[1][node] is not None:
+            parent, edge_id = prev[1][node]
+            steps.append((edge_id, node, parent))
+            node = parent
+        return best, source, node, steps
+
+    def _extremities(self, edge_id, position):
+        start, end = self.edge_nodes[edge_id]
+        length = self.edge_length[edge_id]
+        costs = {start: position * length}
+        costs[end] = min(costs.get(end, float('inf')), (1.0 - position) * length)
+        return costs
+
+    def route(self, start, end):
+        """
+        Shortest route between two points on the network, each given as
+        (edge_id, position). Returns a list of (edge_id, start_position, end_position)
+        or None if no route exists.
+        """
+        (start_edge, start_pos), (end_edge, end_pos) = start, end
+        if start_edge not in self.edge_nodes or end_edge not in self.edge_nodes:
+            return None
+        if start_edge == end_edge:
+            return [(start_edge, start_pos, end_pos)]
+
+        found = self.shortest_path(self._extremities(start_edge, start_pos),
+                                   self._extremities(end_edge, end_pos))
+        if found is None:
+            return None
+        cost, source, target, steps = found
+
+        segments = [(start_edge, start_pos, 0.0 if source == self.edge_nodes[start_edge][0] else 1.0)]
+        for edge_id, from_node, to_node in steps:
+            if from_node == self.edge_nodes[edge_id][0]:
+                segments.append((edge_id, 0.0, 1.0))
+            else:
+                segments.append((edge_id, 1.0, 0.0))
+        segments.append((end_edge, 0.0 if target == self.edge_nodes[end_edge][0] else 1.0, end_pos))
+
+        # Drop zero-length segments (waypoint located on a node)
+        useful = [s for s in segments if s[1] != s[2]]
+        return useful or segments[-1:]
+
+    def route_waypoints(self, waypoints):
+        """
+        Shortest route through all waypoints, in order. Returns one list of
+        segments per leg, or None if any leg cannot be routed.
+        """
+        legs = []
+        for start, end in zip(waypoints[:-1], waypoints[1:]):
+            leg = self.route(start, end)
+            if leg is None:
+                return None
+            legs.append(leg)
+        return legs
+
+
+def serialize_route(legs):
+    """
+    Convert routing legs into the serialized topology format understood
+    by ``TopologyHelper.deserialize``.
+    """
+    objdict = []
+    for leg in legs:
+        objdict.append({
+            'offset': 0,
+            'paths': [edge_id for edge_id, start, end in leg],
+            'positions': dict((str(i), (start, end)) for i, (edge_id, start, end) in enumerate(leg)),
+        })
+    return objdict
+
+
+_routing_graph = {'version': None, 'graph': None}
+
+
+def get_routing_graph():
+    """
+    Return the routing graph of the visible, non-draft network. It is kept warm
+    in the current process and only rebuilt when the network was modified.
+    """
+    if _routing_graph['graph'] is None or graph_changed_since(_routing_graph['version']):
+        state = get_graph_state()
+        _routing_graph['graph'] = RoutingGraph(state.graph)
+        _routing_graph['version'] = state.version
+    return _routing_graph['graph']
@@ -1,8 +1,10 @@
 import json
 import logging
+from collections import OrderedDict
+from contextlib import contextmanager
 
 from django.conf import settings
-from django.db import connection
+from django.db import connection, transaction
 from django.contrib.gis.geos import Point
 from django.db.models.query import QuerySet
 
@@ -12,6 +14,62 @@ from geotrek.common.utils import sqlfunction, uniquify
 logger = logging.getLogger(__name__)
 
 
+@contextmanager
+def deferred_geometry():
+    """
+    Do not compute topologies geometries in triggers when their aggregations
+    change (e.g. while inserting many of them). Geometries have to be updated
+    explicitly before leaving the block, which runs in a transaction.
+    """
+    with transaction.atomic():
+        cursor = connection.cursor()
+        cursor.execute("SET LOCAL geotrek.defer_evenement_geometry = 'on'")
+        yield
+        cursor.execute("SET LOCAL geotrek.defer_evenement_geometry = 'off'")
+
+
+@contextmanager
+def queued_geometry():
+    """
+    Queue topologies affected by path changes instead of computing their geometry
+    in triggers. The block runs in a transaction: once committed, the queue is
+    processed asynchronously by the ``update_topologies_geometry`` task.
+    """
+    from .tasks import update_topologies_geometry
+
+    with transaction.atomic():
+        cursor = connection.cursor()
+        cursor.execute("SET LOCAL geotrek.queue_evenement_geometry = 'on'")
+        yield
+        cursor.execute("SET LOCAL geotrek.queue_evenement_geometry = 'off'")
+        transaction.on_commit(lambda: update_topologies_geometry.delay())
+
+
+@contextmanager
+def bulk_path_edits():
+    """
+    Suspend path triggers (snapping, splitting and update of topologies) while
+    creating or modifying many paths. When leaving the block, which runs in a
+    transaction, touched paths are snapped and split, and geometries of
+    related topologies are computed, in set-based passes.
+    """
+    from .models import PathGraphLog
+
+    with transaction.atomic():
+        cursor = connection.cursor()
+        # Paths touched in the block are read from the graph journal
+        cursor.execute("SELECT COALESCE(MAX(id), 0) FROM %s" % PathGraphLog._meta.db_table)
+        since = cursor.fetchone()[0]
+        cursor.execute("SET LOCAL geotrek.defer_path_triggers = 'on'")
+        cursor.execute("SET LOCAL geotrek.defer_evenement_geometry = 'on'")
+        yield
+        cursor.execute("SELECT geotrek.ft_troncons_bulk_edits_end(%s)", [since])
+        count = cursor.fetchone()[0]
+        cursor.execute("SET LOCAL geotrek.defer_path_triggers = 'off'")
+        cursor.execute("SET LOCAL geotrek.defer_evenement_geometry = 'off'")
+        logger.info("%s paths updated at the end of bulk edits", count)
+
+
 class TopologyHelper(object):
     @classmethod
     def deserialize(cls, serialized):
@@ -87,52 +145,76 @@ class TopologyHelper(object):
 
         kind = objdict[0].get('kind')
         offset = objdict[0].get('offset', 0.0)
-        topology = TopologyFactory.create(no_path=True, kind=kind, offset=offset)
-        # Remove all existing path aggregation (WTF: created from factory ?)
-        PathAggregation.objects.filter(topo_object=topology).delete()
 
         try:
-            counter = 0
-            for j, subtopology in enumerate(objdict):
-                last_topo = j == len(objdict) - 1
-                positions = subtopology.get('positions', {})
-                paths = subtopology['paths']
-                # Create path aggregations
-                for i, path in enumerate(paths):
-                    last_path = i == len(paths) - 1
-                    # Javascript hash keys are parsed as a string
-                    idx = str(i)
-                    start_position, end_position = positions.get(idx, (0.0, 1.0))
-                    path = Path.objects.get(pk=path)
-                    topology.add_path(path, start=start_position, end=end_position, order=counter, reload=False)
-                    if not last_topo and last_path:
-                        counter += 1
-                        # Intermediary marker.
-                        # make sure pos will be [X, X]
-                        # [0, X] or [X, 1] or [X, 0] or [1, X] --> X
-                        # [0.0, 0.0] --> 0.0  : marker at beginning of path
-                        # [1.0, 1.0] --> 1.0  : marker at end of path
-                        pos = -1
-                        if start_position == end_position:
-                            pos = start_position
-                        if start_position == 0.0:
-                            pos = end_position
-                        elif start_position == 1.0:
-                            pos = end_position
-                        elif end_position == 0.0:
-                            pos = start_position
-                        elif end_position == 1.0:
-                            pos = start_position
-                        elif len(paths) == 1:
-                            pos = end_position
-                        assert pos >= 0, "Invalid position (%s, %s)." % (start_position, end_position)
-                        topology.add_path(path, start=pos, end=pos, order=counter, reload=False)
-                    counter += 1
-        except (AssertionError, ValueError, KeyError, Path.DoesNotExist) as e:
+            steps = cls._deserialize_steps(objdict)
+            # Fetch all paths at once
+            paths = Path.objects.in_bulk(set(path for path, start, end, order in steps))
+            missing = set(path for path, start, end, order in steps if path not in paths)
+            if missing:
+                raise Path.DoesNotExist("Unknown paths %s" % sorted(missing))
+        except (AssertionError, ValueError, KeyError, TypeError, Path.DoesNotExist) as e:
             raise ValueError("Invalid serialized topology : %s" % e)
-        topology.save()
+
+        topology = TopologyFactory.create(no_path=True, kind=kind, offset=offset)
+        with deferred_geometry():
+            # Remove all existing path aggregation (WTF: created from factory ?)
+            PathAggregation.objects.filter(topo_object=topology).delete()
+            PathAggregation.objects.bulk_create([
+                PathAggregation(topo_object=topology, path=paths[path],
+                                start_position=start, end_position=end, order=order)
+                for path, start, end, order in steps
+            ])
+            cursor = connection.cursor()
+            cursor.execute("SELECT update_geometry_of_evenement(%s)", [topology.pk])
+        topology.reload()
         return topology
 
+    @classmethod
+    def _deserialize_steps(cls, objdict):
+        """
+        Returns the list of aggregations (path pk, start, end, order) described
+        by a serialized line topology.
+        """
+        steps = []
+        counter = 0
+        for j, subtopology in enumerate(objdict):
+            last_topo = j == len(objdict) - 1
+            positions = subtopology.get('positions', {})
+            paths = subtopology['paths']
+            # Create path aggregations
+            for i, path in enumerate(paths):
+                last_path = i == len(paths) - 1
+                # Javascript hash keys are parsed as a string
+                idx = str(i)
+                start_position, end_position = positions.get(idx, (0.0, 1.0))
+                path = int(path)
+                steps.append((path, start_position, end_position, counter))
+                if not last_topo and last_path:
+                    counter += 1
+                    # Intermediary marker.
+                    # make sure pos will be [X, X]
+                    # [0, X] or [X, 1] or [X, 0] or [1, X] --> X
+                    # [0.0, 0.0] --> 0.0  : marker at beginning of path
+                    # [1.0, 1.0] --> 1.0  : marker at end of path
+                    pos = -1
+                    if start_position == end_position:
+                        pos = start_position
+                    if start_position == 0.0:
+                        pos = end_position
+                    elif start_position == 1.0:
+                        pos = end_position
+                    elif end_position == 0.0:
+                        pos = start_position
+                    elif end_position == 1.0:
+                        pos = start_position
+                    elif len(paths) == 1:
+                        pos = end_position
+                    assert pos >= 0, "Invalid position (%s, %s)." % (start_position, end_position)
+                    steps.append((path, pos, pos, counter))
+                counter += 1
+        return steps
+
     @classmethod
     def _topologypoint(cls, lng, lat, kind=None, snap=None):
         """
@@ -163,6 +245,90 @@ class TopologyHelper(object):
         topology.save()
         return topology
 
+    @classmethod
+    def snap_points(cls, points, candidates=10):
+        """
+        Returns the closest path pk, position and offset of each point, using a
+        single query. Paths are looked up with the ``<->`` index operator, and the
+        closest one is picked among the ``candidates`` nearest. Points without any
+        path around get ``None``.
+        """
+        from .models import Path
+
+        points = [p if p.srid == settings.SRID else p.transform(settings.SRID, clone=True) for p in points]
+        if not points:
+            return []
+
+        sql = """
+        WITH points AS (SELECT i, ST_SetSRID(ST_MakePoint(a.xs[i], a.ys[i]), %(srid)s) AS geom
+                        FROM (SELECT %%s::float[] AS xs, %%s::float[] AS ys) a, generate_subscripts(a.xs, 1) i)
+        SELECT p.i, closest.id, interpolated.position, interpolated.distance
+        FROM points p
+        CROSS JOIN LATERAL (SELECT nearest.id, nearest.geom
+                            FROM (SELECT t.id, t.geom FROM %(paths_table)s t
+                                  WHERE t.visible AND NOT t.brouillon
+                                  ORDER BY t.geom <-> p.geom LIMIT %(candidates)s) nearest
+                            ORDER BY ST_Distance(nearest.geom, p.geom) LIMIT 1) closest
+        CROSS JOIN LATERAL ST_InterpolateAlong(closest.geom, p.geom) AS interpolated(position FLOAT, distance FLOAT)
+        """ % {
+            'srid': settings.SRID,
+            'paths_table': Path._meta.db_table,
+            'candidates': int(candidates),
+        }
+        cursor = connection.cursor()
+        cursor.execute(sql, [[p.x for p in points], [p.y for p in points]])
+        snapped = [None] * len(points)
+        for i, pk, position, offset in cursor.fetchall():
+            snapped[i - 1] = (pk, position, offset)
+        return snapped
+
+    @classmethod
+    def attach_points(cls, topologies, points):
+        """
+        Attach each topology to the closest path of the corresponding point, in bulk.
+        Existing aggregations are replaced. Returns the number of attached topologies.
+        """
+        from .models import Topology, PathAggregation
+
+        snapped = cls.snap_points(points)
+        attached = [(topology, point, snap) for topology, point, snap in zip(topologies, points, snapped)
+                    if snap is not None]
+        if not attached:
+            return 0
+
+        with deferred_geometry():
+            PathAggregation.objects.filter(topo_object__in=[topology.pk for topology, point, snap in attached]).delete()
+            PathAggregation.objects.bulk_create([
+                PathAggregation(topo_object_id=topology.pk, path_id=pk, start_position=position, end_position=position)
+                for topology, point, (pk, position, offset) in attached
+            ])
+            # Offset update computes geometry (see update_evenement_geom_when_offset_changes)
+            sql = """
+            UPDATE %(topology_table)s e
+            SET supprime = FALSE, decallage = v.side_offset,
+                geom = ST_SetSRID(ST_MakePoint(v.x, v.y), %(srid)s)
+            FROM (SELECT unnest(%%s::integer[]) AS id, unnest(%%s::float[]) AS side_offset,
+                         unnest(%%s::float[]) AS x, unnest(%%s::float[]) AS y) v
+            WHERE e.id = v.id
+            """ % {
+                'topology_table': Topology._meta.db_table,
+                'srid': settings.SRID,
+            }
+            points = [p if p.srid == settings.SRID else p.transform(settings.SRID, clone=True)
+                      for topology, p, snap in attached]
+            cursor = connection.cursor()
+            cursor.execute(sql, [[topology.pk for topology, point, snap in attached],
+                                 [cls._static_offset(topology, offset)
+                                  for topology, point, (pk, position, offset) in attached],
+                                 [p.x for p in points], [p.y for p in points]])
+        return len(attached)
+
+    @classmethod
+    def _static_offset(cls, topology, offset):
+        # See Topology.save()
+        shortmodelname = topology._meta.object_name.lower().replace('edge', '')
+        return settings.TOPOLOGY_STATIC_OFFSETS.get(shortmodelname, offset)
+
     @classmethod
     def serialize(cls, topology, with_pk=True):
         # Point topology
@@ -201,60 +367,84 @@ class TopologyHelper(object):
         return json.dumps(objdict)
 
     @classmethod
-    def overlapping(cls, klass, queryset):
-        from .models import Path, Topology, PathAggregation
-
-        all_objects = klass.objects.existing()
-        is_generic = klass.KIND == Topology.KIND
-        single_input = isinstance(queryset, QuerySet)
-
-        if single_input:
-            topology_pks = [str(pk) for pk in queryset.values_list('pk', flat=True)]
-        else:
-            topology_pks = [str(queryset.pk)]
-
-        if len(topology_pks) == 0:
-            return all_objects.filter(pk__in=[])
+    def _overlapping_rows(cls, klass, topology_pks, per_source=False):
+        """ Return (source pk, overlapping pk) rows, sorted by progression
+        along the source topologies (for each of them if ``per_source``).
+        """
+        from .models import Topology, PathAggregation
 
         sql = """
-        WITH topologies AS (SELECT id FROM %(topology_table)s WHERE id IN (%(topology_list)s)),
-        -- Concerned aggregations
-             aggregations AS (SELECT * FROM %(aggregations_table)s a, topologies t
-                              WHERE a.evenement = t.id),
+        WITH sources AS (SELECT DISTINCT unnest(%%s::integer[]) AS id),
         -- Concerned paths along with (start, end)
-             paths_aggr AS (SELECT a.pk_debut AS start, a.pk_fin AS end, p.id, a.ordre AS order
-                            FROM %(paths_table)s p, aggregations a
-                            WHERE a.troncon = p.id
-                            ORDER BY a.ordre)
+             paths_aggr AS (SELECT s.id AS source, a.troncon AS path, a.ordre AS path_order,
+                                   a.pk_debut AS start_position, a.pk_fin AS end_position
+                            FROM %(aggregations_table)s a, sources s
+                            WHERE a.evenement = s.id)
         -- Retrieve primary keys
-        SELECT t.id
+        SELECT pa.source, t.id
         FROM %(topology_table)s t, %(aggregations_table)s a, paths_aggr pa
-        WHERE a.troncon = pa.id AND a.evenement = t.id
-          AND least(a.pk_debut, a.pk_fin) <= greatest(pa.start, pa.end)
-          AND greatest(a.pk_debut, a.pk_fin) >= least(pa.start, pa.end)
-          AND %(extra_condition)s
-        ORDER BY (pa.order + CASE WHEN pa.start > pa.end THEN (1 - a.pk_debut) ELSE a.pk_debut END);
+        WHERE a.troncon = pa.path AND a.evenement = t.id
+          AND NOT t.supprime
+          AND least(a.pk_debut, a.pk_fin) <= greatest(pa.start_position, pa.end_position)
+          AND greatest(a.pk_debut, a.pk_fin) >= least(pa.start_position, pa.end_position)
+          AND (%%s IS NULL OR t.kind = %%s)
+        ORDER BY %(order_by)s(pa.path_order + CASE WHEN pa.start_position > pa.end_position
+                                                   THEN (1 - a.pk_debut) ELSE a.pk_debut END);
         """ % {
             'topology_table': Topology._meta.db_table,
             'aggregations_table': PathAggregation._meta.db_table,
-            'paths_table': Path._meta.db_table,
-            'topology_list': ','.join(topology_pks),
-            'extra_condition': 'true' if is_generic else "kind = '%s'" % klass.KIND
+            'order_by': 'pa.source, ' if per_source else '',
         }
+        kind = None if klass.KIND == Topology.KIND else klass.KIND
 
         cursor = connection.cursor()
-        cursor.execute(sql)
-        result = cursor.fetchall()
-        pk_list = uniquify([row[0] for row in result])
+        cursor.execute(sql, [list(topology_pks), kind, kind])
+        return cursor.fetchall()
+
+    @classmethod
+    def overlapping(cls, klass, queryset):
+        from .models import Topology
+
+        all_objects = klass.objects.existing()
+
+        if isinstance(queryset, QuerySet):
+            topology_pks = list(queryset.values_list('pk', flat=True))
+        else:
+            topology_pks = [queryset.pk]
+
+        if len(topology_pks) == 0:
+            return all_objects.filter(pk__in=[])
+
+        result = cls._overlapping_rows(klass, topology_pks)
+        pk_list = uniquify([row[1] for row in result])
 
         # Return a QuerySet and preserve pk list order
         # http://stackoverflow.com/a/1310188/141895
-        ordering = 'CASE %s END' % ' '.join(['WHEN %s.id=%s THEN %s' % (Topology._meta.db_table, id_, i)
-                                             for i, id_ in enumerate(pk_list)])
+        ordering = 'CASE %s END' % ' '.join(['WHEN %s.id=%%s THEN %%s' % Topology._meta.db_table] * len(pk_list))
+        ordering_params = [value for i, id_ in enumerate(pk_list) for value in (id_, i)]
         queryset = all_objects.filter(pk__in=pk_list).extra(
-            select={'ordering': ordering}, order_by=('ordering',))
+            select={'ordering': ordering}, select_params=ordering_params, order_by=('ordering',))
         return queryset
 
+    @classmethod
+    def overlapping_many(cls, klass, topologies):
+        """
+        Return a mapping from each of the specified topologies (instances or
+        primary keys) to the ordered list of ``klass`` primary keys overlapping it,
+        computed in a single query.
+        """
+        topology_pks = [getattr(topology, 'pk', topology) for topology in topologies]
+        overlaps = OrderedDict((pk, []) for pk in topology_pks)
+        if len(topology_pks) == 0:
+            return overlaps
+
+        seen = set()
+        for source, pk in cls._overlapping_rows(klass, topology_pks, per_source=True):
+            if (source, pk) not in seen:
+                seen.add((source, pk))
+                overlaps[source].append(pk)
+        return overlaps
+
 
 class PathHelper(object):
     @classmethod
@@ -303,3 +493,32 @@ class PathHelper(object):
         wkt = "ST_GeomFromText('%s', %s)" % (geom, settings.SRID)
         disjoint = sqlfunction('SELECT * FROM check_path_not_overlap', str(pk), wkt)
         return disjoint[0]
+
+    @classmethod
+    def delete_paths(cls, qs):
+        """
+        Delete paths of the queryset in a transaction. Point topologies are
+        attached to the closest remaining paths with a single query, and
+        geometries of other related topologies are computed once.
+        """
+        from .models import PathAggregation, Topology
+
+        with transaction.atomic():
+            aggregations = PathAggregation.objects.filter(path__in=qs.values('pk'))
+            affected = set(aggregations.values_list('topo_object', flat=True))
+            points = [topology for topology in Topology.objects.existing().filter(pk__in=affected)
+                      if isinstance(topology.geom, Point)]
+
+            with deferred_geometry():
+                aggregations.delete()
+                deleted = qs.delete()
+                TopologyHelper.attach_points(points, [topology.geom for topology in points])
+
+            # Topologies left without aggregation are marked as deleted
+            attached = PathAggregation.objects.filter(topo_object__in=[topology.pk for topology in points])
+            others = affected - set(attached.values_list('topo_object', flat=True))
+            if others:
+                cursor = connection.cursor()
+                cursor.execute("SELECT update_geometry_of_evenement(id) FROM %s WHERE id = ANY(%%s)"
+                               % Topology._meta.db_table, [list(others)])
+        return deleted
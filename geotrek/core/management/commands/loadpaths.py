@@ -1,4 +1,7 @@
+import time
+
 from django.contrib.gis.gdal import DataSource, GDALException
+from geotrek.core.helpers import bulk_path_edits
 from geotrek.core.models import Path
 from geotrek.authent.models import Structure
 from django.contrib.gis.geos.collections import Polygon, LineString
@@ -29,25 +32,21 @@ class Command(BaseCommand):
         parser.add_argument('--dry', '-d', action='store_true', dest='dry', default=False,
                             help="Do not change the database, dry run. Show the number of fail"
                                  " and objects potentially created")
+        parser.add_argument('--bulk', '-b', action='store_true', dest='bulk', default=False,
+                            help="Snap and split paths once all of them are loaded, instead of one by one")
 
     def handle(self, *args, **options):
         verbosity = options.get('verbosity')
         encoding = options.get('encoding')
         file_path = options.get('file_path')
         structure = options.get('structure')
-        name_column = options.get('name')
-        srid = options.get('srid')
-        do_intersect = options.get('intersect')
-        comments_columns = options.get('comment')
         fail = options.get('fail')
         dry = options.get('dry')
+        bulk = options.get('bulk')
 
         if dry:
             fail = True
 
-        counter = 0
-        counter_fail = 0
-
         if structure:
             try:
                 structure = Structure.objects.get(name=structure)
@@ -69,6 +68,35 @@ class Command(BaseCommand):
 
         sid = transaction.savepoint()
 
+        start = time.time()
+        if bulk:
+            with bulk_path_edits():
+                counter, counter_fail = self.load_layers(ds, bbox, structure, fail, **options)
+        else:
+            counter, counter_fail = self.load_layers(ds, bbox, structure, fail, **options)
+        if verbosity >= 2:
+            self.stdout.write(u"Paths loaded in {0:.2f} seconds".format(time.time() - start))
+
+        if not dry:
+            transaction.savepoint_commit(sid)
+            if verbosity >= 2:
+                self.stdout.write(self.style.NOTICE(
+                    u"{0} objects created, {1} objects failed".format(counter, counter_fail)))
+        else:
+            transaction.savepoint_rollback(sid)
+            self.stdout.write(self.style.NOTICE(
+                u"{0} objects will be create, {1} objects failed;".format(counter, counter_fail)))
+
+    def load_layers(self, ds, bbox, structure, fail, **options):
+        verbosity = options.get('verbosity')
+        name_column = options.get('name')
+        srid = options.get('srid')
+        do_intersect = options.get('intersect')
+        comments_columns = options.get('comment')
+
+        counter = 0
+        counter_fail = 0
+
         for layer in ds:
             for feat in layer:
                 name = feat.get(name_column) if name_column in layer.fields else ''
@@ -103,15 +131,7 @@ class Command(BaseCommand):
                             self.stdout.write('Integrity Error on path : {}, {}'.format(name, geom))
                         else:
                             raise
-        if not dry:
-            transaction.savepoint_commit(sid)
-            if verbosity >= 2:
-                self.stdout.write(self.style.NOTICE(
-                    u"{0} objects created, {1} objects failed".format(counter, counter_fail)))
-        else:
-            transaction.savepoint_rollback(sid)
-            self.stdout.write(self.style.NOTICE(
-                u"{0} objects will be create, {1} objects failed;".format(counter, counter_fail)))
+        return counter, counter_fail
 
     def check_srid(self, srid, geom):
         if not geom.srid:
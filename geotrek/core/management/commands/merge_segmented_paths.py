@@ -0,0 +1,124 @@
+from __future__ import unicode_literals
+
+import time
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from geotrek.core.graph import path_extremities_of_qs
+from geotrek.core.helpers import bulk_path_edits
+from geotrek.core.models import Path
+
+
+class Command(BaseCommand):
+    help = """Merge paths connected end to end at nodes where no other path starts or ends (degree 2),
+if they share the same attributes. Topologies of merged paths are moved to the kept one."""
+
+    attributes = ('structure_id', 'name', 'comments', 'valid', 'visible', 'draft',
+                  'comfort_id', 'source_id', 'stake_id')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry', '-d', action='store_true', dest='dry', default=False,
+                            help="Do not change the database, dry run. Show chains of paths found")
+
+    def handle(self, *args, **options):
+        verbosity = options['verbosity']
+        start = time.time()
+
+        chains = self.find_chains()
+        nodes = sum(len(chain) - 1 for chain in chains)
+
+        if options['dry']:
+            for chain in chains:
+                keeper = min(pk for pk, reverse in chain)
+                self.stdout.write("Paths {} will be merged into path {}".format(
+                    ", ".join(str(pk) for pk, reverse in chain if pk != keeper), keeper))
+            self.stdout.write(self.style.NOTICE("{} nodes and {} paths will be removed".format(nodes, nodes)))
+            return
+
+        paths, keepers, ranks, reverses = [], [], [], []
+        for chain in chains:
+            keeper = min(pk for pk, reverse in chain)
+            for rank, (pk, reverse) in enumerate(chain):
+                paths.append(pk)
+                keepers.append(keeper)
+                ranks.append(rank)
+                reverses.append(reverse)
+
+        removed = 0
+        if paths:
+            with bulk_path_edits():
+                cursor = connection.cursor()
+                cursor.execute("SELECT geotrek.ft_merge_path_chains(%s::integer[], %s::integer[], "
+                               "%s::integer[], %s::boolean[])", [paths, keepers, ranks, reverses])
+                removed = cursor.fetchone()[0]
+
+        if verbosity > 0:
+            self.stdout.write(self.style.SUCCESS("{} nodes and {} paths removed in {:.2f} seconds".format(
+                removed, removed, time.time() - start)))
+
+    def find_chains(self):
+        """
+        Return chains of paths to merge, as lists of ``(pk, reverse)`` in chain order.
+        Chains follow the direction of their path with the lowest pk, which is kept.
+        Closed chains (rings) are left untouched.
+        """
+        extremities = {}
+        node_paths = defaultdict(list)
+        for pk, length, start, end in path_extremities_of_qs(Path.include_invisible.all()):
+            extremities[pk] = (start, end)
+            node_paths[start].append(pk)
+            node_paths[end].append(pk)
+
+        inner_nodes = {node: pks for node, pks in node_paths.items() if len(pks) == 2 and pks[0] != pks[1]}
+        attributes = self.attributes_of(set(pk for pks in inner_nodes.values() for pk in pks))
+
+        # Mergeable neighbours of each path, by shared node
+        links = defaultdict(dict)
+        for node, (pk1, pk2) in inner_nodes.items():
+            if attributes[pk1] == attributes[pk2]:
+                links[pk1][node] = pk2
+                links[pk2][node] = pk1
+
+        chains = []
+        seen = set()
+        for pk in sorted(links):
+            # Walk chains from their ends only
+            if len(links[pk]) == 1 and pk not in seen:
+                chain = self.walk(pk, links, extremities)
+                seen.update(pk for pk, reverse in chain)
+                chains.append(self.orient(chain))
+        return chains
+
+    def walk(self, pk, links, extremities):
+        """Follow links from a chain end, return the list of ``(pk, reverse)``"""
+        start, end = extremities[pk]
+        node, = links[pk].keys()
+        reverse = node == start
+        chain = [(pk, reverse)]
+        while True:
+            pk = links[pk].get(node)
+            if pk is None:
+                return chain
+            start, end = extremities[pk]
+            reverse = node == end
+            chain.append((pk, reverse))
+            node = start if reverse else end
+
+    def orient(self, chain):
+        """Reverse the chain if its path with the lowest pk is reversed"""
+        if min(chain)[1]:
+            chain = [(pk, not reverse) for pk, reverse in reversed(chain)]
+        return chain
+
+    def attributes_of(self, pks):
+        """Return attributes of paths, networks and usages included, by pk"""
+        networks = defaultdict(set)
+        for pk, network in Path.networks.through.objects.filter(path_id__in=pks).values_list('path_id', 'network_id'):
+            networks[pk].add(network)
+        usages = defaultdict(set)
+        for pk, usage in Path.usages.through.objects.filter(path_id__in=pks).values_list('path_id', 'usage_id'):
+            usages[pk].add(usage)
+        rows = Path.include_invisible.filter(pk__in=pks).values_list('pk', *self.attributes)
+        return {row[0]: row[1:] + (frozenset(networks[row[0]]), frozenset(usages[row[0]])) for row in rows}
@@ -0,0 +1,20 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from geotrek.core.graph import prune_graph_journal
+
+
+class Command(BaseCommand):
+    help = """Remove old changes from the path network journal, once applied to the cached path graph.
+To be run periodically (e.g. daily by cron)."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=1,
+                            help="Keep changes of the last days (default: 1)")
+
+    def handle(self, *args, **options):
+        deleted = prune_graph_journal(timezone.now() - timedelta(days=options['days']))
+        if options['verbosity'] >= 1:
+            self.stdout.write("{} journaled changes removed".format(deleted))
@@ -1,47 +1,141 @@
 from __future__ import unicode_literals
 
 from django.core.management.base import BaseCommand
-from django.db import connection, transaction
+from django.db import connection
 
-from geotrek.core.models import Path
+from geotrek.core.helpers import deferred_geometry
+from geotrek.core.models import Path, PathAggregation
 
 
 class Command(BaseCommand):
-    help = """Remove all duplicate path (same geom)."""
-    """Do not remove path with topology."""
+    help = """Remove all duplicate path (same geom, or almost same geom with --tolerance).
+Topologies of removed paths are moved to the kept one (visible if possible)."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tolerance', '-t', action='store', dest='tolerance', type=float, default=None,
+                            help="Also remove paths within this Hausdorff distance (in meters) of another one")
+        parser.add_argument('--chunk-size', '-c', action='store', dest='chunk_size', type=int, default=1000,
+                            help="Number of paths compared at once (default 1000)")
+        parser.add_argument('--dry', '-d', action='store_true', dest='dry', default=False,
+                            help="Do not change the database, dry run. Show duplicate paths found")
 
     def handle(self, *args, **options):
         verbosity = options['verbosity']
-        cursor = connection.cursor()
-        query = """with relations as (SELECT t1.id as t1_id,
-                                             t2.id as t2_id
-                                      FROM l_t_troncon t1
-                                      JOIN l_t_troncon t2 ON t1.id < t2.id AND ST_OrderingEquals(t1.geom, t2.geom)
-                                      ORDER BY t1.id, t2.id)
-                      SELECT * FROM relations WHERE t1_id NOT IN (SELECT t2_id FROM relations) """
-        cursor.execute(query)
-        list_topologies = cursor.fetchall()
+        tolerance = options['tolerance']
+        dry = options['dry']
 
-        path_deleted = []
+        pairs = self.find_duplicates(tolerance, options['chunk_size'], verbosity)
+        duplicates = self.choose_duplicates(pairs)
+
+        if dry:
+            for duplicate, (keeper, distance, reverse) in sorted(duplicates.items()):
+                self.stdout.write("Path {} is a duplicate of path {} (distance {:.2f}{})".format(
+                    duplicate, keeper, distance, ", reversed" if reverse else ""))
+            self.stdout.write(self.style.NOTICE("{} duplicate paths will be deleted".format(len(duplicates))))
+            return
 
-        with transaction.atomic():
-            try:
-                for path1_pk, path2_pk in list_topologies:
-                    path1 = Path.include_invisible.get(pk=path1_pk)
-                    path2 = Path.include_invisible.get(pk=path2_pk)
-                    if not path1.visible and path2.visible:
-                        path1.aggregations.update(path_id=path2_pk)
-                        path1.delete()
-                        path_deleted.append(path1)
-                    else:
-                        path2.aggregations.update(path_id=path1_pk)
-                        path2.delete()
-                        path_deleted.append(path2)
-                    if verbosity > 1:
-                        self.stdout.write("Deleting path %s" % path_deleted[-1])
-
-            except Exception as exc:
-                self.stdout.write(self.style.ERROR("{}".format(exc)))
+        path_deleted = []
+        try:
+            with deferred_geometry():
+                self.move_topologies(duplicates)
+                qs = Path.include_invisible.filter(pk__in=duplicates.keys())
+                if verbosity > 1:
+                    for path in qs:
+                        self.stdout.write("Deleting path %s" % path)
+                path_deleted = list(duplicates.keys())
+                qs.delete()
+        except Exception as exc:
+            path_deleted = []
+            self.stdout.write(self.style.ERROR("{}".format(exc)))
 
         if verbosity > 0:
             self.stdout.write(self.style.SUCCESS("{} duplicate paths have been deleted".format(len(path_deleted))))
+
+    def find_duplicates(self, tolerance, chunk_size, verbosity):
+        """
+        Return pairs of duplicate paths ``(pk1, pk2, distance, reverse)`` with ``pk1 < pk2``,
+        comparing paths by chunks. Paths bounding boxes are compared first (spatial index).
+        """
+        if tolerance is None:
+            condition = "t1.geom && t2.geom AND ST_OrderingEquals(t1.geom, t2.geom)"
+            params = []
+        else:
+            condition = ("t2.geom && ST_Expand(t1.geom, %s) "
+                         "AND ST_HausdorffDistance(t1.geom, t2.geom) <= %s")
+            params = [tolerance, tolerance]
+        query = """SELECT t1.id, t2.id, ST_HausdorffDistance(t1.geom, t2.geom),
+                          ST_Distance(ST_StartPoint(t1.geom), ST_StartPoint(t2.geom))
+                          > ST_Distance(ST_StartPoint(t1.geom), ST_EndPoint(t2.geom))
+                   FROM l_t_troncon t1
+                   JOIN l_t_troncon t2 ON t1.id < t2.id AND {condition}
+                   WHERE t1.id = ANY(%s)""".format(condition=condition)
+
+        pks = list(Path.include_invisible.order_by('pk').values_list('pk', flat=True))
+        cursor = connection.cursor()
+        pairs = []
+        for i in range(0, len(pks), chunk_size):
+            chunk = pks[i:i + chunk_size]
+            cursor.execute(query, params + [chunk])
+            pairs.extend(cursor.fetchall())
+            if verbosity > 1:
+                self.stdout.write("Compared {}/{} paths, {} duplicates found".format(
+                    i + len(chunk), len(pks), len(pairs)))
+        return pairs
+
+    def choose_duplicates(self, pairs):
+        """
+        Group duplicate paths and keep one of each group: the first visible one, or
+        the first one if none is visible. Return a mapping from each path to remove
+        to ``(kept path pk, distance, reverse)``. Paths too far from the kept one
+        (chained near-duplicates) are not removed.
+        """
+        parents = {}
+
+        def root(pk):
+            while parents[pk] != pk:
+                pk = parents[pk]
+            return pk
+
+        links = {}
+        for pk1, pk2, distance, reverse in pairs:
+            links[(pk1, pk2)] = links[(pk2, pk1)] = (distance, reverse)
+            parents.setdefault(pk1, pk1)
+            parents.setdefault(pk2, pk2)
+            root1, root2 = root(pk1), root(pk2)
+            if root1 != root2:
+                parents[max(root1, root2)] = min(root1, root2)
+
+        groups = {}
+        for pk in parents:
+            groups.setdefault(root(pk), set()).add(pk)
+
+        visible = set(Path.objects.filter(pk__in=parents.keys()).values_list('pk', flat=True))
+        duplicates = {}
+        for members in groups.values():
+            keeper = min(members & visible or members)
+            for pk in members - {keeper}:
+                if (pk, keeper) in links:
+                    distance, reverse = links[(pk, keeper)]
+                    duplicates[pk] = (keeper, distance, reverse)
+        return duplicates
+
+    def move_topologies(self, duplicates):
+        """
+        Move topologies of duplicate paths to the kept ones, with one UPDATE
+        for paths in the same direction and one for reversed paths.
+        """
+        table = PathAggregation._meta.db_table
+        cursor = connection.cursor()
+        for reverse in (False, True):
+            moves = [(pk, keeper) for pk, (keeper, distance, rev) in duplicates.items() if rev == reverse]
+            if not moves:
+                continue
+            positions = ", pk_debut = 1 - et.pk_debut, pk_fin = 1 - et.pk_fin" if reverse else ""
+            cursor.execute("""UPDATE {table} et SET troncon = d.keeper{positions}
+                              FROM (SELECT unnest(%s::integer[]) AS duplicate,
+                                           unnest(%s::integer[]) AS keeper) AS d
+                              WHERE et.troncon = d.duplicate""".format(table=table, positions=positions),
+                           [[pk for pk, keeper in moves], [keeper for pk, keeper in moves]])
+        cursor.execute("""SELECT update_geometry_of_evenement(evenement)
+                          FROM (SELECT DISTINCT evenement FROM {table} WHERE troncon = ANY(%s)) AS e"""
+                       .format(table=table), [list(set(keeper for keeper, distance, rev in duplicates.values()))])
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_auto_20190306_1417'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PathGraphLog',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.IntegerField(db_column=b'troncon', verbose_name='Path')),
+                ('date', models.DateTimeField(auto_now_add=True, db_column=b'date', verbose_name='Date')),
+            ],
+            options={
+                'db_table': 'l_t_troncon_journal',
+                'verbose_name': 'Path graph log',
+                'verbose_name_plural': 'Path graph logs',
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_pathgraphlog'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TopologyGeometryQueue',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('topology', models.IntegerField(db_column=b'evenement', db_index=True, verbose_name='Topology')),
+                ('date', models.DateTimeField(auto_now_add=True, db_column=b'date', verbose_name='Date')),
+            ],
+            options={
+                'db_table': 'e_t_evenement_a_recalculer',
+                'verbose_name': 'Topology geometry queue',
+                'verbose_name_plural': 'Topology geometry queues',
+            },
+        ),
+    ]
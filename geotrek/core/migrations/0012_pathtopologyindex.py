@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_topologygeometryqueue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PathTopologyIndex',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.IntegerField(db_column=b'troncon', db_index=True, verbose_name='Path')),
+                ('topology', models.IntegerField(db_column=b'evenement', db_index=True, verbose_name='Topology')),
+                ('kind', models.CharField(db_column=b'kind', max_length=32, verbose_name='Kind')),
+            ],
+            options={
+                'db_table': 'e_r_evenement_troncon_index',
+                'verbose_name': 'Path topology index',
+                'verbose_name_plural': 'Path topology indexes',
+            },
+        ),
+        migrations.RunSQL(
+            """INSERT INTO e_r_evenement_troncon_index (troncon, evenement, kind)
+               SELECT DISTINCT et.troncon, e.id, e.kind
+               FROM e_r_evenement_troncon et, e_t_evenement e
+               WHERE et.evenement = e.id AND NOT e.supprime""",
+            migrations.RunSQL.noop,
+        ),
+    ]
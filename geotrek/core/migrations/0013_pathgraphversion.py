@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_pathtopologyindex'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pathgraphlog',
+            name='version',
+            field=models.BigIntegerField(db_column=b'version', db_index=True, default=0, verbose_name='Version'),
+        ),
+        migrations.CreateModel(
+            name='PathGraphVersion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.BigIntegerField(db_column=b'version', default=0, verbose_name='Version')),
+            ],
+            options={
+                'db_table': 'l_t_troncon_version',
+                'verbose_name': 'Path graph version',
+                'verbose_name_plural': 'Path graph versions',
+            },
+        ),
+        migrations.RunSQL(
+            """UPDATE l_t_troncon_journal SET version = id;
+               INSERT INTO l_t_troncon_version (id, version)
+               SELECT 1, COALESCE(MAX(id), 0) FROM l_t_troncon_journal;""",
+            migrations.RunSQL.noop
+        ),
+    ]
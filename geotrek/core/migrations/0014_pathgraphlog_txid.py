@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_pathgraphversion'),
+    ]
+
+    operations = [
+        # Trigger uses the removed version counter, it is created again by ../sql/40_troncons.sql
+        migrations.RunSQL(
+            "DROP TRIGGER IF EXISTS l_t_troncon_journal_iud_tgr ON l_t_troncon;",
+            migrations.RunSQL.noop
+        ),
+        migrations.DeleteModel(
+            name='PathGraphVersion',
+        ),
+        migrations.RemoveField(
+            model_name='pathgraphlog',
+            name='version',
+        ),
+        migrations.AddField(
+            model_name='pathgraphlog',
+            name='txid',
+            field=models.BigIntegerField(db_column=b'txid', db_index=True, default=0, verbose_name='Transaction'),
+        ),
+    ]
@@ -18,10 +18,9 @@ from geotrek.common.utils import classproperty
 from geotrek.common.utils.postgresql import debug_pg_notices
 from geotrek.altimetry.models import AltimetryMixin
 
-from .helpers import PathHelper, TopologyHelper
+from .helpers import PathHelper, TopologyHelper, queued_geometry
 from django.db import connections, DEFAULT_DB_ALIAS
-
-from django.contrib.gis.geos import Point
+from django.db.models import Exists, OuterRef
 
 logger = logging.getLogger(__name__)
 
@@ -186,31 +185,15 @@ class Path(AddPropertyMixin, MapEntityMixin, AltimetryMixin,
                 aggr.end_position = 1 - aggr.end_position
                 aggr.save()
             self._is_reversed = False
-        super(Path, self).save(*args, **kwargs)
+        if settings.TOPOLOGY_ASYNC_GEOMETRY:
+            with queued_geometry():
+                super(Path, self).save(*args, **kwargs)
+        else:
+            super(Path, self).save(*args, **kwargs)
         self.reload()
 
     def delete(self, *args, **kwargs):
-        topologies = list(self.topology_set.filter())
-        r = super(Path, self).delete(*args, **kwargs)
-        if not Path.objects.exists():
-            return r
-        for topology in topologies:
-            if isinstance(topology.geom, Point):
-                closest = self.closest(topology.geom, self)
-                position, offset = closest.interpolate(topology.geom)
-                new_topology = Topology.objects.create()
-                aggrobj = PathAggregation(topo_object=new_topology,
-                                          start_position=position,
-                                          end_position=position,
-                                          path=closest)
-                aggrobj.save()
-                point = Point(topology.geom.x, topology.geom.y, srid=settings.SRID)
-                new_topology.geom = point
-                new_topology.offset = offset
-                new_topology.position = position
-                new_topology.save()
-                topology.mutate(new_topology)
-        return r
+        return PathHelper.delete_paths(Path.include_invisible.filter(pk=self.pk))
 
     @property
     def name_display(self):
@@ -267,26 +250,47 @@ class Path(AddPropertyMixin, MapEntityMixin, AltimetryMixin,
         return self.checkbox
 
     def topologies_by_path(self, default_dict):
+        Path.topologies_by_paths([self], default_dict)
+
+    @classmethod
+    def topologies_by_paths(cls, paths, default_dict):
+        """
+        Add related objects of the paths to ``default_dict``, by type. Topologies
+        of all paths are read from the index at once, then one query per type.
+        """
+        topologies = {}
+        for by_kind in PathTopologyIndex.topologies_by_kind(paths).values():
+            for kind, pks in by_kind.items():
+                topologies.setdefault(kind, set()).update(pks)
+
+        def related(model):
+            return model.objects.existing().filter(pk__in=topologies.get(model.KIND, []))
+
         if 'geotrek.core' in settings.INSTALLED_APPS:
-            for trail in self.trails:
+            for trail in related(Trail):
                 default_dict[_('Trails')].append({'name': trail.name, 'url': trail.get_detail_url()})
         if 'geotrek.trekking' in settings.INSTALLED_APPS:
-            for trek in self.treks:
+            from geotrek.trekking.models import Trek, POI, Service
+            for trek in related(Trek):
                 default_dict[_('Treks')].append({'name': trek.name, 'url': trek.get_detail_url()})
-            for service in self.services:
+            for service in related(Service).select_related('type'):
                 default_dict[_('Services')].append(
                     {'name': service.type.name, 'url': service.get_detail_url()})
-            for poi in self.pois:
+            for poi in related(POI):
                 default_dict[_('Pois')].append({'name': poi.name, 'url': poi.get_detail_url()})
         if 'geotrek.signage' in settings.INSTALLED_APPS:
-            for signage in self.signages:
+            from geotrek.signage.models import Signage
+            for signage in related(Signage):
                 default_dict[_('Signages')].append({'name': signage.name, 'url': signage.get_detail_url()})
         if 'geotrek.infrastructure' in settings.INSTALLED_APPS:
-            for infrastructure in self.infrastructures:
+            from geotrek.infrastructure.models import Infrastructure
+            for infrastructure in related(Infrastructure):
                 default_dict[_('Infrastructures')].append(
                     {'name': infrastructure.name, 'url': infrastructure.get_detail_url()})
         if 'geotrek.maintenance' in settings.INSTALLED_APPS:
-            for intervention in self.interventions:
+            from geotrek.maintenance.models import Intervention
+            all_topologies = set().union(*topologies.values())
+            for intervention in Intervention.objects.existing().filter(topology__in=all_topologies):
                 default_dict[_('Interventions')].append(
                     {'name': intervention.name, 'url': intervention.get_detail_url()})
 
@@ -315,6 +319,79 @@ class Path(AddPropertyMixin, MapEntityMixin, AltimetryMixin,
         return self.geom.transform(settings.API_SRID, clone=True).extent if self.geom else None
 
 
+class PathGraphLog(models.Model):
+    """
+    Journal of path network changes, filled by triggers (see ../sql/40_troncons.sql).
+    Each change has the id of its transaction, used to version the path graph (see ``graph.graph_version()``).
+    Old changes are removed by the ``prune_graph_journal`` command.
+    """
+    path = models.IntegerField(db_column='troncon', verbose_name=_(u"Path"))
+    date = models.DateTimeField(auto_now_add=True, db_column='date', verbose_name=_(u"Date"))
+    txid = models.BigIntegerField(default=0, db_column='txid', db_index=True, verbose_name=_(u"Transaction"))
+
+    class Meta:
+        db_table = 'l_t_troncon_journal'
+        verbose_name = _(u"Path graph log")
+        verbose_name_plural = _(u"Path graph logs")
+
+
+class TopologyGeometryQueue(models.Model):
+    """
+    Topologies waiting for their geometry to be computed again, filled by triggers
+    when paths change and TOPOLOGY_ASYNC_GEOMETRY is enabled (see ../sql/40_troncons.sql).
+    Processed by the ``update_topologies_geometry`` celery task.
+    """
+    topology = models.IntegerField(db_column='evenement', db_index=True, verbose_name=_(u"Topology"))
+    date = models.DateTimeField(auto_now_add=True, db_column='date', verbose_name=_(u"Date"))
+
+    class Meta:
+        db_table = 'e_t_evenement_a_recalculer'
+        verbose_name = _(u"Topology geometry queue")
+        verbose_name_plural = _(u"Topology geometry queues")
+
+    @classmethod
+    def pending(cls):
+        """ Number of topologies waiting for their geometry """
+        return cls.objects.values('topology').distinct().count()
+
+
+class PathTopologyIndex(models.Model):
+    """
+    Existing topologies of each path, with their kind. Maintained by triggers
+    on aggregations and topologies (see ../sql/35_evenements_troncons_index.sql).
+    """
+    path = models.IntegerField(db_column='troncon', db_index=True, verbose_name=_(u"Path"))
+    topology = models.IntegerField(db_column='evenement', db_index=True, verbose_name=_(u"Topology"))
+    kind = models.CharField(max_length=32, db_column='kind', verbose_name=_(u"Kind"))
+
+    class Meta:
+        db_table = 'e_r_evenement_troncon_index'
+        verbose_name = _(u"Path topology index")
+        verbose_name_plural = _(u"Path topology indexes")
+
+    @classmethod
+    def topologies_by_kind(cls, paths):
+        """
+        Returns pks of existing topologies of each path grouped by kind, as
+        ``{path pk: {kind: [topology pks]}}``, with a single query.
+        """
+        rows = cls.objects.filter(path__in=[getattr(path, 'pk', path) for path in paths]) \
+                          .order_by('path', 'kind', 'topology') \
+                          .values_list('path', 'kind', 'topology').distinct()
+        result = {}
+        for path, kind, topology in rows:
+            result.setdefault(path, {}).setdefault(kind, []).append(topology)
+        return result
+
+    @classmethod
+    def path_topologies(cls, path, kind=None):
+        """ Subquery of pks of existing topologies of the path """
+        qs = cls.objects.filter(path=getattr(path, 'pk', path))
+        if kind is not None:
+            qs = qs.filter(kind=kind)
+        return qs.values('topology')
+
+
 class Topology(AddPropertyMixin, AltimetryMixin, TimeStampedModelMixin, NoDeleteMixin):
     paths = models.ManyToManyField(Path, db_column='troncons', through='PathAggregation', verbose_name=_(u"Path"))
     offset = models.FloatField(default=0.0, db_column='decallage', verbose_name=_(u"Offset"))  # in SRID units
@@ -394,6 +471,29 @@ class Topology(AddPropertyMixin, AltimetryMixin, TimeStampedModelMixin, NoDelete
         """
         return TopologyHelper.overlapping(cls, topologies)
 
+    @property
+    def stale(self):
+        """ True while the geometry is waiting to be computed again (see TopologyGeometryQueue).
+        Use ``with_stale()`` to read it along with a list of topologies.
+        """
+        if hasattr(self, 'is_stale'):
+            return self.is_stale
+        return TopologyGeometryQueue.objects.filter(topology=self.pk).exists()
+
+    @classmethod
+    def with_stale(cls, queryset):
+        """ Annotate topologies of queryset with their ``stale`` flag, in the same query.
+        """
+        queued = TopologyGeometryQueue.objects.filter(topology=OuterRef('pk'))
+        return queryset.annotate(is_stale=Exists(queued))
+
+    @classmethod
+    def overlapping_many(cls, topologies):
+        """ Return a mapping from each specified topology pk to the ordered
+        list of overlapping topologies pks, in one query.
+        """
+        return TopologyHelper.overlapping_many(cls, topologies)
+
     def mutate(self, other, delete=True):
         """
         Take alls attributes of the other topology specified and
@@ -656,7 +756,7 @@ class Trail(MapEntityMixin, Topology, StructureRelated):
 
     @classmethod
     def path_trails(cls, path):
-        return cls.objects.existing().filter(aggregations__path=path)
+        return cls.objects.existing().filter(pk__in=PathTopologyIndex.path_topologies(path, cls.KIND))
 
     def kml(self):
         """ Exports path into KML format, add geometry as linestring """
@@ -1,3 +1,17 @@
+-------------------------------------------------------------------------------
+-- Check a flag set for the current transaction (SET LOCAL geotrek.<name> = 'on')
+-------------------------------------------------------------------------------
+
+CREATE OR REPLACE FUNCTION geotrek.ft_setting_enabled(name text) RETURNS boolean AS $$
+BEGIN
+    RETURN current_setting('geotrek.' || name) = 'on';
+EXCEPTION WHEN undefined_object THEN
+    -- Never set in this session
+    RETURN false;
+END;
+$$ LANGUAGE plpgsql STABLE;
+
+
 -------------------------------------------------------------------------------
 -- Interpolate along : the opposite of ST_LocateAlong
 -------------------------------------------------------------------------------
@@ -15,6 +15,9 @@ ALTER TABLE e_t_evenement ALTER COLUMN denivelee_positive SET DEFAULT 0;
 ALTER TABLE e_t_evenement ALTER COLUMN denivelee_negative SET DEFAULT 0;
 
 
+ALTER TABLE e_t_evenement_a_recalculer ALTER COLUMN date SET DEFAULT now();
+
+
 ALTER TABLE e_t_evenement DROP CONSTRAINT IF EXISTS e_t_evenement_geom_not_empty;
 ALTER TABLE e_t_evenement ADD CONSTRAINT e_t_evenement_geom_not_empty CHECK (supprime OR (geom IS NOT NULL));
 
@@ -179,7 +182,12 @@ BEGIN
     -- Since the evenement to be modified is available in NEW, we could improve
     -- performance with some refactoring.
 
-    PERFORM update_geometry_of_evenement(NEW.id);
+    IF ft_setting_enabled('queue_evenement_geometry') THEN
+        -- Computed later by a celery task (see geotrek.core.helpers.queued_geometry)
+        INSERT INTO e_t_evenement_a_recalculer (evenement) VALUES (NEW.id);
+    ELSE
+        PERFORM update_geometry_of_evenement(NEW.id);
+    END IF;
 
     RETURN NULL;
 END;
@@ -50,6 +50,12 @@ DECLARE
     eid integer;
     eids integer[];
 BEGIN
+    -- Geometries are updated explicitly at the end of bulk operations
+    -- (see geotrek.core.helpers.deferred_geometry)
+    IF ft_setting_enabled('defer_evenement_geometry') THEN
+        RETURN NULL;
+    END IF;
+
     IF TG_OP = 'INSERT' THEN
         eids := array_append(eids, NEW.evenement);
     ELSE
@@ -61,9 +67,14 @@ BEGIN
         END IF;
     END IF;
 
-    FOREACH eid IN ARRAY eids LOOP
-        PERFORM update_geometry_of_evenement(eid);
-    END LOOP;
+    IF ft_setting_enabled('queue_evenement_geometry') THEN
+        -- Computed later by a celery task (see geotrek.core.helpers.queued_geometry)
+        INSERT INTO e_t_evenement_a_recalculer (evenement) SELECT unnest(eids);
+    ELSE
+        FOREACH eid IN ARRAY eids LOOP
+            PERFORM update_geometry_of_evenement(eid);
+        END LOOP;
+    END IF;
 
     RETURN NULL;
 END;
@@ -0,0 +1,58 @@
+-------------------------------------------------------------------------------
+-- Keep index of existing topologies by path up-to-date
+-- (see geotrek.core.models.PathTopologyIndex)
+-------------------------------------------------------------------------------
+
+CREATE OR REPLACE FUNCTION geotrek.ft_refresh_evenement_troncon_index(tid integer, eid integer) RETURNS void AS $$
+BEGIN
+    DELETE FROM e_r_evenement_troncon_index WHERE troncon = tid AND evenement = eid;
+    INSERT INTO e_r_evenement_troncon_index (troncon, evenement, kind)
+        SELECT tid, e.id, e.kind
+        FROM e_t_evenement e
+        WHERE e.id = eid AND NOT e.supprime
+          AND EXISTS (SELECT * FROM e_r_evenement_troncon et
+                      WHERE et.troncon = tid AND et.evenement = eid);
+END;
+$$ LANGUAGE plpgsql;
+
+
+DROP TRIGGER IF EXISTS e_r_evenement_troncon_index_tgr ON e_r_evenement_troncon;
+
+CREATE OR REPLACE FUNCTION geotrek.ft_evenements_troncons_index() RETURNS trigger SECURITY DEFINER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM ft_refresh_evenement_troncon_index(NEW.troncon, NEW.evenement);
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM ft_refresh_evenement_troncon_index(OLD.troncon, OLD.evenement);
+    ELSIF NEW.troncon != OLD.troncon OR NEW.evenement != OLD.evenement THEN
+        PERFORM ft_refresh_evenement_troncon_index(OLD.troncon, OLD.evenement);
+        PERFORM ft_refresh_evenement_troncon_index(NEW.troncon, NEW.evenement);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER e_r_evenement_troncon_index_tgr
+AFTER INSERT OR UPDATE OF troncon, evenement OR DELETE ON e_r_evenement_troncon
+FOR EACH ROW EXECUTE PROCEDURE ft_evenements_troncons_index();
+
+
+DROP TRIGGER IF EXISTS e_t_evenement_index_tgr ON e_t_evenement;
+
+CREATE OR REPLACE FUNCTION geotrek.ft_evenements_index() RETURNS trigger SECURITY DEFINER AS $$
+BEGIN
+    DELETE FROM e_r_evenement_troncon_index WHERE evenement = NEW.id;
+    IF NOT NEW.supprime THEN
+        INSERT INTO e_r_evenement_troncon_index (troncon, evenement, kind)
+            SELECT DISTINCT et.troncon, NEW.id, NEW.kind
+            FROM e_r_evenement_troncon et
+            WHERE et.evenement = NEW.id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER e_t_evenement_index_tgr
+AFTER UPDATE OF supprime, kind ON e_t_evenement
+FOR EACH ROW WHEN (OLD.supprime IS DISTINCT FROM NEW.supprime OR OLD.kind IS DISTINCT FROM NEW.kind)
+EXECUTE PROCEDURE ft_evenements_index();
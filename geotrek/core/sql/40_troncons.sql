@@ -96,16 +96,32 @@ DECLARE
     linear_offset float;
     side_offset float;
 BEGIN
+    -- Topologies are updated at the end of bulk edits
+    -- (see geotrek.core.helpers.bulk_path_edits)
+    IF ft_setting_enabled('defer_path_triggers') THEN
+        RETURN NULL;
+    END IF;
+
     -- Geometry of linear topologies are always updated
     -- Geometry of point topologies are updated if offset = 0
-    FOR eid IN SELECT e.id
-               FROM e_r_evenement_troncon et, e_t_evenement e
-               WHERE et.troncon = NEW.id AND et.evenement = e.id
-               GROUP BY e.id, e.decallage
-               HAVING BOOL_OR(et.pk_debut != et.pk_fin) OR e.decallage = 0.0
-    LOOP
-        PERFORM update_geometry_of_evenement(eid);
-    END LOOP;
+    IF ft_setting_enabled('queue_evenement_geometry') THEN
+        -- Computed later by a celery task (see geotrek.core.helpers.queued_geometry)
+        INSERT INTO e_t_evenement_a_recalculer (evenement)
+            SELECT e.id
+            FROM e_r_evenement_troncon et, e_t_evenement e
+            WHERE et.troncon = NEW.id AND et.evenement = e.id
+            GROUP BY e.id, e.decallage
+            HAVING BOOL_OR(et.pk_debut != et.pk_fin) OR e.decallage = 0.0;
+    ELSE
+        FOR eid IN SELECT e.id
+                   FROM e_r_evenement_troncon et, e_t_evenement e
+                   WHERE et.troncon = NEW.id AND et.evenement = e.id
+                   GROUP BY e.id, e.decallage
+                   HAVING BOOL_OR(et.pk_debut != et.pk_fin) OR e.decallage = 0.0
+        LOOP
+            PERFORM update_geometry_of_evenement(eid);
+        END LOOP;
+    END IF;
 
     -- Special case of point geometries with offset != 0
     FOR eid, egeom IN SELECT e.id, e.geom
@@ -217,3 +233,30 @@ $$ LANGUAGE plpgsql;
 CREATE TRIGGER l_t_troncon_latest_updated_d_tgr
 AFTER DELETE ON l_t_troncon
 FOR EACH ROW EXECUTE PROCEDURE troncon_latest_updated_d();
+
+
+-------------------------------------------------------------------------------
+-- Journal network changes (used to version and patch the path graph)
+-- Changes are read by transaction id, as they are not committed in order
+-------------------------------------------------------------------------------
+
+ALTER TABLE l_t_troncon_journal ALTER COLUMN date SET DEFAULT now();
+ALTER TABLE l_t_troncon_journal ALTER COLUMN txid SET DEFAULT txid_current();
+
+DROP TRIGGER IF EXISTS l_t_troncon_journal_iud_tgr ON l_t_troncon;
+
+CREATE OR REPLACE FUNCTION geotrek.troncon_journal_iud() RETURNS trigger SECURITY DEFINER AS $$
+DECLARE
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        INSERT INTO l_t_troncon_journal (troncon) VALUES (OLD.id);
+    ELSE
+        INSERT INTO l_t_troncon_journal (troncon) VALUES (NEW.id);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER l_t_troncon_journal_iud_tgr
+AFTER INSERT OR UPDATE OF geom, visible, brouillon OR DELETE ON l_t_troncon
+FOR EACH ROW EXECUTE PROCEDURE troncon_journal_iud();
@@ -1,6 +1,6 @@
 DROP TRIGGER IF EXISTS l_t_troncon_00_snap_geom_iu_tgr ON l_t_troncon;
 
-CREATE OR REPLACE FUNCTION geotrek.troncons_snap_extremities() RETURNS trigger SECURITY DEFINER AS $$
+CREATE OR REPLACE FUNCTION geotrek.ft_troncon_snapped_geometry(pid integer, line geometry) RETURNS geometry AS $$
 DECLARE
     linestart geometry;
     lineend geometry;
@@ -14,14 +14,14 @@ DECLARE
 BEGIN
     DISTANCE := {{PATH_SNAPPING_DISTANCE}};
 
-    linestart := ST_StartPoint(NEW.geom);
-    lineend := ST_EndPoint(NEW.geom);
+    linestart := ST_StartPoint(line);
+    lineend := ST_EndPoint(line);
 
     closest := NULL;
     SELECT ST_ClosestPoint(geom, linestart), geom INTO closest, other
       FROM l_t_troncon
-      WHERE geom && ST_Buffer(NEW.geom, DISTANCE * 2)
-        AND id != NEW.id
+      WHERE geom && ST_Buffer(line, DISTANCE * 2)
+        AND id != pid
         AND ST_Distance(geom, linestart) < DISTANCE
       ORDER BY ST_Distance(geom, linestart)
       LIMIT 1;
@@ -43,16 +43,16 @@ BEGIN
     END IF;
     newline := array_append(newline, result);
 
-    FOR i IN 2..ST_NPoints(NEW.geom)-1 LOOP
-        newline := array_append(newline, ST_PointN(NEW.geom, i));
+    FOR i IN 2..ST_NPoints(line)-1 LOOP
+        newline := array_append(newline, ST_PointN(line, i));
     END LOOP;
 
     closest := NULL;
     SELECT ST_ClosestPoint(geom, lineend), geom INTO closest, other
 
       FROM l_t_troncon
-      WHERE geom && ST_Buffer(NEW.geom, DISTANCE * 2)
-        AND id != NEW.id
+      WHERE geom && ST_Buffer(line, DISTANCE * 2)
+        AND id != pid
         AND ST_Distance(geom, lineend) < DISTANCE
       ORDER BY ST_Distance(geom, lineend)
       LIMIT 1;
@@ -74,7 +74,19 @@ BEGIN
     newline := array_append(newline, result);
 
     RAISE NOTICE 'New geom %', ST_AsText(ST_MakeLine(newline));
-    NEW.geom := ST_MakeLine(newline);
+    RETURN ST_MakeLine(newline);
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION geotrek.troncons_snap_extremities() RETURNS trigger SECURITY DEFINER AS $$
+BEGIN
+    -- Extremities are snapped at the end of bulk edits
+    -- (see geotrek.core.helpers.bulk_path_edits)
+    IF ft_setting_enabled('defer_path_triggers') THEN
+        RETURN NEW;
+    END IF;
+
+    NEW.geom := ft_troncon_snapped_geometry(NEW.id, NEW.geom);
     RETURN NEW;
 END;
 $$ LANGUAGE plpgsql;
@@ -108,6 +120,11 @@ DECLARE
     intersections_on_new float8[];
     intersections_on_current float8[];
 BEGIN
+    -- Paths are split at the end of bulk edits
+    -- (see geotrek.core.helpers.bulk_path_edits)
+    IF ft_setting_enabled('defer_path_triggers') THEN
+        RETURN NULL;
+    END IF;
 
     -- Copy original geometry
     newgeom := NEW.geom;
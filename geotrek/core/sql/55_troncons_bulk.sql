@@ -0,0 +1,216 @@
+-------------------------------------------------------------------------------
+-- Split a path at the specified fractions (sorted, in ]0, 1[)
+-- First segment is kept by the path itself, others are created as clones.
+-- Topologies are distributed among segments like in the split trigger.
+-------------------------------------------------------------------------------
+
+CREATE OR REPLACE FUNCTION geotrek.ft_split_troncon(pid integer, fractions float8[]) RETURNS integer[] AS $$
+DECLARE
+    troncon record;
+    bounds float8[];
+    fraction float8;
+    a float8;
+    b float8;
+    segment geometry;
+    tid_clone integer;
+    clones integer[];
+BEGIN
+    clones := ARRAY[]::integer[];
+    SELECT * INTO troncon FROM l_t_troncon WHERE id = pid;
+
+    -- Skip segments shorter than 1 meter, like the split trigger does
+    bounds := ARRAY[0::float8];
+    FOREACH fraction IN ARRAY fractions || 1::float8 LOOP
+        IF ST_Length(ST_LineSubstring(troncon.geom, bounds[array_length(bounds, 1)], fraction)) >= 1 THEN
+            bounds := array_append(bounds, fraction);
+        END IF;
+    END LOOP;
+    bounds[array_length(bounds, 1)] := 1;
+
+    IF array_length(bounds, 1) <= 2 THEN
+        RETURN clones;
+    END IF;
+
+    FOR i IN 2..(array_length(bounds, 1) - 1)
+    LOOP
+        a := bounds[i];
+        b := bounds[i+1];
+        segment := ST_LineSubstring(troncon.geom, a, b);
+
+        RAISE NOTICE 'Bulk: Create clone of %-% with geom %', troncon.id, troncon.nom, ST_AsText(segment);
+        INSERT INTO l_t_troncon (structure,
+                                 visible,
+                                 valide,
+                                 nom,
+                                 remarques,
+                                 source,
+                                 enjeu,
+                                 geom_cadastre,
+                                 depart,
+                                 arrivee,
+                                 confort,
+                                 id_externe,
+                                 geom,
+                                 brouillon)
+            VALUES (troncon.structure,
+                    troncon.visible,
+                    troncon.valide,
+                    troncon.nom,
+                    troncon.remarques,
+                    troncon.source,
+                    troncon.enjeu,
+                    troncon.geom_cadastre,
+                    troncon.depart,
+                    troncon.arrivee,
+                    troncon.confort,
+                    troncon.id_externe,
+                    segment,
+                    troncon.brouillon)
+            RETURNING id INTO tid_clone;
+        clones := array_append(clones, tid_clone);
+
+        -- Copy N-N relations
+        INSERT INTO l_r_troncon_reseau (path_id, network_id)
+            SELECT tid_clone, tr.network_id
+            FROM l_r_troncon_reseau tr
+            WHERE tr.path_id = troncon.id;
+        INSERT INTO l_r_troncon_usage (path_id, usage_id)
+            SELECT tid_clone, tr.usage_id
+            FROM l_r_troncon_usage tr
+            WHERE tr.path_id = troncon.id;
+
+        -- Copy topologies overlapping the segment, and points at its start
+        INSERT INTO e_r_evenement_troncon (troncon, evenement, pk_debut, pk_fin, ordre)
+            SELECT
+                tid_clone,
+                et.evenement,
+                CASE WHEN pk_debut <= pk_fin THEN
+                    (greatest(a, pk_debut) - a) / (b - a)
+                ELSE
+                    (least(b, pk_debut) - a) / (b - a)
+                END,
+                CASE WHEN pk_debut <= pk_fin THEN
+                    (least(b, pk_fin) - a) / (b - a)
+                ELSE
+                    (greatest(a, pk_fin) - a) / (b - a)
+                END,
+                et.ordre
+            FROM e_r_evenement_troncon et,
+                 e_t_evenement e
+            WHERE et.evenement = e.id
+                  AND et.troncon = troncon.id
+                  AND ((least(pk_debut, pk_fin) < b AND greatest(pk_debut, pk_fin) > a) OR
+                       (pk_debut = pk_fin AND pk_debut = a AND decallage = 0));
+
+        -- Special case : point topology at the end of path
+        IF b = 1 THEN
+            INSERT INTO e_r_evenement_troncon (troncon, evenement, pk_debut, pk_fin)
+                SELECT tid_clone, evenement, pk_debut, pk_fin
+                FROM e_r_evenement_troncon et,
+                     e_t_evenement e
+                WHERE et.evenement = e.id
+                      AND et.troncon = troncon.id
+                      AND pk_debut = pk_fin
+                      AND pk_debut = 1
+                      AND decallage = 0;
+        END IF;
+    END LOOP;
+
+    -- Now handle first segment topologies, and shrink the path
+    b := bounds[2];
+    DELETE FROM e_r_evenement_troncon et WHERE et.troncon = troncon.id
+                                         AND least(pk_debut, pk_fin) > b;
+    UPDATE e_r_evenement_troncon et SET
+        pk_debut = least(pk_debut / b, 1),
+        pk_fin = least(pk_fin / b, 1)
+        WHERE et.troncon = troncon.id;
+
+    RAISE NOTICE 'Bulk: Skrink %-% (%) to [0 ; %]', troncon.id, troncon.nom, ST_AsText(troncon.geom), b;
+    UPDATE l_t_troncon SET geom = ST_LineSubstring(troncon.geom, 0, b) WHERE id = troncon.id;
+
+    RETURN clones;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-------------------------------------------------------------------------------
+-- End of bulk edits of the path network (see geotrek.core.helpers.bulk_path_edits)
+-- Paths journaled after ``since`` are snapped and split in set-based passes,
+-- then geometries of related topologies are computed once.
+-------------------------------------------------------------------------------
+
+CREATE OR REPLACE FUNCTION geotrek.ft_troncons_bulk_edits_end(since integer) RETURNS integer AS $$
+DECLARE
+    touched integer[];
+    affected integer[];
+    split record;
+    eid integer;
+    egeom geometry;
+    tid integer;
+    tgeom geometry;
+    linear_offset float;
+    side_offset float;
+BEGIN
+    SELECT array_agg(DISTINCT t.id) INTO touched
+      FROM l_t_troncon_journal j, l_t_troncon t
+     WHERE j.id > since AND j.troncon = t.id;
+
+    IF touched IS NULL THEN
+        RETURN 0;
+    END IF;
+
+    -- 1. Snap extremities of touched paths
+    UPDATE l_t_troncon t SET geom = snapped.geom
+      FROM (SELECT id, ft_troncon_snapped_geometry(id, geom) AS geom
+              FROM l_t_troncon
+             WHERE id = ANY(touched)) AS snapped
+     WHERE t.id = snapped.id AND NOT ST_Equals(t.geom, snapped.geom);
+
+    -- 2. Split touched paths, and paths they cross, at every crossing
+    affected := touched;
+    FOR split IN WITH crossings AS (SELECT t.id AS touched_id, t.geom AS touched_geom,
+                                           p.id AS crossed_id, p.geom AS crossed_geom,
+                                           (ST_Dump(ST_Intersection(t.geom, p.geom))).geom AS point
+                                      FROM l_t_troncon t, l_t_troncon p
+                                     WHERE t.id = ANY(touched)
+                                       AND p.id != t.id
+                                       AND t.brouillon = FALSE
+                                       AND p.brouillon = FALSE
+                                       AND ST_DWithin(t.geom, p.geom, 0)
+                                       AND GeometryType(ST_Intersection(t.geom, p.geom)) NOT IN ('LINESTRING', 'MULTILINESTRING')),
+                      fractions AS (SELECT touched_id AS id, ST_LineLocatePoint(touched_geom, point) AS fraction
+                                      FROM crossings
+                                     WHERE GeometryType(point) = 'POINT'
+                                    UNION
+                                    SELECT crossed_id AS id, ST_LineLocatePoint(crossed_geom, point) AS fraction
+                                      FROM crossings
+                                     WHERE GeometryType(point) = 'POINT')
+                 SELECT id, array_agg(fraction ORDER BY fraction) AS fractions
+                   FROM fractions
+                  WHERE fraction > 0 AND fraction < 1
+                  GROUP BY id
+    LOOP
+        affected := array_append(affected, split.id) || ft_split_troncon(split.id, split.fractions);
+    END LOOP;
+
+    -- 3. Update topologies of affected paths
+    -- Point topologies with offset != 0 keep their geometry: re-locate them on their path
+    FOR eid, egeom, tid, tgeom IN SELECT e.id, e.geom, t.id, t.geom
+               FROM e_r_evenement_troncon et, e_t_evenement e, l_t_troncon t
+               WHERE et.troncon = ANY(affected) AND et.evenement = e.id AND et.troncon = t.id
+                 AND et.pk_debut = et.pk_fin AND e.decallage != 0.0
+                 AND NOT EXISTS (SELECT * FROM e_r_evenement_troncon other
+                                 WHERE other.evenement = e.id AND other.id != et.id)
+    LOOP
+        SELECT * INTO linear_offset, side_offset FROM ST_InterpolateAlong(tgeom, egeom) AS (position float, distance float);
+        UPDATE e_r_evenement_troncon SET pk_debut = linear_offset, pk_fin = linear_offset WHERE evenement = eid AND troncon = tid;
+        UPDATE e_t_evenement SET decallage = side_offset WHERE id = eid;
+    END LOOP;
+
+    -- Then compute every geometry once
+    PERFORM update_geometry_of_evenement(e.evenement)
+       FROM (SELECT DISTINCT evenement FROM e_r_evenement_troncon WHERE troncon = ANY(affected)) AS e;
+
+    RETURN (SELECT COUNT(DISTINCT pid) FROM unnest(affected) AS pid);
+END;
+$$ LANGUAGE plpgsql;
@@ -176,3 +176,70 @@ BEGIN
 
 END;
 $$ LANGUAGE plpgsql;
+
+
+-------------------------------------------------------------------------------
+-- Merge chains of paths at once (see merge_segmented_paths command)
+-- Paths of each chain are given with their rank and direction in the chain,
+-- and the path they are merged into (keeper). Topologies are moved to keepers.
+-------------------------------------------------------------------------------
+
+CREATE OR REPLACE FUNCTION geotrek.ft_merge_path_chains(paths integer[], keepers integer[], ranks integer[], reversed boolean[])
+  RETURNS integer AS $$
+DECLARE
+    merged integer[];
+BEGIN
+    DROP TABLE IF EXISTS merge_steps;
+    CREATE TEMPORARY TABLE merge_steps ON COMMIT DROP AS
+        WITH plan AS (SELECT unnest(paths) AS path, unnest(keepers) AS keeper,
+                             unnest(ranks) AS rank, unnest(reversed) AS reversed)
+        SELECT plan.path, plan.keeper, plan.rank, plan.reversed, t.geom,
+               ST_Length(t.geom) AS length,
+               SUM(ST_Length(t.geom)) OVER (PARTITION BY plan.keeper ORDER BY plan.rank) - ST_Length(t.geom) AS start,
+               SUM(ST_Length(t.geom)) OVER (PARTITION BY plan.keeper) AS total
+        FROM plan, l_t_troncon t
+        WHERE t.id = plan.path;
+
+    -- Point topologies at inner nodes of chains are kept on one path only
+    DELETE FROM e_r_evenement_troncon et
+     USING merge_steps s
+     WHERE et.troncon = s.path AND et.pk_debut = et.pk_fin
+       AND NOT EXISTS (SELECT * FROM e_r_evenement_troncon line
+                       WHERE line.evenement = et.evenement AND line.pk_debut != line.pk_fin)
+       AND EXISTS (SELECT * FROM e_r_evenement_troncon other, merge_steps os
+                   WHERE other.evenement = et.evenement AND other.troncon = os.path
+                     AND os.keeper = s.keeper AND other.id < et.id);
+
+    -- Point topologies on reversed paths change side
+    UPDATE e_t_evenement e SET decallage = -decallage
+      FROM e_r_evenement_troncon et, merge_steps s
+     WHERE et.evenement = e.id AND et.troncon = s.path AND s.reversed
+       AND et.pk_debut = et.pk_fin AND e.decallage != 0
+       AND NOT EXISTS (SELECT * FROM e_r_evenement_troncon other
+                       WHERE other.evenement = e.id AND other.id != et.id);
+
+    -- Move topologies to keepers
+    UPDATE e_r_evenement_troncon et
+       SET troncon = s.keeper,
+           pk_debut = (s.start + s.length * CASE WHEN s.reversed THEN 1 - et.pk_debut ELSE et.pk_debut END) / s.total,
+           pk_fin = (s.start + s.length * CASE WHEN s.reversed THEN 1 - et.pk_fin ELSE et.pk_fin END) / s.total
+      FROM merge_steps s
+     WHERE et.troncon = s.path;
+
+    -- Delete merged paths, and rebuild geometry of keepers
+    SELECT array_agg(path) INTO merged FROM merge_steps WHERE path != keeper;
+    DELETE FROM l_r_troncon_reseau WHERE path_id = ANY(merged);
+    DELETE FROM l_r_troncon_usage WHERE path_id = ANY(merged);
+    DELETE FROM l_t_troncon WHERE id = ANY(merged);
+
+    UPDATE l_t_troncon t SET geom = chains.geom
+      FROM (SELECT keeper,
+                   ST_MakeLine(array_agg(CASE WHEN reversed THEN ST_Reverse(geom) ELSE geom END ORDER BY rank)) AS geom
+              FROM merge_steps
+             GROUP BY keeper) AS chains
+     WHERE t.id = chains.keeper;
+
+    DROP TABLE merge_steps;
+    RETURN coalesce(array_length(merged, 1), 0);
+END;
+$$ LANGUAGE plpgsql;
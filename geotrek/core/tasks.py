@@ -0,0 +1,41 @@
+# -*- encoding: UTF-8 -
+
+from celery import shared_task, current_task
+from django.db import connection, transaction
+
+
+@shared_task(name='geotrek.core.update-topologies-geometry')
+def update_topologies_geometry(batch_size=100):
+    """
+    celery shared task - compute geometries of queued topologies, by batches
+    """
+    from geotrek.core.models import Topology, TopologyGeometryQueue
+
+    count = 0
+    while True:
+        with transaction.atomic():
+            batch = list(TopologyGeometryQueue.objects.order_by('pk').values_list('pk', 'topology')[:batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1][0]
+            topology_pks = list(set(topology for pk, topology in batch))
+            cursor = connection.cursor()
+            cursor.execute("SELECT update_geometry_of_evenement(id) FROM %s WHERE id = ANY(%%s)"
+                           % Topology._meta.db_table, [topology_pks])
+            # Topologies queued again meanwhile stay in queue
+            TopologyGeometryQueue.objects.filter(pk__lte=last_pk, topology__in=topology_pks).delete()
+        count += len(topology_pks)
+        if current_task.request.id:
+            current_task.update_state(
+                state='PROGRESS',
+                meta={
+                    'name': current_task.name,
+                    'current': count,
+                    'total': count + TopologyGeometryQueue.pending(),
+                }
+            )
+
+    return {
+        'name': current_task.name,
+        'count': count,
+    }
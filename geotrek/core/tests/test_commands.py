@@ -7,6 +7,7 @@ from django.test import TestCase, override_settings
 from django.db import IntegrityError
 
 from geotrek.authent.models import Structure
+from geotrek.core.factories import TopologyFactory
 from geotrek.core.models import Path
 from geotrek.trekking.factories import POIFactory
 import os
@@ -101,6 +102,38 @@ class RemoveDuplicatePathTest(TestCase):
         self.assertIn("duplicate paths have been deleted",
                       output.getvalue())
 
+    def test_remove_duplicate_path_dry(self):
+        output = StringIO()
+        call_command('remove_duplicate_paths', dry=True, verbosity=2, stdout=output)
+        self.assertEquals(Path.objects.count(), 9)
+        self.assertIn("Path %s is a duplicate of path %s" % (self.p2.pk, self.p1.pk), output.getvalue())
+        self.assertIn("4 duplicate paths will be deleted", output.getvalue())
+
+    def test_remove_duplicate_path_by_chunks(self):
+        output = StringIO()
+        call_command('remove_duplicate_paths', chunk_size=2, verbosity=2, stdout=output)
+        self.assertItemsEqual((self.p1, self.p3, self.p5, self.p6, self.p8),
+                              list(Path.objects.all()))
+        self.assertIn("Compared 2/9 paths", output.getvalue())
+        self.assertIn("Compared 9/9 paths", output.getvalue())
+
+    def test_remove_near_duplicate_path(self):
+        """
+        With a tolerance, p5 (reversed) and p10 (almost the same) are duplicates of p3.
+        Their topologies are moved to p3.
+        """
+        self.p10 = Path.objects.create(name='Tenth Path', geom=LineString((0, 2.05), (1, 2.05), (2, 2)))
+        poi5 = POIFactory.create(name='POI5', no_path=True)
+        poi5.add_path(self.p5, start=0.25, end=0.25)
+        output = StringIO()
+        call_command('remove_duplicate_paths', tolerance=0.1, verbosity=2, stdout=output)
+        self.assertItemsEqual((self.p1, self.p3, self.p6, self.p8),
+                              list(Path.objects.all()))
+        aggregation = poi5.aggregations.get()
+        self.assertEqual(aggregation.path, self.p3)
+        self.assertAlmostEqual(aggregation.start_position, 0.75)
+        self.assertIn("6 duplicate paths have been deleted", output.getvalue())
+
 
 class LoadPathsCommandTest(TestCase):
     def setUp(self):
@@ -197,6 +230,14 @@ class LoadPathsCommandTest(TestCase):
         self.assertIn('2 objects will be create, 0 objects failed;', output.getvalue())
         self.assertEqual(Path.objects.count(), 0)
 
+    @override_settings(SRID=4326, SPATIAL_EXTENT=(-1, 0, 4, 2))
+    def test_load_paths_bulk(self):
+        output = StringIO()
+        call_command('loadpaths', self.filename, '-i', bulk=True, verbosity=2, stdout=output)
+        self.assertIn('2 objects created, 0 objects failed', output.getvalue())
+        self.assertIn('Paths loaded in', output.getvalue())
+        self.assertEqual(Path.objects.count(), 2)
+
     @override_settings(SRID=4326, SPATIAL_EXTENT=(-1, 0, 4, 2))
     def test_load_paths_fail_with_dry(self):
         filename = os.path.join(os.path.dirname(__file__), 'data', 'bad_path.geojson')
@@ -211,3 +252,51 @@ class LoadPathsCommandTest(TestCase):
         output = StringIO()
         with self.assertRaises(IntegrityError):
             call_command('loadpaths', filename, '-i', verbosity=2, stdout=output)
+
+
+class MergeSegmentedPathsCommandTest(TestCase):
+    def setUp(self):
+        self.ab = Path.objects.create(name='Road', geom=LineString((0, 0), (10, 0)))
+        self.cb = Path.objects.create(name='Road', geom=LineString((20, 0), (10, 0)))
+        self.cd = Path.objects.create(name='Road', geom=LineString((20, 0), (30, 0)))
+        self.de = Path.objects.create(name='Road', geom=LineString((30, 0), (30, 10)))
+        self.df = Path.objects.create(name='Road', geom=LineString((30, 0), (40, 0)))
+        self.gh = Path.objects.create(name='Road', geom=LineString((0, 20), (10, 20)))
+        self.hi = Path.objects.create(name='Track', geom=LineString((10, 20), (20, 20)))
+
+    def test_chain_is_merged_into_first_path(self):
+        output = StringIO()
+        call_command('merge_segmented_paths', stdout=output)
+        self.assertIn("2 nodes and 2 paths removed", output.getvalue())
+        self.assertItemsEqual((self.ab, self.de, self.df, self.gh, self.hi), list(Path.objects.all()))
+        self.ab.reload()
+        self.assertEqual(self.ab.geom.coords, ((0, 0), (10, 0), (20, 0), (30, 0)))
+
+    def test_topologies_are_moved(self):
+        poi = POIFactory.create(no_path=True, offset=2)
+        poi.add_path(self.cb, start=0.25, end=0.25)
+        line = TopologyFactory.create(no_path=True)
+        line.add_path(self.ab, start=0.5, end=1, order=0, reload=False)
+        line.add_path(self.cb, start=1, end=0, order=1, reload=False)
+        line.add_path(self.cd, start=0, end=0.5, order=2)
+        poi_geom = poi.geom
+        call_command('merge_segmented_paths', verbosity=0)
+        poi.reload()
+        aggregation = poi.aggregations.get()
+        self.assertEqual(aggregation.path, self.ab)
+        self.assertAlmostEqual(aggregation.start_position, 17.5 / 30)
+        self.assertAlmostEqual(poi.offset, -2)
+        self.assertTrue(poi.geom.equals_exact(poi_geom, 0.01))
+        line.reload()
+        self.assertEqual(list(line.paths.all()), [self.ab] * 3)
+        self.assertAlmostEqual(line.geom.length, 20)
+        self.assertEqual(line.geom.coords[0], (5, 0))
+        self.assertEqual(line.geom.coords[-1], (25, 0))
+
+    def test_dry(self):
+        output = StringIO()
+        call_command('merge_segmented_paths', dry=True, stdout=output)
+        self.assertIn("Paths {}, {} will be merged into path {}".format(self.cb.pk, self.cd.pk, self.ab.pk),
+                      output.getvalue())
+        self.assertIn("2 nodes and 2 paths will be removed", output.getvalue())
+        self.assertEqual(Path.objects.count(), 7)
@@ -1,13 +1,20 @@
 import json
+import threading
+from datetime import timedelta
 
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.contrib.auth.models import User
 from django.contrib.gis.geos import LineString
+from django.core.cache import caches
+from django.core.management import call_command
 from django.core.urlresolvers import reverse
+from django.db import connection, transaction
+from django.utils import timezone
 
 from geotrek.core.factories import PathFactory
-from geotrek.core.graph import graph_edges_nodes_of_qs
-from geotrek.core.models import Path
+from geotrek.core.graph import (graph_edges_nodes_of_qs, serialize_route, RoutingGraph, GraphState,
+                                get_graph_state, graph_version)
+from geotrek.core.models import Path, Topology, PathGraphLog
 
 
 class SimpleGraph(TestCase):
@@ -70,6 +77,24 @@ class SimpleGraph(TestCase):
         self.assertDictEqual({'edges': {str(path.pk): {u'id': path.pk, u'length': 1.4142135623731, u'nodes_id': [1, 2]}},
                               'nodes': {u'1': {u'2': path.pk}, u'2': {u'1': path.pk}}}, graph)
 
+    def test_json_graph_compact(self):
+        path_1 = PathFactory(geom=LineString((0, 0), (1, 1)))
+        path_2 = PathFactory(geom=LineString((1, 1), (2, 0)))
+        response = self.client.get(self.url, {'format': 'compact'})
+        self.assertEqual(response.status_code, 200)
+        graph = json.loads(response.content)
+        self.assertEqual(sorted(graph.keys()), ['end', 'id', 'length', 'start'])
+        edges = dict((pk, (start, end)) for pk, start, end in zip(graph['id'], graph['start'], graph['end']))
+        self.assertEqual(len(set(graph['start'] + graph['end'])), 3)
+        self.assertEqual(edges[path_1.pk][1], edges[path_2.pk][0])
+
+    def test_graph_nodes_snapped_to_grid(self):
+        path_1 = PathFactory(geom=LineString((0, 0), (10, 10)))
+        path_2 = PathFactory(geom=LineString((10.0001, 10.0001), (20, 0)))
+        graph = graph_edges_nodes_of_qs(Path.objects.order_by('id'))
+        self.assertEqual(graph['edges'][path_1.pk]['nodes_id'][1],
+                         graph['edges'][path_2.pk]['nodes_id'][0])
+
     def test_json_graph_headers(self):
         """
         Last modified depends on
@@ -77,3 +102,208 @@ class SimpleGraph(TestCase):
         PathFactory(geom=LineString((0, 0), (1, 1)))
         response = self.client.get(self.url)
         self.assertNotEqual(response['Cache-Control'], None)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+                           'fat': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class GraphDeltaTest(TransactionTestCase):
+    """Graph versions are transaction ids: test data has to be committed"""
+    def setUp(self):
+        caches['fat'].clear()
+        user = User.objects.create_user('homer', 'h@s.com', 'dooh')
+        success = self.client.login(username=user.username, password='dooh')
+        self.assertTrue(success)
+        self.path_1 = PathFactory(geom=LineString((0, 0), (10, 0)))
+        self.path_2 = PathFactory(geom=LineString((10, 0), (20, 0)))
+        response = self.client.get(reverse('core:path_json_graph'))
+        self.graph = json.loads(response.content)
+        self.version = int(response['X-Graph-Version'])
+
+    def get_delta(self, since):
+        return self.client.get(reverse('core:path_json_graph_delta'), {'since': since})
+
+    def test_delta_is_empty_when_nothing_changed(self):
+        response = self.get_delta(self.version)
+        self.assertEqual(response.status_code, 200)
+        self.assertDictEqual(json.loads(response.content), {'version': self.version, 'edges': {}, 'nodes': {}})
+
+    def test_delta_of_added_path(self):
+        path_3 = PathFactory(geom=LineString((20, 0), (20, 10)))
+        delta = json.loads(self.get_delta(self.version).content)
+        self.assertTrue(delta['version'] > self.version)
+        self.assertEqual(delta['edges'].keys(), [str(path_3.pk)])
+        start, end = delta['edges'][str(path_3.pk)]['nodes_id']
+        # Existing node numbering is kept
+        self.assertEqual(start, self.graph['edges'][str(self.path_2.pk)]['nodes_id'][1])
+        self.assertEqual(sorted(delta['nodes'].keys()), sorted([str(start), str(end)]))
+        self.assertEqual(delta['nodes'][str(end)], {str(start): path_3.pk})
+
+    def test_delta_of_removed_path(self):
+        start, end = self.graph['edges'][str(self.path_2.pk)]['nodes_id']
+        self.path_2.delete()
+        delta = json.loads(self.get_delta(self.version).content)
+        self.assertEqual(delta['edges'], {str(self.path_2.pk): None})
+        self.assertEqual(delta['nodes'][str(end)], None)
+        self.assertEqual(delta['nodes'][str(start)], {str(self.graph['edges'][str(self.path_1.pk)]['nodes_id'][0]): self.path_1.pk})
+
+    def test_delta_invalid_version(self):
+        self.assertEqual(self.get_delta('abc').status_code, 400)
+        self.assertEqual(self.get_delta(self.version + 1000).status_code, 400)
+
+    def test_delta_too_old_version(self):
+        state = get_graph_state()
+        state.base_version = self.version + 1
+        caches['fat'].set('path_graph_state', state)
+        self.assertEqual(self.get_delta(self.version).status_code, 410)
+
+    def test_journal_is_pruned(self):
+        PathFactory(geom=LineString((20, 0), (20, 10)))
+        state = get_graph_state()
+        PathGraphLog.objects.update(date=timezone.now() - timedelta(days=2))
+        path_4 = PathFactory(geom=LineString((20, 10), (30, 10)))
+        call_command('prune_graph_journal', verbosity=0)
+        self.assertFalse(PathGraphLog.objects.filter(txid__lt=state.version).exists())
+        self.assertTrue(PathGraphLog.objects.filter(path=path_4.pk).exists())
+        delta = json.loads(self.get_delta(state.version).content)
+        self.assertEqual(delta['edges'].keys(), [str(path_4.pk)])
+
+    def test_recent_journal_is_kept(self):
+        PathFactory(geom=LineString((20, 0), (20, 10)))
+        get_graph_state()
+        call_command('prune_graph_journal', verbosity=0)
+        self.assertTrue(PathGraphLog.objects.exists())
+
+    def test_state_history_is_bounded(self):
+        state = GraphState(self.version)
+        state.history = 1
+        PathFactory(geom=LineString((20, 0), (20, 10)))
+        version_1 = graph_version()
+        state.update(Path.objects.all(), version_1)
+        PathFactory(geom=LineString((20, 10), (30, 10)))
+        state.update(Path.objects.all(), graph_version())
+        self.assertIsNone(state.delta(self.version))
+        self.assertIsNotNone(state.delta(version_1))
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+                           'fat': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class GraphVersionTest(TransactionTestCase):
+    def setUp(self):
+        caches['fat'].clear()
+        self.path_1 = PathFactory(geom=LineString((0, 0), (10, 0)))
+        self.path_2 = PathFactory(geom=LineString((0, 10), (10, 10)))
+        self.state = get_graph_state()
+        self.nodes_1 = self.state.edges[self.path_1.pk]['nodes_id']
+        self.nodes_2 = self.state.edges[self.path_2.pk]['nodes_id']
+
+    def reverse_path(self, path, changed=None, commit=None):
+        try:
+            with transaction.atomic():
+                connection.cursor().execute("UPDATE l_t_troncon SET geom = ST_Reverse(geom) WHERE id = %s", [path.pk])
+                if changed:
+                    changed.set()
+                    commit.wait(10)
+        finally:
+            connection.close()
+
+    def test_changes_committed_out_of_order(self):
+        changed, commit = threading.Event(), threading.Event()
+        first = threading.Thread(target=self.reverse_path, args=(self.path_1, changed, commit))
+        first.start()
+        changed.wait(10)
+        # Second change is committed first, without waiting for the first one
+        second = threading.Thread(target=self.reverse_path, args=(self.path_2, ))
+        second.start()
+        second.join(10)
+        self.assertFalse(second.is_alive())
+        state = get_graph_state()
+        self.assertEqual(state.edges[self.path_1.pk]['nodes_id'], self.nodes_1)
+        commit.set()
+        first.join(10)
+        state = get_graph_state()
+        self.assertGreater(state.version, self.state.version)
+        self.assertEqual(state.edges[self.path_1.pk]['nodes_id'], self.nodes_1[::-1])
+        self.assertEqual(state.edges[self.path_2.pk]['nodes_id'], self.nodes_2[::-1])
+        delta = state.delta(self.state.version)
+        self.assertEqual(sorted(delta['edges'].keys()), sorted([self.path_1.pk, self.path_2.pk]))
+
+
+class RoutingGraphTest(TestCase):
+    def setUp(self):
+        # 1 --(10, len 1)-- 2 --(11, len 1)-- 3
+        #  \________________(12, len 5)______/
+        self.graph = RoutingGraph({
+            'nodes': {},
+            'edges': {
+                10: {'id': 10, 'length': 1.0, 'nodes_id': [1, 2]},
+                11: {'id': 11, 'length': 1.0, 'nodes_id': [2, 3]},
+                12: {'id': 12, 'length': 5.0, 'nodes_id': [3, 1]},
+                13: {'id': 13, 'length': 1.0, 'nodes_id': [4, 5]},
+            }
+        })
+
+    def test_adjacency_keeps_all_edges(self):
+        self.assertEqual(sorted(self.graph.adjacent(1)), [(2, 10, 1.0), (3, 12, 5.0)])
+        self.assertEqual(sorted(self.graph.adjacent(2)), [(1, 10, 1.0), (3, 11, 1.0)])
+
+    def test_shortest_path_between_nodes(self):
+        cost, source, target, steps = self.graph.shortest_path({1: 0.0}, {3: 0.0})
+        self.assertEqual(cost, 2.0)
+        self.assertEqual((source, target), (1, 3))
+        self.assertEqual(steps, [(10, 1, 2), (11, 2, 3)])
+
+    def test_route_along_same_edge(self):
+        self.assertEqual(self.graph.route((12, 0.2), (12, 0.8)), [(12, 0.2, 0.8)])
+
+    def test_route_between_edges(self):
+        route = self.graph.route((12, 0.9), (11, 0.5))
+        self.assertEqual(route, [(12, 0.9, 1.0), (10, 0.0, 1.0), (11, 0.0, 0.5)])
+
+    def test_route_reversed_edges(self):
+        route = self.graph.route((11, 0.5), (10, 0.5))
+        self.assertEqual(route, [(11, 0.5, 0.0), (10, 1.0, 0.5)])
+
+    def test_route_skips_waypoint_on_node(self):
+        route = self.graph.route((10, 1.0), (11, 0.5))
+        self.assertEqual(route, [(11, 0.0, 0.5)])
+
+    def test_no_route_between_disconnected_edges(self):
+        self.assertIsNone(self.graph.route((10, 0.5), (13, 0.5)))
+        self.assertIsNone(self.graph.route_waypoints([(10, 0.5), (11, 0.5), (13, 0.5)]))
+
+    def test_serialize_route(self):
+        legs = self.graph.route_waypoints([(12, 0.9), (10, 0.5), (11, 0.5)])
+        self.assertEqual(serialize_route(legs), [
+            {'offset': 0, 'paths': [12, 10], 'positions': {'0': (0.9, 1.0), '1': (0.0, 0.5)}},
+            {'offset': 0, 'paths': [10, 11], 'positions': {'0': (0.5, 1.0), '1': (0.0, 0.5)}},
+        ])
+
+
+class RouteViewTest(TestCase):
+    def setUp(self):
+        user = User.objects.create_user('homer', 'h@s.com', 'dooh')
+        success = self.client.login(username=user.username, password='dooh')
+        self.assertTrue(success)
+        self.url = reverse('core:path_json_route')
+
+    def test_route_is_a_serialized_topology(self):
+        path_a = PathFactory(geom=LineString((0, 0), (10, 0)))
+        path_b = PathFactory(geom=LineString((10, 0), (20, 0)))
+        waypoints = [{'path': path_a.pk, 'position': 0.5}, {'path': path_b.pk, 'position': 0.5}]
+        response = self.client.post(self.url, {'waypoints': json.dumps(waypoints)})
+        self.assertEqual(response.status_code, 200)
+        topology = Topology.deserialize(response.content)
+        self.assertEqual([a.path.pk for a in topology.aggregations.all()], [path_a.pk, path_b.pk])
+        self.assertEqual(topology.geom.coords, ((5, 0), (10, 0), (15, 0)))
+
+    def test_route_needs_two_waypoints(self):
+        path = PathFactory(geom=LineString((0, 0), (10, 0)))
+        response = self.client.post(self.url, {'waypoints': json.dumps([{'path': path.pk}])})
+        self.assertEqual(response.status_code, 400)
+
+    def test_route_not_found(self):
+        path_a = PathFactory(geom=LineString((0, 0), (10, 0)))
+        path_b = PathFactory(geom=LineString((50, 50), (60, 60)))
+        waypoints = [{'path': path_a.pk, 'position': 0.5}, {'path': path_b.pk, 'position': 0.5}]
+        response = self.client.post(self.url, {'waypoints': json.dumps(waypoints)})
+        self.assertEqual(response.status_code, 400)
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 import math
+from collections import defaultdict
 
 from django.test import TestCase
 from django.contrib.gis.geos import LineString
@@ -8,8 +9,9 @@ from django.db import IntegrityError
 from geotrek.common.utils import dbnow
 from geotrek.authent.factories import UserFactory
 from geotrek.authent.models import Structure
-from geotrek.core.factories import (PathFactory, StakeFactory, TrailFactory)
-from geotrek.core.models import Path
+from geotrek.core.factories import (PathFactory, StakeFactory, TrailFactory, TopologyFactory)
+from geotrek.core.models import Path, PathTopologyIndex
+from geotrek.trekking.factories import POIFactory
 
 
 class StakeTest(TestCase):
@@ -122,6 +124,43 @@ class PathVisibilityTest(TestCase):
         self.assertEqual(len(Path.objects.all()), 3)
 
 
+class PathTopologyIndexTest(TestCase):
+    def setUp(self):
+        self.path1 = PathFactory.create(geom=LineString((0, 0), (10, 0)))
+        self.path2 = PathFactory.create(geom=LineString((10, 0), (20, 0)))
+        self.poi = POIFactory.create(no_path=True)
+        self.poi.add_path(self.path1, start=0.5, end=0.5)
+        self.topology = TopologyFactory.create(no_path=True)
+        self.topology.add_path(self.path1, start=0.5, end=1, reload=False)
+        self.topology.add_path(self.path2, start=0, end=0.5, order=1)
+
+    def test_topologies_are_grouped_by_path_and_kind(self):
+        with self.assertNumQueries(1):
+            index = PathTopologyIndex.topologies_by_kind([self.path1, self.path2.pk])
+        self.assertEqual(index, {
+            self.path1.pk: {'POI': [self.poi.pk], 'TOPOLOGY': [self.topology.pk]},
+            self.path2.pk: {'TOPOLOGY': [self.topology.pk]},
+        })
+
+    def test_deleted_topologies_are_removed(self):
+        self.poi.delete()
+        self.assertEqual(PathTopologyIndex.topologies_by_kind([self.path1]),
+                         {self.path1.pk: {'TOPOLOGY': [self.topology.pk]}})
+
+    def test_index_follows_aggregations(self):
+        self.topology.aggregations.filter(path=self.path2).delete()
+        self.poi.aggregations.update(path=self.path2)
+        self.assertEqual(PathTopologyIndex.topologies_by_kind([self.path1, self.path2]), {
+            self.path1.pk: {'TOPOLOGY': [self.topology.pk]},
+            self.path2.pk: {'POI': [self.poi.pk]},
+        })
+
+    def test_topologies_by_paths(self):
+        topologies = defaultdict(list)
+        Path.topologies_by_paths([self.path1, self.path2], topologies)
+        self.assertIn({'name': self.poi.name, 'url': self.poi.get_detail_url()}, sum(topologies.values(), []))
+
+
 class PathGeometryTest(TestCase):
     def test_self_intersection_raises_integrity_error(self):
         # Create path with self-intersection
@@ -2,10 +2,12 @@
 from django.test import TestCase
 from django.contrib.gis.geos import LineString, Point
 from django.conf import settings
+from django.db import transaction
 
 from geotrek.common.utils import almostequal
 
 from geotrek.core.factories import PathFactory, TopologyFactory, NetworkFactory, UsageFactory
+from geotrek.core.helpers import bulk_path_edits
 from geotrek.core.models import Path, Topology
 
 
@@ -1531,3 +1533,66 @@ class SplitPathGenericTopologyTest(TestCase):
         # But topology resulting geometry did not change
         originalgeom = LineString((2.2071067811865470, 0), *originalgeom[1:], srid=settings.SRID)
         self.assertEqual(topology.geom, originalgeom)
+
+
+class BulkPathEditsTest(TestCase):
+    geometries = [
+        LineString((5, -5), (5, 5)),
+        LineString((0, 10), (10, 10)),
+        LineString((2, 10.5), (2, 20)),  # Start is snapped
+        LineString((8, -5), (8, 15)),
+    ]
+
+    def load_network(self, bulk):
+        """
+        Add paths crossing AB (which has topologies), one by one or in bulk,
+        and return the resulting network. Database is left unchanged.
+        """
+        sid = transaction.savepoint()
+        ab = PathFactory.create(name="AB", geom=LineString((0, 0), (10, 0)))
+        line = TopologyFactory.create(no_path=True)
+        line.add_path(ab, start=0.2, end=0.8)
+        point = TopologyFactory.create(no_path=True)
+        point.add_path(ab, start=0.3, end=0.3)
+        if bulk:
+            with bulk_path_edits():
+                for geom in self.geometries:
+                    PathFactory.create(geom=geom)
+        else:
+            for geom in self.geometries:
+                PathFactory.create(geom=geom)
+        paths = sorted([tuple((round(x, 3), round(y, 3)) for x, y in path.geom.coords)
+                        for path in Path.objects.all()])
+        line.reload()
+        point.reload()
+        network = (paths, line.geom, line.length, point.geom)
+        transaction.savepoint_rollback(sid)
+        return network
+
+    def test_bulk_edits_match_row_by_row_edits(self):
+        paths, line_geom, line_length, point_geom = self.load_network(bulk=False)
+        bulk_paths, bulk_line_geom, bulk_line_length, bulk_point_geom = self.load_network(bulk=True)
+        self.assertEqual(len(paths), 12)
+        self.assertEqual(paths, bulk_paths)
+        self.assertTrue(line_geom.equals(bulk_line_geom))
+        self.assertAlmostEqual(line_length, bulk_line_length)
+        self.assertTrue(point_geom.equals(bulk_point_geom))
+
+    def test_paths_are_split_when_leaving_bulk_edits(self):
+        ab = PathFactory.create(name="AB", geom=LineString((0, 0), (4, 0)))
+        with bulk_path_edits():
+            PathFactory.create(geom=LineString((2, -2), (2, 2)))
+            self.assertEqual(Path.objects.count(), 2)
+        self.assertEqual(Path.objects.count(), 4)
+        ab.reload()
+        self.assertEqual(ab.geom, LineString((0, 0), (2, 0), srid=settings.SRID))
+
+    def test_topologies_are_updated_when_leaving_bulk_edits(self):
+        ab = PathFactory.create(name="AB", geom=LineString((0, 0), (4, 0)))
+        topology = TopologyFactory.create(no_path=True)
+        topology.add_path(ab, start=0, end=1)
+        with bulk_path_edits():
+            PathFactory.create(geom=LineString((2, -2), (2, 2)))
+        topology.reload()
+        self.assertEqual(len(topology.paths.all()), 2)
+        self.assertEqual(topology.geom, LineString((0, 0), (2, 0), (4, 0), srid=settings.SRID))
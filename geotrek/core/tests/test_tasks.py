@@ -0,0 +1,81 @@
+import json
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.gis.geos import LineString
+from django.core.urlresolvers import reverse
+from django.test import TestCase, override_settings
+
+from geotrek.core.factories import PathFactory, TopologyFactory
+from geotrek.core.models import Topology, TopologyGeometryQueue
+from geotrek.core.tasks import update_topologies_geometry
+
+
+@override_settings(TOPOLOGY_ASYNC_GEOMETRY=True)
+class TopologyGeometryQueueTest(TestCase):
+    def setUp(self):
+        self.path = PathFactory.create(geom=LineString((0, 0), (10, 0)))
+        self.topology = TopologyFactory.create(no_path=True)
+        self.topology.add_path(self.path, start=0, end=1)
+        self.path.geom = LineString((0, 0), (20, 0))
+        self.path.save()
+
+    def test_path_change_queues_topologies(self):
+        self.assertTrue(self.topology.stale)
+        self.assertEqual(TopologyGeometryQueue.pending(), 1)
+        self.topology.reload()
+        self.assertEqual(self.topology.geom, LineString((0, 0), (10, 0), srid=settings.SRID))
+
+    def test_task_computes_queued_geometries(self):
+        result = update_topologies_geometry()
+        self.assertEqual(result['count'], 1)
+        self.assertFalse(self.topology.stale)
+        self.assertEqual(TopologyGeometryQueue.pending(), 0)
+        self.topology.reload()
+        self.assertEqual(self.topology.geom, LineString((0, 0), (20, 0), srid=settings.SRID))
+
+    def test_task_computes_by_batches(self):
+        other = TopologyFactory.create(no_path=True)
+        other.add_path(self.path, start=0, end=0.5)
+        self.path.geom = LineString((0, 0), (30, 0))
+        self.path.save()
+        update_topologies_geometry(batch_size=1)
+        self.assertEqual(TopologyGeometryQueue.pending(), 0)
+        other.reload()
+        self.assertEqual(other.geom, LineString((0, 0), (15, 0), srid=settings.SRID))
+
+    def test_split_queues_topologies(self):
+        update_topologies_geometry()
+        PathFactory.create(geom=LineString((5, -5), (5, 5)))
+        self.assertTrue(self.topology.stale)
+        update_topologies_geometry()
+        self.assertFalse(self.topology.stale)
+        self.topology.reload()
+        self.assertEqual(len(self.topology.paths.all()), 2)
+        self.assertEqual(self.topology.geom.length, 20)
+
+    def test_point_with_offset_is_queued(self):
+        update_topologies_geometry()
+        point = TopologyFactory.create(no_path=True, offset=1)
+        point.add_path(self.path, start=0.5, end=0.5)
+        self.path.geom = LineString((0, 0), (40, 0))
+        self.path.save()
+        point.reload()
+        self.assertTrue(point.stale)
+        update_topologies_geometry()
+        self.assertFalse(point.stale)
+
+    def test_stale_of_many_topologies(self):
+        other = TopologyFactory.create(no_path=True)
+        other.add_path(PathFactory.create(geom=LineString((0, 10), (10, 10))), start=0, end=1)
+        with self.assertNumQueries(1):
+            topologies = Topology.with_stale(Topology.objects.filter(pk__in=[self.topology.pk, other.pk]))
+            stale = dict((topology.pk, topology.stale) for topology in topologies)
+        self.assertEqual(stale, {self.topology.pk: True, other.pk: False})
+
+    def test_pending_count_view(self):
+        user = User.objects.create_user('homer', 'h@s.com', 'dooh')
+        self.client.login(username=user.username, password='dooh')
+        response = self.client.get(reverse('core:topology_json_queue'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content), {'pending': 1})
@@ -3,7 +3,8 @@ import math
 
 from django.test import TestCase
 from django.conf import settings
-from django.db import connections, DEFAULT_DB_ALIAS
+from django.db import connection, connections, DEFAULT_DB_ALIAS
+from django.test.utils import CaptureQueriesContext
 from django.contrib.gis.geos import Point, LineString
 
 from geotrek.common.utils import dbnow, almostequal
@@ -869,6 +870,26 @@ class TopologyDerialization(TestCase):
         self.assertEqual(topology.aggregations.all()[2].start_position, 0.0)
         self.assertEqual(topology.aggregations.all()[2].end_position, 0.7)
 
+    def test_deserialize_line_unknown_path(self):
+        path = PathFactory.create()
+        with self.assertRaises(ValueError):
+            Topology.deserialize('{"paths": [%s, %s], "offset": 0}' % (path.pk, path.pk + 1000))
+
+    def test_deserialize_line_queries_do_not_depend_on_paths_count(self):
+        paths = [PathFactory.create(geom=LineString((i, 0), (i + 1, 0))) for i in range(10)]
+
+        def deserialize_queries(pks):
+            with CaptureQueriesContext(connection) as context:
+                topology = Topology.deserialize('{"paths": %s, "offset": 0}' % pks)
+            return topology, len(context.captured_queries)
+
+        short_topology, short_queries = deserialize_queries([p.pk for p in paths[:2]])
+        long_topology, long_queries = deserialize_queries([p.pk for p in paths])
+        self.assertEqual(short_queries, long_queries)
+        self.assertEqual(len(long_topology.aggregations.all()), 10)
+        self.assertEqual(long_topology.geom.coords, tuple((float(i), 0.0) for i in range(11)))
+        self.assertFalse(long_topology.deleted)
+
     def test_deserialize_point(self):
         PathFactory.create()
         # Take a point
@@ -902,6 +923,43 @@ class TopologyDerialization(TestCase):
         self.assertTrue(almostequal(end_before, end_after), '%s != %s' % (end_before, end_after))
 
 
+class TopologyPointBatchTest(TestCase):
+    def setUp(self):
+        self.path1 = PathFactory.create(geom=LineString((0, 0), (10, 0)))
+        self.path2 = PathFactory.create(geom=LineString((0, 100), (10, 100)))
+
+    def test_snap_points(self):
+        points = [Point(2, 5, srid=settings.SRID), Point(5, 60, srid=settings.SRID), Point(5, 0, srid=settings.SRID)]
+        snapped = TopologyHelper.snap_points(points)
+        self.assertEqual([pk for pk, position, offset in snapped], [self.path1.pk, self.path2.pk, self.path1.pk])
+        self.assertTrue(almostequal(snapped[0][1], 0.2))
+        self.assertTrue(almostequal(abs(snapped[0][2]), 5))
+        self.assertTrue(almostequal(snapped[1][1], 0.5))
+        self.assertTrue(almostequal(abs(snapped[1][2]), 40))
+        self.assertEqual(snapped[2][1:], (0.5, 0))
+
+    def test_snap_points_same_as_closest(self):
+        point = Point(7, 30, srid=settings.SRID)
+        closest = Path.closest(point)
+        self.assertEqual(TopologyHelper.snap_points([point]), [(closest.pk, ) + tuple(closest.interpolate(point))])
+
+    def test_snap_points_without_paths(self):
+        Path.objects.all().delete()
+        self.assertEqual(TopologyHelper.snap_points([Point(2, 5, srid=settings.SRID)]), [None])
+
+    def test_attach_points(self):
+        topologies = [TopologyFactory.create(no_path=True) for i in range(3)]
+        points = [Point(2, 5, srid=settings.SRID), Point(5, 60, srid=settings.SRID), Point(5, 0, srid=settings.SRID)]
+        self.assertEqual(TopologyHelper.attach_points(topologies, points), 3)
+        for topology, point, path in zip(topologies, points, [self.path1, self.path2, self.path1]):
+            topology.reload()
+            self.assertFalse(topology.deleted)
+            self.assertEqual(list(topology.paths.all()), [path])
+            self.assertTrue(topology.ispoint())
+            self.assertTrue(almostequal(topology.geom.x, point.x))
+            self.assertTrue(almostequal(topology.geom.y, point.y))
+
+
 class TopologyOverlappingTest(TestCase):
 
     def setUp(self):
@@ -956,3 +1014,33 @@ class TopologyOverlappingTest(TestCase):
         from geotrek.trekking.models import Trek
         overlaps = Topology.overlapping(Trek.objects.all())
         self.assertEqual(list(overlaps), [])
+
+    def test_overlapping_many_maps_each_topology(self):
+        overlaps = Topology.overlapping_many([self.topo2, self.point1])
+        self.assertEqual(overlaps.keys(), [self.topo2.pk, self.point1.pk])
+        self.assertEqual(overlaps[self.topo2.pk], [self.topo2.pk, self.point1.pk, self.point3.pk,
+                                                   self.point2.pk, self.topo1.pk])
+        self.assertEqual(overlaps[self.point1.pk], [self.topo2.pk, self.point1.pk, self.topo1.pk])
+
+    def test_overlapping_many_is_ordered_as_overlapping(self):
+        overlaps = Topology.overlapping_many([self.topo1.pk])
+        self.assertEqual(overlaps[self.topo1.pk],
+                         [t.pk for t in Topology.overlapping(self.topo1)])
+
+    def test_overlapping_many_filters_kind_and_deleted(self):
+        from geotrek.trekking.factories import POIFactory
+        from geotrek.trekking.models import POI
+        poi = POIFactory.create(no_path=True)
+        poi.add_path(self.path2, start=0.5, end=0.5)
+        deleted_poi = POIFactory.create(no_path=True)
+        deleted_poi.add_path(self.path2, start=0.5, end=0.5)
+        deleted_poi.delete()
+        overlaps = POI.overlapping_many([self.topo1, self.topo2])
+        self.assertEqual(overlaps, {self.topo1.pk: [poi.pk], self.topo2.pk: [poi.pk]})
+
+    def test_overlapping_many_runs_one_query(self):
+        with self.assertNumQueries(1):
+            Topology.overlapping_many([self.topo1, self.topo2, self.point1])
+
+    def test_overlapping_many_does_not_fail_if_no_records(self):
+        self.assertEqual(Topology.overlapping_many([]), {})
@@ -20,6 +20,7 @@ from geotrek.common.utils import almostequal
 from geotrek.authent.factories import PathManagerFactory, StructureFactory
 from geotrek.authent.tests import AuthentFixturesTest
 
+from geotrek.core.helpers import PathHelper
 from geotrek.core.models import Path, Trail
 
 from geotrek.trekking.factories import POIFactory, TrekFactory, ServiceFactory
@@ -533,3 +534,30 @@ class RemovePathKeepTopology(TestCase):
         self.assertEqual(poi.deleted, False)
 
         self.assertTrue(almostequal(1.5, poi.offset))
+
+    def test_delete_many_paths_attach_points_in_bulk(self):
+        ab = PathFactory.create(name="AB", geom=LineString((0, 0), (1, 0)))
+        bc = PathFactory.create(name="BC", geom=LineString((1, 0), (2, 0)))
+        de = PathFactory.create(name="DE", geom=LineString((0, 2), (2, 2)))
+        poi1 = POIFactory.create(no_path=True)
+        poi1.add_path(ab, start=0.5, end=0.5)
+        poi2 = POIFactory.create(no_path=True)
+        poi2.add_path(bc, start=0.5, end=0.5)
+        e1 = TopologyFactory.create(no_path=True)
+        e1.add_path(ab, start=0.5, end=1, order=0, reload=False)
+        e1.add_path(bc, start=0, end=1, order=1)
+
+        PathHelper.delete_paths(Path.objects.filter(pk__in=[ab.pk, bc.pk]))
+        poi1.reload()
+        poi2.reload()
+        e1.reload()
+
+        self.assertEqual(list(Path.objects.all()), [de])
+        self.assertEqual(e1.deleted, True)
+        for poi, position in ((poi1, 0.25), (poi2, 0.75)):
+            self.assertEqual(poi.deleted, False)
+            aggregation = poi.aggregations.get()
+            self.assertEqual(aggregation.path, de)
+            self.assertTrue(almostequal(position, aggregation.start_position))
+            self.assertTrue(almostequal(2, abs(poi.offset)))
+        self.assertTrue(poi1.geom.equals_exact(Point(0.5, 0, srid=settings.SRID), 0.01))
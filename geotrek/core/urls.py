@@ -6,12 +6,15 @@ from mapentity.registry import registry
 from geotrek.altimetry.urls import AltimetryEntityOptions
 from geotrek.core.models import Path, Trail
 from geotrek.core.views import (
-    get_graph_json, merge_path, ParametersView, PathGPXDetail, PathKMLDetail, TrailGPXDetail, TrailKMLDetail,
-    MultiplePathDelete
+    get_graph_json, get_graph_delta_json, get_route_json, get_topology_queue_json, merge_path, ParametersView,
+    PathGPXDetail, PathKMLDetail, TrailGPXDetail, TrailKMLDetail, MultiplePathDelete
 )
 
 urlpatterns = [
     url(r'^api/graph.json$', get_graph_json, name="path_json_graph"),
+    url(r'^api/graph_delta.json$', get_graph_delta_json, name="path_json_graph_delta"),
+    url(r'^api/route.json$', get_route_json, name="path_json_route"),
+    url(r'^api/topology_queue.json$', get_topology_queue_json, name="topology_json_queue"),
     url(r'^api/(?P<lang>\w\w)/parameters.json$', ParametersView.as_view(), name='parameters_json'),
     url(r'^mergepath/$', merge_path, name="merge_path"),
     url(r'^path/delete/(?P<pk>\d+(,\d+)+)/', MultiplePathDelete.as_view(), name="multiple_path_delete"),
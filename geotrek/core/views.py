@@ -11,11 +11,13 @@ from django.core.urlresolvers import reverse
 from django.shortcuts import redirect
 from django.views.decorators.http import last_modified as cache_last_modified
 from django.views.decorators.cache import cache_control
+from django.views.decorators.http import require_POST
 from django.views.generic import View, TemplateView
 from django.utils.translation import ugettext as _
 from django.core.cache import caches
 from django.views.generic.detail import BaseDetailView
 from django.http import HttpResponseRedirect
+from django.contrib.gis.geos import Point
 
 from mapentity.serializers import GPXSerializer
 from mapentity.views import (MapEntityLayer, MapEntityList, MapEntityJsonList,
@@ -28,7 +30,8 @@ from geotrek.common.utils import classproperty
 from geotrek.common.views import PublicOrReadPermMixin
 from geotrek.core.models import AltimetryMixin
 
-from .models import Path, Trail, Topology
+from .models import Path, Trail, Topology, TopologyGeometryQueue
+from .helpers import PathHelper
 from .forms import PathForm, TrailForm
 from .filters import PathFilterSet, TrailFilterSet
 from . import graph as graph_lib
@@ -218,15 +221,13 @@ class MultiplePathDelete(TemplateView):
         return self.delete(request, *args, **kwargs)
 
     def delete(self, request, *args, **kwargs):
-        for path in self.paths:
-            path.delete()
+        PathHelper.delete_paths(Path.include_invisible.filter(pk__in=[path.pk for path in self.paths]))
         return HttpResponseRedirect(reverse(self.success_url))
 
     def get_context_data(self, **kwargs):
         context = super(MultiplePathDelete, self).get_context_data(**kwargs)
         topologies_by_model = defaultdict(list)
-        for path in self.paths:
-            path.topologies_by_path(topologies_by_model)
+        Path.topologies_by_paths(self.paths, topologies_by_model)
         context['topologies_by_model'] = dict(topologies_by_model)
         return context
 
@@ -261,25 +262,107 @@ class PathDelete(MapEntityDelete):
 @cache_control(max_age=0, must_revalidate=True)
 @cache_last_modified(lambda x: Path.latest_updated())
 def get_graph_json(request):
+    """
+    Network graph used for client-side routing. ``?format=compact`` returns
+    parallel arrays (see ``graph.compact_graph``) instead of nested dicts.
+    The graph version is given in the ``X-Graph-Version`` header.
+    """
+    compact = request.GET.get('format') == 'compact'
     cache = caches['fat']
-    key = 'path_graph_json'
+    key = 'path_graph_json_compact' if compact else 'path_graph_json'
 
     result = cache.get(key)
-    latest = Path.latest_updated()
 
-    if result and latest:
-        cache_latest, json_graph = result
+    if result:
+        cache_version, json_graph = result
         # Not empty and still valid
-        if cache_latest and cache_latest >= latest:
-            return HttpJSONResponse(json_graph)
+        if not graph_lib.graph_changed_since(cache_version):
+            response = HttpJSONResponse(json_graph)
+            response['X-Graph-Version'] = cache_version
+            return response
 
     # cache does not exist or is not up to date
-    # rebuild the graph and cache the json
-    graph = graph_lib.graph_edges_nodes_of_qs(Path.objects.exclude(draft=True))
-    json_graph = json.dumps(graph)
+    # update the graph and cache the json
+    state = graph_lib.get_graph_state()
+    if compact:
+        json_graph = json.dumps(graph_lib.compact_graph(state.graph), separators=(',', ':'))
+    else:
+        json_graph = json.dumps(state.graph)
+
+    cache.set(key, (state.version, json_graph))
+    response = HttpJSONResponse(json_graph)
+    response['X-Graph-Version'] = state.version
+    return response
+
+
+@login_required
+@cache_control(max_age=0, must_revalidate=True)
+def get_graph_delta_json(request):
+    """
+    Edges and nodes of the network graph changed since the version given
+    in ``?since=``. Removed ones are ``null``. If the delta cannot be computed
+    (version too old), the whole graph has to be downloaded again.
+    """
+    try:
+        since = int(request.GET.get('since'))
+    except (TypeError, ValueError):
+        return JsonResponse({u'error': _(u"Invalid graph version")}, status=400)
+
+    # State is up-to-date with the database, later versions do not exist
+    state = graph_lib.get_graph_state()
+    if since > state.version:
+        return JsonResponse({u'error': _(u"Invalid graph version")}, status=400)
+    delta = state.delta(since)
+    if delta is None:
+        return JsonResponse({u'error': _(u"Graph version is too old, reload the whole graph")}, status=410)
+    return HttpJSONResponse(json.dumps(delta))
+
+
+@login_required
+@cache_control(max_age=0, must_revalidate=True)
+def get_topology_queue_json(request):
+    """
+    Number of topologies whose geometry is being computed again
+    (see ``TOPOLOGY_ASYNC_GEOMETRY``).
+    """
+    return JsonResponse({u'pending': TopologyGeometryQueue.pending()})
+
+
+def _route_waypoint(waypoint):
+    """
+    A waypoint is either a position along a path ``{"path": 12, "position": 0.3}``
+    or a point ``{"lat": 5.0, "lng": 10.2}`` snapped to the closest path.
+    """
+    if 'path' in waypoint:
+        position = float(waypoint.get('position', 0.0))
+        if not 0.0 <= position <= 1.0:
+            raise ValueError(_(u"Invalid position %s") % position)
+        return int(waypoint['path']), position
+    point = Point(float(waypoint['lng']), float(waypoint['lat']), srid=settings.API_SRID)
+    point.transform(settings.SRID)
+    closest = Path.closest(point)
+    position, offset = closest.interpolate(point)
+    return closest.pk, position
+
 
-    cache.set(key, (latest, json_graph))
-    return HttpJSONResponse(json_graph)
+@login_required
+@require_POST
+def get_route_json(request):
+    """
+    Compute the shortest route through the posted waypoints, and return it
+    as a serialized topology.
+    """
+    try:
+        waypoints = [_route_waypoint(w) for w in json.loads(request.POST.get('waypoints', '[]'))]
+    except (TypeError, ValueError, KeyError, AttributeError, IndexError) as exc:
+        return JsonResponse({u'error': u'%s' % exc}, status=400)
+    if len(waypoints) < 2:
+        return JsonResponse({u'error': _(u"At least two waypoints are required")}, status=400)
+
+    legs = graph_lib.get_routing_graph().route_waypoints(waypoints)
+    if legs is None:
+        return JsonResponse({u'error': _(u"No route found between waypoints")}, status=400)
+    return HttpJSONResponse(json.dumps(graph_lib.serialize_route(legs)))
 
 
 class TrailLayer(MapEntityLayer):
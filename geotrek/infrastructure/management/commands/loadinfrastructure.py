@@ -3,6 +3,7 @@
 import os.path
 
 from django.contrib.gis.gdal import DataSource
+from django.contrib.gis.geos import Point
 from django.core.management.base import BaseCommand, CommandError
 from django.db import transaction
 
@@ -18,6 +19,11 @@ class Command(BaseCommand):
     help = 'Load a layer with point geometries in te structure model\n'
     can_import_settings = True
     counter = 0
+    batch_size = 1000
+
+    def __init__(self, *args, **kwargs):
+        super(Command, self).__init__(*args, **kwargs)
+        self.pending = []
 
     def add_arguments(self, parser):
         parser.add_argument('point_layer')
@@ -156,6 +162,7 @@ class Command(BaseCommand):
 
                     self.create_infrastructure(feature_geom, name, type, condition, structure, description, year,
                                                verbosity, eid)
+            self.attach_infrastructures()
 
             transaction.savepoint_commit(sid)
             if verbosity >= 2:
@@ -200,10 +207,17 @@ class Command(BaseCommand):
             else:
                 infra = Infrastructure.objects.create(**fields_without_eid)
 
-        serialized = '{"lng": %s, "lat": %s}' % (geometry.x, geometry.y)
-        topology = TopologyHelper.deserialize(serialized)
-        infra.mutate(topology)
+        # Objects are attached to paths by batches (see attach_infrastructures)
+        self.pending.append((infra, Point(geometry.x, geometry.y, srid=settings.API_SRID)))
+        if len(self.pending) >= self.batch_size:
+            self.attach_infrastructures()
 
         self.counter += 1
 
         return infra
+
+    def attach_infrastructures(self):
+        if self.pending:
+            infras, points = zip(*self.pending)
+            TopologyHelper.attach_points(infras, points)
+        self.pending = []
@@ -9,7 +9,7 @@ from extended_choices import Choices
 from mapentity.models import MapEntityMixin
 
 from geotrek.common.utils import classproperty
-from geotrek.core.models import Topology, Path
+from geotrek.core.models import Topology, Path, PathTopologyIndex
 from geotrek.authent.models import StructureRelated, StructureOrNoneRelated
 from geotrek.common.mixins import BasePublishableMixin, OptionalPictogramMixin
 
@@ -130,7 +130,7 @@ class Infrastructure(MapEntityMixin, BaseInfrastructure):
 
     @classmethod
     def path_infrastructures(cls, path):
-        return cls.objects.existing().filter(aggregations__path=path).distinct('pk')
+        return cls.objects.existing().filter(pk__in=PathTopologyIndex.path_topologies(path, cls.KIND))
 
     @classmethod
     def topology_infrastructures(cls, topology):
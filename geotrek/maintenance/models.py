@@ -12,7 +12,7 @@ from mapentity.models import MapEntityMixin
 
 from geotrek.authent.models import StructureRelated, StructureOrNoneRelated
 from geotrek.altimetry.models import AltimetryMixin
-from geotrek.core.models import Topology, Path, Trail
+from geotrek.core.models import Topology, Path, PathTopologyIndex, Trail
 from geotrek.common.models import Organism
 from geotrek.common.mixins import TimeStampedModelMixin, NoDeleteMixin, AddPropertyMixin
 from geotrek.common.utils import classproperty
@@ -296,7 +296,7 @@ class Intervention(AddPropertyMixin, MapEntityMixin, AltimetryMixin,
 
     @classmethod
     def path_interventions(cls, path):
-        return cls.objects.existing().filter(topology__aggregations__path=path)
+        return cls.objects.existing().filter(topology__in=PathTopologyIndex.path_topologies(path))
 
     @classmethod
     def topology_interventions(cls, topology):
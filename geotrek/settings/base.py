@@ -540,6 +540,7 @@ EMBED_VIDEO_BACKENDS = (
 
 TRAIL_MODEL_ENABLED = True
 TREKKING_TOPOLOGY_ENABLED = True
+TOPOLOGY_ASYNC_GEOMETRY = False  # Compute topologies geometries in a celery task when paths change
 FLATPAGES_ENABLED = True
 TOURISM_ENABLED = True
 
@@ -604,6 +605,9 @@ MOBILE_TILES_RADIUS_SMALL = 0.005  # ~500 m
 MOBILE_TILES_GLOBAL_ZOOMS = range(13)
 MOBILE_TILES_LOW_ZOOMS = range(13, 15)
 MOBILE_TILES_HIGH_ZOOMS = range(15, 17)
+MOBILE_TILES_CONCURRENCY = 4  # parallel downloads
+MOBILE_TILES_CACHE_EXPIRY = 30 * 24 * 3600  # seconds, 0 to disable tiles cache
+MOBILE_DELTAS_KEPT = 2  # delta packages kept by zip file of sync_mobile, 0 to disable them
 MOBILE_CATEGORY_PICTO_SIZE = 32
 MOBILE_POI_PICTO_SIZE = 32
 MOBILE_INFORMATIONDESKTYPE_PICTO_SIZE = 32
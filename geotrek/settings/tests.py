@@ -12,6 +12,8 @@ INSTALLED_APPS += ('geotrek.sensitivity', )
 
 LOGGING['handlers']['console']['level'] = 'CRITICAL'
 
+MOBILE_TILES_CACHE_EXPIRY = 0
+
 LANGUAGE_CODE = 'en'
 MODELTRANSLATION_DEFAULT_LANGUAGE = 'en'
 MODELTRANSLATION_LANGUAGES = ('en', 'es', 'fr', 'it')
@@ -12,7 +12,7 @@ from geotrek.authent.models import StructureOrNoneRelated, StructureRelated
 from geotrek.common.mixins import NoDeleteMixin, OptionalPictogramMixin
 from geotrek.common.models import Organism
 from geotrek.common.utils import classproperty
-from geotrek.core.models import Topology, Path
+from geotrek.core.models import Topology, Path, PathTopologyIndex
 
 from geotrek.infrastructure.models import BaseInfrastructure, InfrastructureCondition
 
@@ -80,7 +80,7 @@ class Signage(MapEntityMixin, BaseInfrastructure):
 
     @classmethod
     def path_signages(cls, path):
-        return cls.objects.existing().filter(aggregations__path=path).distinct('pk')
+        return cls.objects.existing().filter(pk__in=PathTopologyIndex.path_topologies(path, cls.KIND))
 
     @classmethod
     def topology_signages(cls, topology):
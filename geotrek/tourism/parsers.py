@@ -40,6 +40,7 @@ class ApidaeParser(AttachmentParserMixin, Parser):
     }
     size = 100
     skip = 0
+    batch_size = 100
     responseFields = [
         'id',
         'nom',
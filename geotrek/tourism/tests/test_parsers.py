@@ -25,6 +25,19 @@ class EauViveParser(TouristicContentApidaeParser):
     type2 = []
 
 
+class EauViveBatchParser(EauViveParser):
+    batch_size = 10
+    non_fields = {}
+
+
+class EauViveTypeBBatchParser(EauViveBatchParser):
+    type1 = [u"Type B"]
+
+
+class EauViveRepeatedTypeBatchParser(EauViveBatchParser):
+    type1 = [u"Type A", u"Type A"]
+
+
 class EspritParc(EspritParcParser):
     category = u"Miels et produits de la ruche"
     type1 = [u"Miel", u"Pollen", u"Gelée royale, propolis et pollen"]
@@ -85,6 +98,51 @@ class ParserTests(TranslationResetMixin, TestCase):
         self.assertEqual(Attachment.objects.count(), 3)
         self.assertEqual(Attachment.objects.first().content_object, content)
 
+    @mock.patch('requests.get')
+    def test_content_apidae_by_batch(self, mocked):
+        def mocked_json():
+            filename = os.path.join(os.path.dirname(__file__), 'data', 'apidaeContent.json')
+            with io.open(filename, 'r', encoding='utf8') as f:
+                return json.load(f)
+        mocked.return_value.status_code = 200
+        mocked.return_value.json = mocked_json
+        FileType.objects.create(type=u"Photographie")
+        TouristicContentCategoryFactory(label=u"Eau vive")
+        type_a = TouristicContentType1Factory(label=u"Type A")
+        type_b = TouristicContentType1Factory(label=u"Type B")
+        parser = EauViveBatchParser()
+        parser.parse()
+        self.assertEqual((parser.nb_success, parser.nb_created, parser.nb_updated), (1, 1, 0))
+        content = TouristicContent.objects.get()
+        self.assertEqual(set(content.type1.all()), {type_a, type_b})
+        parser = EauViveBatchParser()
+        parser.parse()
+        self.assertEqual((parser.nb_success, parser.nb_updated, parser.nb_unmodified), (1, 0, 1))
+        parser = EauViveTypeBBatchParser()
+        parser.parse()
+        self.assertEqual((parser.nb_success, parser.nb_updated, parser.nb_unmodified), (1, 1, 0))
+        self.assertEqual(list(content.type1.all()), [type_b])
+        self.assertEqual(TouristicContent.objects.count(), 1)
+
+    @mock.patch('requests.get')
+    def test_repeated_m2m_value_by_batch(self, mocked):
+        def mocked_json():
+            filename = os.path.join(os.path.dirname(__file__), 'data', 'apidaeContent.json')
+            with io.open(filename, 'r', encoding='utf8') as f:
+                return json.load(f)
+        mocked.return_value.status_code = 200
+        mocked.return_value.json = mocked_json
+        FileType.objects.create(type=u"Photographie")
+        TouristicContentCategoryFactory(label=u"Eau vive")
+        type_a = TouristicContentType1Factory(label=u"Type A")
+        parser = EauViveRepeatedTypeBatchParser()
+        # Chunk is not written again row by row
+        with mock.patch.object(EauViveRepeatedTypeBatchParser, 'write_row') as mocked_write_row:
+            parser.parse()
+        self.assertFalse(mocked_write_row.called)
+        self.assertEqual((parser.nb_success, parser.nb_created), (1, 1))
+        self.assertEqual(list(TouristicContent.objects.get().type1.all()), [type_a])
+
     @mock.patch('requests.get')
     def test_filetype_structure_none(self, mocked):
         def mocked_json():
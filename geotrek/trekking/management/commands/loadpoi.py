@@ -1,7 +1,8 @@
 import os.path
 
+from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
-from django.contrib.gis.geos import GEOSGeometry
+from django.contrib.gis.geos import GEOSGeometry, Point
 
 from geotrek.core.helpers import TopologyHelper
 from geotrek.trekking.models import POI, POIType
@@ -12,6 +13,11 @@ class Command(BaseCommand):
     can_import_settings = True
     field_name = 'name'
     field_poitype = 'type'
+    batch_size = 1000
+
+    def __init__(self, *args, **kwargs):
+        super(Command, self).__init__(*args, **kwargs)
+        self.pending = []
 
     def add_arguments(self, parser):
         parser.add_argument('point_layer')
@@ -46,14 +52,19 @@ class Command(BaseCommand):
             if poitype:
                 poitype = poitype.decode('utf-8')
             self.create_poi(geometry, name, poitype)
+        self.attach_pois()
 
     def create_poi(self, geometry, name, poitype):
         poitype, created = POIType.objects.get_or_create(label=poitype)
         poi = POI.objects.create(name=name, type=poitype)
-        # Use existing topology helpers to transform a Point(x, y)
-        # to a path aggregation (topology)
-        serialized = '{"lng": %s, "lat": %s}' % (geometry.x, geometry.y)
-        topology = TopologyHelper.deserialize(serialized)
-        # Move deserialization aggregations to the POI
-        poi.mutate(topology)
+        # POIs are attached to paths by batches (see attach_pois)
+        self.pending.append((poi, Point(geometry.x, geometry.y, srid=settings.API_SRID)))
+        if len(self.pending) >= self.batch_size:
+            self.attach_pois()
         return poi
+
+    def attach_pois(self):
+        if self.pending:
+            pois, points = zip(*self.pending)
+            TopologyHelper.attach_points(pois, points)
+        self.pending = []
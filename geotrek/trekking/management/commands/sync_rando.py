@@ -1,16 +1,29 @@
 # -*- encoding: UTF-8 -
 
+import errno
+import gzip
+import hashlib
+import heapq
+import json
 import logging
 import filecmp
 import os
 import re
 import shutil
-from time import sleep
-from zipfile import ZipFile
+import sqlite3
+from collections import defaultdict
+from io import BytesIO
+from multiprocessing import Pool, current_process
+from multiprocessing.pool import ThreadPool
+from tempfile import NamedTemporaryFile
+from time import sleep, time
+from zipfile import ZipFile, ZIP_DEFLATED, ZIP_STORED
 
 from django.conf import settings
 from django.contrib.auth.models import AnonymousUser
-from django.core.management.base import BaseCommand, CommandError
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand, CommandError, OutputWrapper
+from django.db import connections
 from django.db.models import Q
 from django.http import StreamingHttpResponse
 from django.test.client import RequestFactory
@@ -18,6 +31,7 @@ from django.utils import translation, timezone
 from django.utils.translation import ugettext as _
 from landez import TilesManager
 from landez.sources import DownloadError
+import geotrek
 from geotrek.common.models import FileType  # NOQA
 from geotrek.altimetry.views import ElevationProfile, ElevationArea, serve_elevation_chart
 from geotrek.common import models as common_models
@@ -39,6 +53,10 @@ from geotrek.trekking.views import (TrekViewSet, POIViewSet, TrekPOIViewSet,
 if 'geotrek.sensitivity' in settings.INSTALLED_APPS:
     from geotrek.sensitivity import models as sensitivity_models
     from geotrek.sensitivity import views as sensitivity_views
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 # Register mapentity models
 from geotrek.trekking import urls  # NOQA
@@ -48,21 +66,162 @@ from geotrek.tourism import urls  # NOQA
 logger = logging.getLogger(__name__)
 
 
-class ZipTilesBuilder(object):
-    def __init__(self, zipfile, prefix="", **builder_args):
-        self.zipfile = zipfile
-        self.prefix = prefix
+def fix2028_chunks(chunks):
+    """Replace escaped unicode characters 2028 and 2029 by \\n, also across chunks"""
+    tail = b''
+    for chunk in chunks:
+        chunk = (tail + chunk).replace('\\u2028', '\\n').replace('\\u2029', '\\n')
+        # End of chunk may be the start of an escape sequence
+        chunk, tail = chunk[:-5], chunk[-5:]
+        yield chunk
+    yield tail
+
+
+def gzip_file(src, dst):
+    # No timestamp in header, so that identical files give identical archives
+    with open(src, 'rb') as f_in, gzip.GzipFile(dst, 'wb', mtime=0) as f_out:
+        shutil.copyfileobj(f_in, f_out)
+
+
+def brotli_file(src, dst):
+    compressor = brotli.Compressor()
+    with open(src, 'rb') as f_in, open(dst, 'wb') as f_out:
+        for chunk in iter(lambda: f_in.read(64 * 1024), b''):
+            f_out.write(compressor.process(chunk))
+        f_out.write(compressor.finish())
+
+
+def precompress(fullname, oldfullname=None):
+    """
+    Write .gz (and .br if brotli is installed) siblings of the file, to be served by
+    nginx ``gzip_static``. If ``oldfullname`` is given, the file is the same as this one,
+    and its siblings are linked if they exist. Return the suffixes of siblings.
+    """
+    compressors = [('.gz', gzip_file)]
+    if brotli is not None:
+        compressors.append(('.br', brotli_file))
+    for suffix, compress in compressors:
+        sibling = fullname + suffix
+        if os.path.isfile(sibling):
+            os.unlink(sibling)
+        if oldfullname and os.path.isfile(oldfullname + suffix):
+            os.link(oldfullname + suffix, sibling)
+        else:
+            compress(fullname, sibling)
+    return [suffix for suffix, compress in compressors]
+
+
+class SyncZipFile(ZipFile):
+    """
+    Zip file which skips duplicate entries, deflates text entries and stores
+    other ones (pictures, tiles, PDF...), which are already compressed.
+    """
+    compressible = ('.json', '.geojson', '.gpx', '.kml', '.svg', '.html', '.xml', '.csv', '.txt', '.css', '.js')
+
+    def __init__(self, *args, **kwargs):
+        super(SyncZipFile, self).__init__(*args, **kwargs)
+        self.names = set(self.NameToInfo)
+
+    def compress_type(self, arcname):
+        if os.path.splitext(arcname)[1].lower() in self.compressible:
+            return ZIP_DEFLATED
+        return ZIP_STORED
+
+    def write(self, filename, arcname=None, compress_type=None):
+        if arcname is None:
+            arcname = filename
+        if arcname in self.names:
+            return
+        self.names.add(arcname)
+        if compress_type is None:
+            compress_type = self.compress_type(arcname)
+        super(SyncZipFile, self).write(filename, arcname, compress_type)
+
+    def writestr(self, arcname, data, compress_type=None):
+        if arcname in self.names:
+            return
+        self.names.add(arcname)
+        if compress_type is None:
+            compress_type = self.compress_type(arcname)
+        super(SyncZipFile, self).writestr(arcname, data, compress_type)
+
+
+class TileCache(object):
+    """
+    Tiles cache on disk, shared by syncs. Tiles are stored once by hash of their content
+    (sea, blank areas...) and indexed by source and coordinates. Tiles older than
+    ``expiry`` seconds are downloaded again, but still used if download fails.
+    """
+
+    def __init__(self, root, source, expiry):
+        self.root = root
+        self.index = os.path.join(root, 'index', hashlib.sha1(source).hexdigest())
+        self.expiry = expiry
+
+    def object_path(self, digest):
+        return os.path.join(self.root, 'objects', digest[:2], digest)
+
+    def write(self, path, data):
+        """Write file atomically, since tiles are fetched by several threads and processes"""
+        dirname = os.path.dirname(path)
+        try:
+            os.makedirs(dirname)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        with NamedTemporaryFile(dir=dirname, delete=False) as f:
+            f.write(data)
+        os.rename(f.name, path)
+
+    def get(self, tile, fetch):
+        if not self.expiry:
+            return fetch()
+        index = os.path.join(self.index, '{0}/{1}/{2}'.format(*tile))
+        try:
+            age = time() - os.path.getmtime(index)
+            with open(index) as f:
+                digest = f.read()
+            with open(self.object_path(digest), 'rb') as f:
+                data = f.read()
+        except (IOError, OSError):
+            data = None
+        if data is not None and age < self.expiry:
+            return data
+        try:
+            fresh = fetch()
+        except DownloadError:
+            if data is None:
+                raise
+            return data
+        if fresh:
+            digest = hashlib.sha1(fresh).hexdigest()
+            if not os.path.exists(self.object_path(digest)):
+                self.write(self.object_path(digest), fresh)
+            self.write(index, digest)
+        return fresh
+
+
+class TilesBuilder(object):
+    """Download tiles of the coverage, see ``write()`` in subclasses"""
+
+    def __init__(self, **builder_args):
+        tiles_urls = [builder_args['tiles_url']]
+        # Tiles are cached by TileCache instead of landez
+        builder_args['cache'] = False
         builder_args['tile_format'] = self.format_from_url(builder_args['tiles_url'])
         self.tm = TilesManager(**builder_args)
 
         if not isinstance(settings.MOBILE_TILES_URL, str) and len(settings.MOBILE_TILES_URL) > 1:
             for url in settings.MOBILE_TILES_URL[1:]:
+                tiles_urls.append(url)
                 args = builder_args
                 args['tiles_url'] = url
                 args['tile_format'] = self.format_from_url(args['tiles_url'])
                 self.tm.add_layer(TilesManager(**args), opacity=1)
 
+        self.cache = TileCache(builder_args['tiles_dir'], repr(tiles_urls), settings.MOBILE_TILES_CACHE_EXPIRY)
         self.tiles = set()
+        self.bytes = 0
 
     def format_from_url(self, url):
         """
@@ -75,25 +234,321 @@ class ZipTilesBuilder(object):
             return m.group(1)
         return url.rsplit('.')[-1]
 
+    @property
+    def extension(self):
+        return settings.MOBILE_TILES_EXTENSION or self.tm._tile_extension
+
     def add_coverage(self, bbox, zoomlevels):
         self.tiles |= set(self.tm.tileslist(bbox, zoomlevels))
 
+    def fetch(self, tile):
+        try:
+            return tile, self.cache.get(tile, lambda: self.tm.tile(tile))
+        except DownloadError:
+            return tile, None
+
     def run(self):
-        for tile in self.tiles:
-            name = '{prefix}{0}/{1}/{2}{ext}'.format(
-                *tile,
-                prefix=self.prefix,
-                ext=settings.MOBILE_TILES_EXTENSION or self.tm._tile_extension
-            )
-            try:
-                data = self.tm.tile(tile)
-            except DownloadError:
-                logger.warning("Failed to download tile %s" % name)
+        """Download tiles in MOBILE_TILES_CONCURRENCY threads, and write them from the calling thread"""
+        pool = ThreadPool(settings.MOBILE_TILES_CONCURRENCY)
+        try:
+            for tile, data in pool.imap(self.fetch, sorted(self.tiles)):
+                if data is None:
+                    logger.warning("Failed to download tile {0}/{1}/{2}".format(*tile))
+                else:
+                    self.bytes += len(data)
+                    self.write(tile, data)
+        finally:
+            pool.close()
+            pool.join()
+
+    def write(self, tile, data):
+        raise NotImplementedError
+
+
+class ZipTilesBuilder(TilesBuilder):
+    def __init__(self, zipfile, prefix="", **builder_args):
+        super(ZipTilesBuilder, self).__init__(**builder_args)
+        self.zipfile = zipfile
+        self.prefix = prefix
+
+    def write(self, tile, data):
+        name = '{prefix}{0}/{1}/{2}{ext}'.format(*tile, prefix=self.prefix, ext=self.extension)
+        self.zipfile.writestr(name, data)
+
+
+class MBTilesBuilder(TilesBuilder):
+    """
+    Write tiles in a MBTiles file. Identical tiles are stored once (like mbutil does).
+    Tiles of ``exclude`` (global package ones for trek packages) are left out.
+    """
+
+    def __init__(self, filename, exclude=frozenset(), **builder_args):
+        super(MBTilesBuilder, self).__init__(**builder_args)
+        self.filename = filename
+        self.exclude = exclude
+
+    def add_coverage(self, bbox, zoomlevels):
+        super(MBTilesBuilder, self).add_coverage(bbox, zoomlevels)
+        self.tiles -= self.exclude
+
+    def run(self):
+        if os.path.exists(self.filename):
+            os.unlink(self.filename)
+        self.db = sqlite3.connect(self.filename)
+        self.db.executescript("""
+            CREATE TABLE metadata (name text, value text);
+            CREATE TABLE map (zoom_level integer, tile_column integer, tile_row integer, tile_id text);
+            CREATE TABLE images (tile_data blob, tile_id text);
+            CREATE UNIQUE INDEX name ON metadata (name);
+            CREATE UNIQUE INDEX map_index ON map (zoom_level, tile_column, tile_row);
+            CREATE UNIQUE INDEX images_id ON images (tile_id);
+            CREATE VIEW tiles AS
+                SELECT map.zoom_level AS zoom_level, map.tile_column AS tile_column,
+                       map.tile_row AS tile_row, images.tile_data AS tile_data
+                FROM map JOIN images ON images.tile_id = map.tile_id;
+        """)
+        metadata = {
+            'name': os.path.splitext(os.path.basename(self.filename))[0],
+            'type': 'baselayer',
+            'version': '1.1',
+            'format': self.extension.lstrip('.'),
+        }
+        if self.tiles:
+            zooms = [z for z, x, y in self.tiles]
+            metadata.update({'minzoom': min(zooms), 'maxzoom': max(zooms)})
+        self.db.executemany("INSERT INTO metadata (name, value) VALUES (?, ?)", metadata.items())
+        try:
+            super(MBTilesBuilder, self).run()
+            self.db.commit()
+        finally:
+            self.db.close()
+
+    def write(self, tile, data):
+        z, x, y = tile
+        tile_id = hashlib.sha1(data).hexdigest()
+        self.db.execute("INSERT OR IGNORE INTO images (tile_data, tile_id) VALUES (?, ?)",
+                        (sqlite3.Binary(data), tile_id))
+        # MBTiles rows follow TMS scheme (from bottom)
+        self.db.execute("INSERT INTO map (zoom_level, tile_column, tile_row, tile_id) VALUES (?, ?, ?, ?)",
+                        (z, x, 2 ** z - 1 - y, tile_id))
+
+
+class SyncMemo(object):
+    """Language independent results, computed once and shared by all languages of a sync"""
+
+    def __init__(self):
+        self.values = {}
+        self.hits = defaultdict(int)
+        self.misses = defaultdict(int)
+
+    def get(self, kind, key, compute):
+        try:
+            value = self.values[(kind, key)]
+        except KeyError:
+            self.misses[kind] += 1
+            value = self.values[(kind, key)] = compute()
+        else:
+            self.hits[kind] += 1
+        return value
+
+    def stats(self):
+        """Return ``(kind, hits, total)`` for each kind of result"""
+        return [(kind, self.hits[kind], self.hits[kind] + self.misses[kind])
+                for kind in sorted(set(self.hits) | set(self.misses))]
+
+    def add_stats(self, hits, misses):
+        for kind, count in hits.items():
+            self.hits[kind] += count
+        for kind, count in misses.items():
+            self.misses[kind] += count
+
+
+class SyncReport(object):
+    """
+    Timings and sizes of sync steps (views, files, tiles, zips, jobs) and work units
+    done, used for progress of celery task.
+    """
+    slowest_count = 20
+
+    def __init__(self):
+        self.start = time()
+        self.steps = {}
+        self.slowest = {}
+        self.languages = {}
+        self.units_done = 0
+        self.units_total = 0
+
+    def add(self, kind, name, start, status, size=0):
+        """Record a step started at ``start``, with status generated, unchanged, copied or failed"""
+        duration = time() - start
+        step = self.steps.setdefault(kind, {'count': 0, 'duration': 0.0, 'bytes': 0})
+        step['count'] += 1
+        step['duration'] += duration
+        step['bytes'] += size
+        step[status] = step.get(status, 0) + 1
+        self.add_slowest(kind, [(duration, name)])
+
+    def add_slowest(self, kind, items):
+        slowest = self.slowest.setdefault(kind, [])
+        for item in items:
+            if len(slowest) < self.slowest_count:
+                heapq.heappush(slowest, item)
             else:
-                self.zipfile.writestr(name, data)
+                heapq.heappushpop(slowest, item)
+
+    def clear(self):
+        self.steps = {}
+        self.slowest = {}
+
+    def merge(self, steps, slowest):
+        """Add steps recorded by a worker process"""
+        for kind, step in steps.items():
+            total = self.steps.setdefault(kind, {'count': 0, 'duration': 0.0, 'bytes': 0})
+            for key, value in step.items():
+                total[key] = total.get(key, 0) + value
+        for kind, items in slowest.items():
+            self.add_slowest(kind, items)
+
+    def progress(self):
+        """Return percentage of work units done"""
+        if not self.units_total:
+            return 0
+        return min(99, 100 * self.units_done // self.units_total)
+
+    def as_dict(self):
+        return {
+            'duration': time() - self.start,
+            'languages': self.languages,
+            'steps': self.steps,
+            'slowest': {kind: [{'name': name, 'duration': duration} for duration, name in sorted(items, reverse=True)]
+                        for kind, items in self.slowest.items()},
+        }
 
+    def save(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.as_dict(), f, indent=2, sort_keys=True)
+
+
+class ZipEntries(object):
+    """Record entries written to a zip by a worker, to write them in the parent process"""
+
+    def __init__(self):
+        self.entries = []
+        self.names = set()
+
+    def namelist(self):
+        return [arcname for filename, arcname in self.entries]
+
+    def write(self, filename, arcname):
+        if arcname not in self.names:
+            self.names.add(arcname)
+            self.entries.append((filename, arcname))
+
+
+worker_command = None
+
+
+class SyncManifestMixin(object):
+    """
+    Incremental sync helpers of ``sync_rando`` and ``sync_mobile``: files written by each job are
+    recorded in a manifest, with a fingerprint of what they depend on. Jobs whose fingerprint did
+    not change since previous sync link their files instead of being run again.
+    """
+    manifest_name = None
+
+    def mkdirs(self, name):
+        dirname = os.path.dirname(name)
+        if not os.path.exists(dirname):
+            try:
+                os.makedirs(dirname)
+            except OSError as e:
+                # Created meanwhile by another worker
+                if e.errno != errno.EEXIST:
+                    raise
+
+    def record(self, name):
+        """Record a file written by the current job of ``run_jobs()``"""
+        if self.written is not None:
+            self.written.append(name)
+
+    def object_state(self, obj):
+        """Return a value which changes with the object"""
+        if getattr(obj, 'date_update', None) is not None:
+            return (obj._meta.label, obj.pk, obj.date_update.isoformat())
+        return (obj._meta.label, obj.pk, [field.value_to_string(obj) for field in obj._meta.concrete_fields])
+
+    def objects_fingerprint(self, deps, *values):
+        """Hash of objects, of their attachments, and of other values"""
+        by_model = defaultdict(list)
+        for dep in deps:
+            by_model[type(dep)].append(dep.pk)
+        attachments = common_models.Attachment.objects.none()
+        for model, pks in by_model.items():
+            attachments |= common_models.Attachment.objects.filter(content_type=ContentType.objects.get_for_model(model),
+                                                                   object_id__in=pks)
+        states = [self.object_state(dep) for dep in deps + list(attachments.order_by('pk'))]
+        states += values
+        return hashlib.md5(repr(states)).hexdigest()
+
+    def reusable(self, key, fingerprint):
+        """Return True if files of the job are the same than in previous sync"""
+        previous = self.previous_manifest.get(key)
+        if fingerprint is None or previous is None or previous['fingerprint'] != fingerprint:
+            return False
+        return all(os.path.isfile(os.path.join(self.dst_root, name)) for name in previous['files'])
+
+    def link_previous_files(self, key):
+        """Link files of the job from previous sync, return its manifest entry"""
+        previous = self.previous_manifest[key]
+        for name in previous['files']:
+            fullname = os.path.join(self.tmp_root, name)
+            self.mkdirs(fullname)
+            if not os.path.isfile(fullname):
+                os.link(os.path.join(self.dst_root, name), fullname)
+        return previous
+
+    def load_manifest(self, fingerprint):
+        """Return jobs of previous incremental sync, if it used the same options and settings"""
+        try:
+            with open(os.path.join(self.dst_root, self.manifest_name)) as f:
+                manifest = json.load(f)
+        except (IOError, ValueError):
+            return {}
+        if manifest.get('fingerprint') != fingerprint:
+            return {}
+        return manifest['jobs']
+
+    def save_manifest(self):
+        with open(os.path.join(self.tmp_root, self.manifest_name), 'w') as f:
+            json.dump({'fingerprint': self.manifest_fingerprint, 'jobs': self.manifest}, f)
+
+
+def init_worker(command):
+    global worker_command
+    worker_command = command
+
+
+def run_worker_job(job):
+    return worker_command.run_job(*job)
+
+
+class Command(SyncManifestMixin, BaseCommand):
+    manifest_name = 'sync_rando.json'
+    # Settings and models used by outputs of every object (see ``incremental``)
+    fingerprint_settings = ('SRID', 'API_SRID', 'PUBLISHED_BY_LANG', 'TREKKING_TOPOLOGY_ENABLED',
+                            'TREK_POI_INTERSECTION_MARGIN', 'TOURISM_INTERSECTION_MARGIN',
+                            'SENSITIVE_AREA_INTERSECTION_MARGIN', 'THUMBNAIL_COPYRIGHT_FORMAT',
+                            'THUMBNAIL_COPYRIGHT_SIZE', 'MOBILE_TILES_URL', 'MOBILE_TILES_EXTENSION',
+                            'MOBILE_TILES_RADIUS_LARGE', 'MOBILE_TILES_RADIUS_SMALL',
+                            'MOBILE_TILES_LOW_ZOOMS', 'MOBILE_TILES_HIGH_ZOOMS')
+    fingerprint_models = (common_models.Theme, common_models.RecordSource, common_models.TargetPortal,
+                          trekking_models.TrekNetwork, trekking_models.Practice, trekking_models.Accessibility,
+                          trekking_models.Route, trekking_models.DifficultyLevel, trekking_models.WebLinkCategory,
+                          trekking_models.POIType, trekking_models.ServiceType,
+                          tourism_models.InformationDeskType, tourism_models.TouristicContentCategory,
+                          tourism_models.TouristicContentType, tourism_models.TouristicEventType,
+                          infrastructure_models.InfrastructureType)
 
-class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument('path')
         parser.add_argument('--url', '-u', dest='url', default='http://localhost', help='Base url')
@@ -105,6 +560,12 @@ class Command(BaseCommand):
                             help='Skip generation of PDF files')
         parser.add_argument('--skip-tiles', '-t', action='store_true', dest='skip_tiles', default=False,
                             help='Skip generation of zip tiles files')
+        parser.add_argument('--mbtiles', '-m', action='store_true', dest='mbtiles', default=False,
+                            help='Generate MBTiles files instead of zip tiles files. '
+                                 'Trek files only contain tiles missing from global file')
+        parser.add_argument('--precompress', '-z', action='store_true', dest='precompress', default=False,
+                            help='Write gzip (and brotli if installed) compressed copies of text files, '
+                                 'for nginx gzip_static')
         parser.add_argument('--skip-dem', '-d', action='store_true', dest='skip_dem', default=False,
                             help='Skip generation of DEM files for 3D')
         parser.add_argument('--skip-profile-png', '-e', action='store_true', dest='skip_profile_png', default=False,
@@ -119,22 +580,26 @@ class Command(BaseCommand):
                             help='include signages')
         parser.add_argument('--with-infrastructures', '-i', action='store_true', dest='with_infrastructures',
                             default=False, help='include infrastructures')
-
-    def mkdirs(self, name):
-        dirname = os.path.dirname(name)
-        if not os.path.exists(dirname):
-            os.makedirs(dirname)
+        parser.add_argument('--workers', '-W', dest='workers', type=int, default=1,
+                            help='Number of processes rendering treks, touristic contents and events, '
+                                 'and trek tiles (default 1)')
+        parser.add_argument('--incremental', '-I', action='store_true', dest='incremental', default=False,
+                            help='Only render treks, touristic contents and events which changed since '
+                                 'last incremental sync, link other ones from previous sync')
+        parser.add_argument('--report', '-R', dest='report', default=None,
+                            help='Write timings and sizes of sync steps in this JSON file')
 
     def sync_global_tiles(self):
         """ Creates a tiles file on the global extent.
         """
-        zipname = os.path.join('zip', 'tiles', 'global.zip')
+        zipname = os.path.join('zip', 'tiles', 'global.mbtiles' if self.mbtiles else 'global.zip')
 
         if self.verbosity == 2:
             self.stdout.write(u"\x1b[36m**\x1b[0m \x1b[1m{name}\x1b[0m ...".format(name=zipname), ending="")
             self.stdout.flush()
 
         global_extent = settings.LEAFLET_CONFIG['SPATIAL_EXTENT']
+        start = time()
 
         logger.info("Global extent is %s" % unicode(global_extent))
         global_file = os.path.join(self.tmp_root, zipname)
@@ -142,23 +607,39 @@ class Command(BaseCommand):
         logger.info("Build global tiles file...")
         self.mkdirs(global_file)
 
-        zipfile = ZipFile(global_file, 'w')
-        tiles = ZipTilesBuilder(zipfile, **self.builder_args)
+        if self.mbtiles:
+            tiles = MBTilesBuilder(global_file, **self.builder_args)
+        else:
+            zipfile = SyncZipFile(global_file, 'w')
+            tiles = ZipTilesBuilder(zipfile, **self.builder_args)
         tiles.add_coverage(bbox=global_extent,
                            zoomlevels=settings.MOBILE_TILES_GLOBAL_ZOOMS)
         tiles.run()
-        self.close_zip(zipfile, zipname)
+        self.report.add('tiles', zipname, start, 'generated', tiles.bytes)
+        if self.mbtiles:
+            self.close_mbtiles(zipname)
+        else:
+            self.close_zip(zipfile, zipname)
+
+    def global_tiles(self):
+        """ Tiles of the global extent, left out of trek MBTiles files.
+        """
+        tiles = TilesBuilder(**self.builder_args)
+        tiles.add_coverage(bbox=settings.LEAFLET_CONFIG['SPATIAL_EXTENT'],
+                           zoomlevels=settings.MOBILE_TILES_GLOBAL_ZOOMS)
+        return frozenset(tiles.tiles)
 
     def sync_trek_tiles(self, trek):
         """ Creates a tiles file for the specified Trek object.
         """
-        zipname = os.path.join('zip', 'tiles', '{pk}.zip'.format(pk=trek.pk))
+        zipname = os.path.join('zip', 'tiles', '{pk}.{ext}'.format(pk=trek.pk, ext='mbtiles' if self.mbtiles else 'zip'))
 
         if self.verbosity == 2:
             self.stdout.write(u"\x1b[36m**\x1b[0m \x1b[1m{name}\x1b[0m ...".format(name=zipname), ending="")
             self.stdout.flush()
 
         trek_file = os.path.join(self.tmp_root, zipname)
+        start = time()
 
         def _radius2bbox(lng, lat, radius):
             return (lng - radius, lat - radius,
@@ -166,8 +647,12 @@ class Command(BaseCommand):
 
         self.mkdirs(trek_file)
 
-        zipfile = ZipFile(trek_file, 'w')
-        tiles = ZipTilesBuilder(zipfile, **self.builder_args)
+        if self.mbtiles:
+            tiles = MBTilesBuilder(trek_file, exclude=self.memo.get('tiles', 'global', self.global_tiles),
+                                   **self.builder_args)
+        else:
+            zipfile = SyncZipFile(trek_file, 'w')
+            tiles = ZipTilesBuilder(zipfile, **self.builder_args)
 
         geom = trek.geom
         if geom.geom_type == 'MultiLineString':
@@ -181,14 +666,62 @@ class Command(BaseCommand):
             tiles.add_coverage(bbox=small, zoomlevels=settings.MOBILE_TILES_HIGH_ZOOMS)
 
         tiles.run()
-        self.close_zip(zipfile, zipname)
+        self.report.add('tiles', zipname, start, 'generated', tiles.bytes)
+        if self.mbtiles:
+            self.close_mbtiles(zipname)
+        else:
+            self.close_zip(zipfile, zipname)
+
+    def close_mbtiles(self, name):
+        self.record(name)
+        if self.verbosity == 2:
+            self.stdout.write(u"\x1b[3D\x1b[32mgenerated\x1b[0m")
 
-    def sync_view(self, lang, view, name, url='/', params={}, zipfile=None, fix2028=False, **kwargs):
+    def sync_view(self, lang, view, name, url='/', params={}, zipfile=None, fix2028=False, memo_key=None, **kwargs):
+        """
+        Render the view into file ``name``. If ``memo_key`` is given, the view output does not
+        depend on language and the file rendered for the first language is linked for the others.
+        """
         if self.verbosity == 2:
             self.stdout.write(u"\x1b[36m{lang}\x1b[0m \x1b[1m{name}\x1b[0m ...".format(lang=lang, name=name), ending="")
             self.stdout.flush()
+        start = time()
         fullname = os.path.join(self.tmp_root, name)
         self.mkdirs(fullname)
+        if memo_key is None:
+            rendered = self.render_view(lang, view, fullname, url, params, fix2028, **kwargs)
+        else:
+            def render():
+                if self.render_view(lang, view, fullname, url, params, fix2028, **kwargs):
+                    return fullname
+            source = self.memo.get(memo_key[0], memo_key[1:], render)
+            rendered = source is not None
+            if rendered and source != fullname:
+                os.link(source, fullname)
+        if not rendered:
+            self.report.add('view', name, start, 'failed')
+            return
+        self.record(name)
+        oldfilename = os.path.join(self.dst_root, name)
+        # If new file is identical to old one, don't recreate it. This will help backup
+        unchanged = os.path.isfile(oldfilename) and filecmp.cmp(fullname, oldfilename)
+        if unchanged:
+            os.unlink(fullname)
+            os.link(oldfilename, fullname)
+            if self.verbosity == 2:
+                self.stdout.write(u"\x1b[3D\x1b[32munchanged\x1b[0m")
+        else:
+            if self.verbosity == 2:
+                self.stdout.write(u"\x1b[3D\x1b[32mgenerated\x1b[0m")
+        if self.precompress and os.path.splitext(name)[1] in SyncZipFile.compressible:
+            for suffix in precompress(fullname, oldfilename if unchanged else None):
+                self.record(name + suffix)
+        if zipfile:
+            zipfile.write(fullname, name)
+        self.report.add('view', name, start, 'unchanged' if unchanged else 'generated', os.path.getsize(fullname))
+
+    def render_view(self, lang, view, fullname, url, params, fix2028, **kwargs):
+        """Write the view response into ``fullname``, return False if it failed"""
         request = self.factory.get(url, params, HTTP_HOST=self.host)
         request.LANGUAGE_CODE = lang
         request.user = AnonymousUser()
@@ -200,37 +733,23 @@ class Command(BaseCommand):
             self.successfull = False
             if self.verbosity == 2:
                 self.stdout.write(u"\x1b[3D\x1b[31mfailed ({})\x1b[0m".format(e))
-            return
+            return False
         if response.status_code != 200:
             self.successfull = False
             if self.verbosity == 2:
                 self.stdout.write(u"\x1b[3D\x1b[31;1mfailed (HTTP {code})\x1b[0m".format(code=response.status_code))
-            return
-        f = open(fullname, 'w')
+            return False
         if isinstance(response, StreamingHttpResponse):
-            content = b''.join(response.streaming_content)
+            chunks = response.streaming_content
         else:
-            content = response.content
+            chunks = [response.content]
         # Fix strange unicode characters 2028 and 2029 that make Geotrek-rando crash
         if fix2028:
-            content = content.replace('\\u2028', '\\n')
-            content = content.replace('\\u2029', '\\n')
-        f.write(content)
-        f.close()
-        oldfilename = os.path.join(self.dst_root, name)
-        # If new file is identical to old one, don't recreate it. This will help backup
-        if os.path.isfile(oldfilename) and filecmp.cmp(fullname, oldfilename):
-            os.unlink(fullname)
-            os.link(oldfilename, fullname)
-            if self.verbosity == 2:
-                self.stdout.write(u"\x1b[3D\x1b[32munchanged\x1b[0m")
-        else:
-            if self.verbosity == 2:
-                self.stdout.write(u"\x1b[3D\x1b[32mgenerated\x1b[0m")
-        # FixMe: Find why there are duplicate files.
-        if zipfile:
-            if name not in zipfile.namelist():
-                zipfile.write(fullname, name)
+            chunks = fix2028_chunks(chunks)
+        with open(fullname, 'w') as f:
+            for chunk in chunks:
+                f.write(chunk)
+        return True
 
     def sync_json(self, lang, viewset, name, zipfile=None, params={}, as_view_args=[], **kwargs):
         view = viewset.as_view(*as_view_args)
@@ -296,7 +815,8 @@ class Command(BaseCommand):
 
     def sync_profile_json(self, lang, obj, zipfile=None):
         view = ElevationProfile.as_view(model=type(obj))
-        self.sync_object_view(lang, obj, view, 'profile.json', zipfile=zipfile)
+        memo_key = ('profiles', obj._meta.model_name, obj.pk)
+        self.sync_object_view(lang, obj, view, 'profile.json', zipfile=zipfile, memo_key=memo_key)
 
     def sync_profile_png(self, lang, obj, zipfile=None):
         view = serve_elevation_chart
@@ -307,7 +827,8 @@ class Command(BaseCommand):
         if self.skip_dem:
             return
         view = ElevationArea.as_view(model=type(obj))
-        self.sync_object_view(lang, obj, view, 'dem.json')
+        memo_key = ('dems', obj._meta.model_name, obj.pk)
+        self.sync_object_view(lang, obj, view, 'dem.json', memo_key=memo_key)
 
     def sync_gpx(self, lang, obj):
         self.sync_object_view(lang, obj, TrekGPXDetail.as_view(), '{obj.slug}.gpx')
@@ -334,14 +855,22 @@ class Command(BaseCommand):
                        params={'rando_url': self.rando_url})
 
     def sync_file(self, lang, name, src_root, url, zipfile=None):
+        start = time()
         url = url.strip('/')
         src = os.path.join(src_root, name)
         dst = os.path.join(self.tmp_root, url, name)
         self.mkdirs(dst)
         if not os.path.isfile(dst):
-            os.link(src, dst)
+            try:
+                os.link(src, dst)
+            except OSError as e:
+                # Linked meanwhile by another worker
+                if e.errno != errno.EEXIST:
+                    raise
+        self.record(os.path.join(url, name))
         if zipfile:
             zipfile.write(dst, os.path.join(url, name))
+        self.report.add('file', os.path.join(url, name), start, 'copied', os.path.getsize(dst))
         if self.verbosity == 2:
             self.stdout.write(u"\x1b[36m{lang}\x1b[0m \x1b[1m{url}/{name}\x1b[0m \x1b[32mcopied\x1b[0m".format(lang=lang, url=url, name=name))
 
@@ -353,25 +882,39 @@ class Command(BaseCommand):
             self.sync_file(lang, field.name, settings.MEDIA_ROOT, settings.MEDIA_URL, zipfile=zipfile)
 
     def sync_pictograms(self, lang, model, zipfile=None):
-        for obj in model.objects.all():
-            self.sync_media_file(lang, obj.pictogram, zipfile=zipfile)
+        pictograms = self.memo.get('pictograms', model._meta.label,
+                                   lambda: [obj.pictogram for obj in model.objects.all()])
+        for pictogram in pictograms:
+            self.sync_media_file(lang, pictogram, zipfile=zipfile)
+
+    def resized_pictures(self, obj):
+        key = (obj._meta.model_name, obj.pk)
+        return self.memo.get('pictures', key, lambda: obj.resized_pictures)
+
+    def attached_files(self, obj):
+        key = (obj._meta.model_name, obj.pk)
+        return self.memo.get('files', key, lambda: obj.files)
+
+    def trek_pois(self, trek):
+        """POIs of the trek published in current language, spatial query is shared by languages"""
+        pois = self.memo.get('pois', trek.pk, lambda: list(trek.pois))
+        return [poi for poi in pois if poi.published]
 
     def sync_poi_media(self, lang, poi):
-        if poi.resized_pictures:
-            self.sync_media_file(lang, poi.resized_pictures[0][1], zipfile=self.trek_zipfile)
-        for picture, resized in poi.resized_pictures[1:]:
+        resized_pictures = self.resized_pictures(poi)
+        if resized_pictures:
+            self.sync_media_file(lang, resized_pictures[0][1], zipfile=self.trek_zipfile)
+        for picture, resized in resized_pictures[1:]:
             self.sync_media_file(lang, resized)
-        for other_file in poi.files:
+        for other_file in self.attached_files(poi):
             self.sync_media_file(lang, other_file.attachment_file)
 
     def sync_trek(self, lang, trek):
         zipname = os.path.join('zip', 'treks', lang, '{pk}.zip'.format(pk=trek.pk))
         zipfullname = os.path.join(self.tmp_root, zipname)
         self.mkdirs(zipfullname)
-        self.trek_zipfile = ZipFile(zipfullname, 'w')
+        self.trek_zipfile = SyncZipFile(zipfullname, 'w')
 
-        self.sync_json(lang, ParametersView, 'parameters', zipfile=self.zipfile)
-        self.sync_json(lang, ThemeViewSet, 'themes', as_view_args=[{'get': 'list'}], zipfile=self.zipfile)
         self.sync_trek_pois(lang, trek, zipfile=self.zipfile)
         if self.with_infrastructures:
             self.sync_trek_infrastructures(lang, trek)
@@ -386,12 +929,14 @@ class Command(BaseCommand):
         if not self.skip_profile_png:
             self.sync_profile_png(lang, trek, zipfile=self.zipfile)
         self.sync_dem(lang, trek)
-        for desk in trek.information_desks.all():
-            self.sync_media_file(lang, desk.thumbnail, zipfile=self.trek_zipfile)
-        for poi in trek.published_pois:
+        desks = self.memo.get('desks', trek.pk, lambda: [desk.thumbnail for desk in trek.information_desks.all()])
+        for thumbnail in desks:
+            self.sync_media_file(lang, thumbnail, zipfile=self.trek_zipfile)
+        for poi in self.trek_pois(trek):
             self.sync_poi_media(lang, poi)
-        self.sync_media_file(lang, trek.thumbnail, zipfile=self.zipfile)
-        for picture, resized in trek.resized_pictures:
+        thumbnail = self.memo.get('thumbnails', trek.pk, lambda: trek.thumbnail)
+        self.sync_media_file(lang, thumbnail, zipfile=self.zipfile)
+        for picture, resized in self.resized_pictures(trek):
             self.sync_media_file(lang, resized, zipfile=self.trek_zipfile)
 
         if self.with_events:
@@ -410,6 +955,7 @@ class Command(BaseCommand):
         self.close_zip(self.trek_zipfile, zipname)
 
     def close_zip(self, zipfile, name):
+        start = time()
         oldzipfilename = os.path.join(self.dst_root, name)
         zipfilename = os.path.join(self.tmp_root, name)
         try:
@@ -426,6 +972,8 @@ class Command(BaseCommand):
         if uptodate:
             stat = os.stat(oldzipfilename)
             os.utime(zipfilename, (stat.st_atime, stat.st_mtime))
+        self.record(name)
+        self.report.add('zip', name, start, 'unchanged' if uptodate else 'generated', os.path.getsize(zipfilename))
 
         if self.verbosity == 2:
             if uptodate:
@@ -448,7 +996,7 @@ class Command(BaseCommand):
         zipname = os.path.join('zip', 'treks', lang, 'global.zip')
         zipfullname = os.path.join(self.tmp_root, zipname)
         self.mkdirs(zipfullname)
-        self.zipfile = ZipFile(zipfullname, 'w')
+        self.zipfile = SyncZipFile(zipfullname, 'w')
 
         self.sync_geojson(lang, TrekViewSet, 'treks.geojson', zipfile=self.zipfile)
         self.sync_geojson(lang, POIViewSet, 'pois.geojson')
@@ -479,21 +1027,10 @@ class Command(BaseCommand):
         self.sync_pictograms(lang, trekking_models.Route, zipfile=self.zipfile)
         self.sync_pictograms(lang, trekking_models.WebLinkCategory)
 
-        treks = trekking_models.Trek.objects.existing().order_by('pk')
-        treks = treks.filter(
-            Q(**{'published_{lang}'.format(lang=lang): True})
-            | Q(**{'trek_parents__parent__published_{lang}'.format(lang=lang): True,
-                   'trek_parents__parent__deleted': False})
-        )
-
-        if self.source:
-            treks = treks.filter(source__name__in=self.source)
-
-        if self.portal:
-            treks = treks.filter(Q(portal__name__in=self.portal) | Q(portal=None))
-
-        for trek in treks:
-            self.sync_trek(lang, trek)
+        # Shared by treks, written once here rather than by each (possibly parallel) trek job
+        self.sync_json(lang, ParametersView, 'parameters', zipfile=self.zipfile)
+        self.sync_json(lang, ThemeViewSet, 'themes', as_view_args=[{'get': 'list'}], zipfile=self.zipfile)
+        self.run_jobs('sync_trek', lang, self.published_treks(lang))
 
         self.sync_tourism(lang)
         self.sync_meta(lang)
@@ -508,30 +1045,12 @@ class Command(BaseCommand):
 
     def sync_tiles(self):
         if not self.skip_tiles:
-
-            if self.celery_task:
-                self.celery_task.update_state(
-                    state='PROGRESS',
-                    meta={
-                        'name': self.celery_task.name,
-                        'current': 10,
-                        'total': 100,
-                        'infos': u"{}".format(_(u"Global tiles syncing ..."))
-                    }
-                )
+            self.report.units_total += 1
+            self.progress(u"{}".format(_(u"Global tiles syncing ...")))
 
             self.sync_global_tiles()
 
-            if self.celery_task:
-                self.celery_task.update_state(
-                    state='PROGRESS',
-                    meta={
-                        'name': self.celery_task.name,
-                        'current': 20,
-                        'total': 100,
-                        'infos': u"{}".format(_(u"Trek tiles syncing ..."))
-                    }
-                )
+            self.progress(u"{}".format(_(u"Trek tiles syncing ...")), units=1)
 
             treks = trekking_models.Trek.objects.existing().order_by('pk')
             if self.source:
@@ -540,20 +1059,12 @@ class Command(BaseCommand):
             if self.portal:
                 treks = treks.filter(Q(portal__name__in=self.portal) | Q(portal=None))
 
-            for trek in treks:
-                if trek.any_published or any([parent.any_published for parent in trek.parents]):
-                    self.sync_trek_tiles(trek)
+            treks = [trek for trek in treks
+                     if trek.any_published or any([parent.any_published for parent in trek.parents])]
+            self.report.units_total += len(treks)
+            self.run_jobs('sync_trek_tiles', None, treks)
 
-            if self.celery_task:
-                self.celery_task.update_state(
-                    state='PROGRESS',
-                    meta={
-                        'name': self.celery_task.name,
-                        'current': 30,
-                        'total': 100,
-                        'infos': u"{}".format(_(u"Tiles synced ..."))
-                    }
-                )
+            self.progress(u"{}".format(_(u"Tiles synced ...")))
 
     def sync_content(self, lang, content):
         self.sync_touristiccontent_meta(lang, content)
@@ -566,7 +1077,7 @@ class Command(BaseCommand):
             view = tourism_views.TouristicContentDocumentPublic.as_view(model=type(content))
             self.sync_object_view(lang, content, view, '{obj.slug}.pdf', params=params)
 
-        for picture, resized in content.resized_pictures:
+        for picture, resized in self.resized_pictures(content):
             self.sync_media_file(lang, resized)
 
     def sync_event(self, lang, event):
@@ -581,7 +1092,7 @@ class Command(BaseCommand):
             view = tourism_views.TouristicEventDocumentPublic.as_view(model=type(event))
             self.sync_object_view(lang, event, view, '{obj.slug}.pdf', params=params)
 
-        for picture, resized in event.resized_pictures:
+        for picture, resized in self.resized_pictures(event):
             self.sync_media_file(lang, resized)
 
     def sync_sensitiveareas(self, lang):
@@ -599,6 +1110,34 @@ class Command(BaseCommand):
         name = os.path.join('api', lang, 'treks', str(trek.pk), 'sensitiveareas.geojson')
         self.sync_view(lang, view, name, params=params, pk=trek.pk)
 
+    def published_treks(self, lang):
+        treks = trekking_models.Trek.objects.existing().order_by('pk')
+        treks = treks.filter(
+            Q(**{'published_{lang}'.format(lang=lang): True})
+            | Q(**{'trek_parents__parent__published_{lang}'.format(lang=lang): True,
+                   'trek_parents__parent__deleted': False})
+        )
+
+        if self.source:
+            treks = treks.filter(source__name__in=self.source)
+
+        if self.portal:
+            treks = treks.filter(Q(portal__name__in=self.portal) | Q(portal=None))
+
+        return treks
+
+    def published_objects(self, model, lang):
+        objs = model.objects.existing().order_by('pk')
+        objs = objs.filter(**{'published_{lang}'.format(lang=lang): True})
+
+        if self.source:
+            objs = objs.filter(source__name__in=self.source)
+
+        if self.portal:
+            objs = objs.filter(Q(portal__name__in=self.portal) | Q(portal=None))
+
+        return objs
+
     def sync_tourism(self, lang):
         self.sync_geojson(lang, tourism_views.TouristicContentViewSet, 'touristiccontents.geojson')
         self.sync_geojson(lang, tourism_views.TouristicEventViewSet, 'touristicevents.geojson',
@@ -628,29 +1167,8 @@ class Command(BaseCommand):
         for category in tourism_models.TouristicContentCategory.objects.all():
             self.sync_media_file(lang, category.pictogram, zipfile=self.zipfile)
 
-        contents = tourism_models.TouristicContent.objects.existing().order_by('pk')
-        contents = contents.filter(**{'published_{lang}'.format(lang=lang): True})
-
-        if self.source:
-            contents = contents.filter(source__name__in=self.source)
-
-        if self.portal:
-            contents = contents.filter(Q(portal__name__in=self.portal) | Q(portal=None))
-
-        for content in contents:
-            self.sync_content(lang, content)
-
-        events = tourism_models.TouristicEvent.objects.existing().order_by('pk')
-        events = events.filter(**{'published_{lang}'.format(lang=lang): True})
-
-        if self.source:
-            events = events.filter(source__name__in=self.source)
-
-        if self.portal:
-            events = events.filter(Q(portal__name__in=self.portal) | Q(portal=None))
-
-        for event in events:
-            self.sync_event(lang, event)
+        self.run_jobs('sync_content', lang, self.published_objects(tourism_models.TouristicContent, lang))
+        self.run_jobs('sync_event', lang, self.published_objects(tourism_models.TouristicEvent, lang))
 
         # Information desks
         self.sync_geojson(lang, tourism_views.InformationDeskViewSet, 'information_desks.geojson')
@@ -670,7 +1188,8 @@ class Command(BaseCommand):
         name = os.path.join('api', lang, 'treks', str(trek.pk), 'touristiccontents.geojson')
         self.sync_view(lang, view, name, params=params, zipfile=zipfile, pk=trek.pk)
 
-        for content in trek.touristic_contents.all():
+        contents = self.memo.get('touristiccontents', trek.pk, lambda: list(trek.touristic_contents.all()))
+        for content in contents:
             self.sync_touristiccontent_media(lang, content, zipfile=self.trek_zipfile)
 
     def sync_trek_touristicevents(self, lang, trek, zipfile=None):
@@ -680,44 +1199,194 @@ class Command(BaseCommand):
         name = os.path.join('api', lang, 'treks', str(trek.pk), 'touristicevents.geojson')
         self.sync_view(lang, view, name, params=params, zipfile=zipfile, pk=trek.pk)
 
-        for event in trek.touristic_events.all():
+        events = self.memo.get('touristicevents', trek.pk, lambda: list(trek.touristic_events.all()))
+        for event in events:
             self.sync_touristicevent_media(lang, event, zipfile=self.trek_zipfile)
 
     def sync_touristicevent_media(self, lang, event, zipfile=None):
-        if event.resized_pictures:
-            self.sync_media_file(lang, event.resized_pictures[0][1], zipfile=zipfile)
-        for picture, resized in event.resized_pictures[1:]:
+        resized_pictures = self.resized_pictures(event)
+        if resized_pictures:
+            self.sync_media_file(lang, resized_pictures[0][1], zipfile=zipfile)
+        for picture, resized in resized_pictures[1:]:
             self.sync_media_file(lang, resized)
 
     def sync_touristiccontent_media(self, lang, content, zipfile=None):
-        if content.resized_pictures:
-            self.sync_media_file(lang, content.resized_pictures[0][1], zipfile=zipfile)
-        for picture, resized in content.resized_pictures[1:]:
+        resized_pictures = self.resized_pictures(content)
+        if resized_pictures:
+            self.sync_media_file(lang, resized_pictures[0][1], zipfile=zipfile)
+        for picture, resized in resized_pictures[1:]:
             self.sync_media_file(lang, resized)
 
+    def run_jobs(self, method, lang, objs):
+        """
+        Call ``method`` for each object, in worker processes if any. Entries of the global
+        zip and output of workers are written by the parent process, in objects order.
+        In incremental mode, files of unchanged objects are linked from previous sync.
+        """
+        jobs = []
+        pending = []
+        for obj in objs:
+            key = u'{}:{}:{}'.format(method, lang or '', obj.pk)
+            fingerprint = self.fingerprint(method, obj) if self.incremental else None
+            reusable = self.reusable(key, fingerprint)
+            jobs.append((obj, key, fingerprint, reusable))
+            if not reusable:
+                pending.append(obj)
+
+        if self.pool is None:
+            results = (('', ) + self.call_job(method, lang, obj) + ({}, {}, {}, {}) for obj in pending)
+        else:
+            results = self.pool.imap(run_worker_job, [(method, lang, type(obj), obj.pk) for obj in pending])
+
+        for obj, key, fingerprint, reusable in jobs:
+            if reusable:
+                start = time()
+                files, arcnames = self.reuse_job(key)
+                successfull = True
+                self.report.add('job', key, start, 'unchanged')
+            else:
+                output, files, arcnames, successfull, hits, misses, steps, slowest = next(results)
+                self.stdout.write(output, ending='')
+                self.successfull = self.successfull and successfull
+                self.memo.add_stats(hits, misses)
+                self.report.merge(steps, slowest)
+            for arcname in arcnames:
+                self.zipfile.write(os.path.join(self.tmp_root, arcname), arcname)
+            if self.incremental and successfull:
+                self.manifest[key] = {'fingerprint': fingerprint, 'files': files, 'entries': arcnames}
+            self.progress(units=1)
+
+    def call_job(self, method, lang, obj):
+        """Call ``method`` for the object, return files written, entries of the global zip and success"""
+        zipfile, self.zipfile = getattr(self, 'zipfile', None), ZipEntries()
+        successfull, self.successfull = self.successfull, True
+        self.written = []
+        start = time()
+        try:
+            if lang is None:
+                getattr(self, method)(obj)
+            else:
+                getattr(self, method)(lang, obj)
+            return self.written, self.zipfile.namelist(), self.successfull
+        finally:
+            self.report.add('job', u'{}:{}:{}'.format(method, lang or '', obj.pk), start,
+                            'generated' if self.successfull else 'failed')
+            self.zipfile = zipfile
+            self.successfull = successfull and self.successfull
+            self.written = None
+
+    def run_job(self, method, lang, model, pk):
+        """Run one job of ``run_jobs()`` in a worker process"""
+        output = BytesIO()
+        self.stdout = OutputWrapper(output)
+        self.memo.hits.clear()
+        self.memo.misses.clear()
+        self.report.clear()
+        obj = model.objects.get(pk=pk)
+        if lang is not None:
+            translation.activate(lang)
+        try:
+            files, arcnames, successfull = self.call_job(method, lang, obj)
+        finally:
+            if lang is not None:
+                translation.deactivate()
+        return (output.getvalue(), files, arcnames, successfull, dict(self.memo.hits), dict(self.memo.misses),
+                self.report.steps, self.report.slowest)
+
+    def fingerprint(self, method, obj):
+        """Hash of the object, of objects its files depend on, and of their attachments"""
+        deps = [obj]
+        if method == 'sync_trek':
+            deps += self.memo.get('pois', obj.pk, lambda: list(obj.pois))
+            deps += list(obj.services)
+            deps += list(obj.information_desks.all())
+            deps += list(obj.parents) + list(obj.children)
+            if self.with_events:
+                deps += self.memo.get('touristicevents', obj.pk, lambda: list(obj.touristic_events.all()))
+            if self.categories:
+                deps += self.memo.get('touristiccontents', obj.pk, lambda: list(obj.touristic_contents.all()))
+            if self.with_signages:
+                deps += list(obj.signages)
+            if self.with_infrastructures:
+                deps += list(obj.infrastructures)
+            if 'geotrek.sensitivity' in settings.INSTALLED_APPS:
+                deps += list(obj.published_sensitive_areas)
+        return self.objects_fingerprint(deps)
+
+    def global_fingerprint(self, options):
+        """Hash of options, settings and reference tables used by files of every object"""
+        names = ('url', 'rando_url', 'source', 'portal', 'skip_pdf', 'skip_tiles', 'mbtiles', 'skip_dem', 'skip_profile_png',
+                 'precompress', 'with_events', 'content_categories', 'with_signages', 'with_infrastructures')
+        state = [geotrek.__version__]
+        state += [(name, options.get(name)) for name in names]
+        state += [(name, getattr(settings, name, None)) for name in self.fingerprint_settings]
+        for model in self.fingerprint_models:
+            state += [self.object_state(obj) for obj in model.objects.order_by('pk')]
+        return hashlib.md5(repr(state)).hexdigest()
+
+    def reuse_job(self, key):
+        """Link files of the job from previous sync, return files and entries of the global zip"""
+        previous = self.link_previous_files(key)
+        if self.verbosity == 2:
+            self.stdout.write(u"\x1b[36m{key}\x1b[0m \x1b[32munchanged\x1b[0m".format(key=key))
+        return previous['files'], previous['entries']
+
     def sync(self):
-        self.sync_tiles()
+        self.pool = None
+        if self.workers > 1:
+            # Workers open their own database connections
+            connections.close_all()
+            self.pool = Pool(self.workers, init_worker, (self, ))
+        try:
+            self.sync_languages()
+            if self.incremental:
+                self.save_manifest()
+        finally:
+            if self.pool is not None:
+                self.pool.close()
+                self.pool.join()
+
+    def progress(self, infos=None, units=0):
+        """Count work units done, and update progress of celery task"""
+        self.report.units_done += units
+        if infos is not None:
+            self.progress_infos = infos
+        if self.celery_task:
+            self.celery_task.update_state(
+                state='PROGRESS',
+                meta={
+                    'name': self.celery_task.name,
+                    'current': self.report.progress(),
+                    'total': 100,
+                    'infos': self.progress_infos
+                }
+            )
 
-        step_value = int(50 / len(settings.MODELTRANSLATION_LANGUAGES))
-        current_value = 30
+    def language_units(self, lang):
+        """Work units of a language: one by trek, touristic content and event, plus one"""
+        return (1 + self.published_treks(lang).count()
+                + self.published_objects(tourism_models.TouristicContent, lang).count()
+                + self.published_objects(tourism_models.TouristicEvent, lang).count())
+
+    def sync_languages(self):
+        units = {lang: self.language_units(lang) for lang in self.languages}
+        self.report.units_total += sum(units.values())
+
+        self.sync_tiles()
 
         for lang in self.languages:
-            if self.celery_task:
-                self.celery_task.update_state(
-                    state='PROGRESS',
-                    meta={
-                        'name': self.celery_task.name,
-                        'current': current_value + step_value,
-                        'total': 100,
-                        'infos': u"{} : {} ...".format(_(u"Language"), lang)
-                    }
-                )
-                current_value = current_value + step_value
+            units_done = self.report.units_done + units[lang]
+            self.progress(u"{} : {} ...".format(_(u"Language"), lang))
+            start = time()
 
             translation.activate(lang)
             self.sync_trekking(lang)
             translation.deactivate()
 
+            self.report.languages[lang] = time() - start
+            # Objects counted but not synced (published through their parents...)
+            self.report.units_done = units_done
+
         self.sync_static_file('**', 'tourism/touristicevent.svg')
         self.sync_pictograms('**', tourism_models.InformationDeskType)
         self.sync_pictograms('**', tourism_models.TouristicContentCategory)
@@ -728,7 +1397,7 @@ class Command(BaseCommand):
         if not os.path.exists(self.dst_root):
             return
         existing = set([os.path.basename(p) for p in os.listdir(self.dst_root)])
-        remaining = existing - set(('api', 'media', 'meta', 'static', 'zip'))
+        remaining = existing - set(('api', 'media', 'meta', 'static', 'zip', self.manifest_name))
         if remaining:
             raise CommandError(u"Destination directory contains extra data")
 
@@ -755,8 +1424,13 @@ class Command(BaseCommand):
         if self.rando_url.endswith('/'):
             self.rando_url = self.rando_url[:-1]
         self.factory = RequestFactory()
+        self.memo = SyncMemo()
+        self.report = SyncReport()
+        self.progress_infos = u""
         self.skip_pdf = options['skip_pdf']
         self.skip_tiles = options['skip_tiles']
+        self.mbtiles = options.get('mbtiles', False)
+        self.precompress = options.get('precompress', False)
         self.skip_dem = options['skip_dem']
         self.skip_profile_png = options['skip_profile_png']
         self.source = options['source']
@@ -775,6 +1449,20 @@ class Command(BaseCommand):
         self.with_signages = options.get('with_signages', False)
         self.with_infrastructures = options.get('with_infrastructures', False)
         self.celery_task = options.get('task', None)
+        self.workers = options.get('workers', 1)
+        if self.workers < 1:
+            raise CommandError('workers parameter should be at least 1')
+        if self.workers > 1 and (self.celery_task or current_process().daemon):
+            # Daemonic processes (like celery workers) are not allowed to have children
+            logger.warning("sync_rando runs in a daemonic process, workers are disabled")
+            self.workers = 1
+        self.written = None
+        self.incremental = options.get('incremental', False)
+        self.manifest = {}
+        self.previous_manifest = {}
+        if self.incremental:
+            self.manifest_fingerprint = self.global_fingerprint(options)
+            self.previous_manifest = self.load_manifest(self.manifest_fingerprint)
 
         if self.source is not None:
             self.source = self.source.split(',')
@@ -807,6 +1495,8 @@ class Command(BaseCommand):
             )
         try:
             self.sync()
+            if options.get('report'):
+                self.report.save(options['report'])
             if self.celery_task:
                 self.celery_task.update_state(
                     state='PROGRESS',
@@ -828,6 +1518,9 @@ class Command(BaseCommand):
             done_message = self.style.SUCCESS(done_message)
 
         if self.verbosity >= 1:
+            for kind, hits, total in self.memo.stats():
+                self.stdout.write(u"Cache {kind}: {hits}/{total} hits ({rate:.0%})".format(
+                    kind=kind, hits=hits, total=total, rate=float(hits) / total))
             self.stdout.write(done_message)
 
         if not self.successfull:
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trekking', '0008_auto_20190626_1514'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrekProximity',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('trek', models.IntegerField(db_column=b'itineraire', verbose_name='Trek')),
+                ('kind', models.CharField(db_column=b'kind', max_length=32, verbose_name='Kind')),
+                ('object', models.IntegerField(db_column=b'objet', db_index=True, verbose_name='Object')),
+                ('position', models.FloatField(db_column=b'position', verbose_name='Position')),
+                ('distance', models.FloatField(db_column=b'distance', verbose_name='Distance')),
+            ],
+            options={
+                'db_table': 'o_r_itineraire_proximite',
+                'verbose_name': 'Trek proximity',
+                'verbose_name_plural': 'Trek proximities',
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='trekproximity',
+            index_together=set([('trek', 'kind')]),
+        ),
+    ]
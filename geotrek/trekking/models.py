@@ -14,7 +14,7 @@ from mapentity.models import MapEntityMixin
 from mapentity.serializers import plain_text
 
 from geotrek.authent.models import StructureRelated
-from geotrek.core.models import Path, Topology
+from geotrek.core.models import Path, PathTopologyIndex, Topology
 from geotrek.common.utils import intersecting, classproperty
 from geotrek.common.mixins import (PicturesMixin, PublishableMixin,
                                    PictogramMixin, OptionalPictogramMixin)
@@ -263,10 +263,8 @@ class Trek(StructureRelated, PicturesMixin, PublishableMixin, MapEntityMixin, To
 
     @classmethod
     def path_treks(cls, path):
-        treks = cls.objects.existing().filter(aggregations__path=path)
-        # The following part prevents conflict with default trek ordering
-        # ProgrammingError: SELECT DISTINCT ON expressions must match initial ORDER BY expressions
-        return treks.order_by('topo_object').distinct('topo_object')
+        treks = cls.objects.existing().filter(pk__in=PathTopologyIndex.path_topologies(path, cls.KIND))
+        return treks.order_by('topo_object')
 
     @classmethod
     def topology_treks(cls, topology):
@@ -442,10 +440,63 @@ else:
     Topology.add_property('published_treks', lambda self: intersecting(Trek, self).filter(published=True), _(u"Published treks"))
 Intervention.add_property('treks', lambda self: self.topology.treks if self.topology else [], _(u"Treks"))
 Project.add_property('treks', lambda self: self.edges_by_attr('treks'), _(u"Treks"))
-tourism_models.TouristicContent.add_property('treks', lambda self: intersecting(Trek, self), _(u"Treks"))
-tourism_models.TouristicContent.add_property('published_treks', lambda self: intersecting(Trek, self).filter(published=True), _(u"Published treks"))
-tourism_models.TouristicEvent.add_property('treks', lambda self: intersecting(Trek, self), _(u"Treks"))
-tourism_models.TouristicEvent.add_property('published_treks', lambda self: intersecting(Trek, self).filter(published=True), _(u"Published treks"))
+tourism_models.TouristicContent.add_property('treks', lambda self: TrekProximity.treks(self), _(u"Treks"))
+tourism_models.TouristicContent.add_property('published_treks', lambda self: TrekProximity.treks(self).filter(published=True), _(u"Published treks"))
+tourism_models.TouristicEvent.add_property('treks', lambda self: TrekProximity.treks(self), _(u"Treks"))
+tourism_models.TouristicEvent.add_property('published_treks', lambda self: TrekProximity.treks(self).filter(published=True), _(u"Published treks"))
+Trek.add_property('touristic_contents', lambda self: TrekProximity.nearby(self, tourism_models.TouristicContent, self.distance(tourism_models.TouristicContent)), _(u"Touristic contents"))
+Trek.add_property('published_touristic_contents', lambda self: self.touristic_contents.filter(published=True), _(u"Published touristic contents"))
+Trek.add_property('touristic_events', lambda self: TrekProximity.nearby(self, tourism_models.TouristicEvent, self.distance(tourism_models.TouristicEvent)), _(u"Touristic events"))
+Trek.add_property('published_touristic_events', lambda self: self.touristic_events.filter(published=True), _(u"Published touristic events"))
+
+
+class TrekProximity(models.Model):
+    """
+    Objects near each trek, with their position along the trek and their distance.
+    Maintained by triggers (see sql/40_proximites.sql) within the largest margin,
+    and filtered by distance when read.
+    """
+    trek = models.IntegerField(db_column='itineraire', verbose_name=_(u"Trek"))
+    kind = models.CharField(max_length=32, db_column='kind', verbose_name=_(u"Kind"))
+    object = models.IntegerField(db_column='objet', db_index=True, verbose_name=_(u"Object"))
+    position = models.FloatField(db_column='position', verbose_name=_(u"Position"))
+    distance = models.FloatField(db_column='distance', verbose_name=_(u"Distance"))
+
+    class Meta:
+        db_table = 'o_r_itineraire_proximite'
+        verbose_name = _(u"Trek proximity")
+        verbose_name_plural = _(u"Trek proximities")
+        index_together = [('trek', 'kind')]
+
+    @classmethod
+    def kind_of(cls, model):
+        return model._meta.object_name.upper()
+
+    @classmethod
+    def nearby(cls, trek, model, distance):
+        """
+        Existing objects of the model within distance of the trek, ordered along the trek.
+        """
+        table = cls._meta.db_table
+        return model.objects.existing().extra(
+            tables=[table],
+            where=['{table}.objet = {model_table}.{pk}'.format(table=table, model_table=model._meta.db_table,
+                                                               pk=model._meta.pk.column),
+                   '{table}.itineraire = %s'.format(table=table),
+                   '{table}.kind = %s'.format(table=table),
+                   '{table}.distance <= %s'.format(table=table)],
+            params=[trek.pk, cls.kind_of(model), distance],
+            order_by=['{table}.position'.format(table=table)])
+
+    @classmethod
+    def treks(cls, obj, distance=None):
+        """
+        Existing treks within distance of the object (by default, the object association distance).
+        """
+        if distance is None:
+            distance = obj.distance(Trek)
+        pks = cls.objects.filter(kind=cls.kind_of(obj), object=obj.pk, distance__lte=distance).values('trek')
+        return Trek.objects.existing().filter(pk__in=pks)
 
 
 class TrekRelationshipManager(models.Manager):
@@ -694,13 +745,16 @@ class POI(StructureRelated, PicturesMixin, PublishableMixin, MapEntityMixin, Top
 
     @classmethod
     def path_pois(cls, path):
-        return cls.objects.existing().filter(aggregations__path=path).distinct('pk')
+        return cls.objects.existing().filter(pk__in=PathTopologyIndex.path_topologies(path, cls.KIND))
 
     @classmethod
     def topology_pois(cls, topology):
         if settings.TREKKING_TOPOLOGY_ENABLED:
             qs = cls.overlapping(topology)
             qs = cls.exclude_pois(qs, topology)
+        elif isinstance(topology, Trek):
+            qs = TrekProximity.nearby(topology, cls, settings.TREK_POI_INTERSECTION_MARGIN)
+            qs = cls.exclude_pois(qs, topology)
         else:
             area = topology.geom.buffer(settings.TREK_POI_INTERSECTION_MARGIN)
             qs = cls.objects.existing().filter(geom__intersects=area)
@@ -711,6 +765,8 @@ class POI(StructureRelated, PicturesMixin, PublishableMixin, MapEntityMixin, Top
     def topology_all_pois(cls, topology):
         if settings.TREKKING_TOPOLOGY_ENABLED:
             qs = cls.overlapping(topology)
+        elif isinstance(topology, Trek):
+            qs = TrekProximity.nearby(topology, cls, settings.TREK_POI_INTERSECTION_MARGIN)
         else:
             area = topology.geom.buffer(settings.TREK_POI_INTERSECTION_MARGIN)
             qs = cls.objects.existing().filter(geom__intersects=area)
@@ -832,12 +888,14 @@ class Service(StructureRelated, MapEntityMixin, Topology):
 
     @classmethod
     def path_services(cls, path):
-        return cls.objects.existing().filter(aggregations__path=path).distinct('pk')
+        return cls.objects.existing().filter(pk__in=PathTopologyIndex.path_topologies(path, cls.KIND))
 
     @classmethod
     def topology_services(cls, topology):
         if settings.TREKKING_TOPOLOGY_ENABLED:
             qs = cls.overlapping(topology)
+        elif isinstance(topology, Trek):
+            qs = TrekProximity.nearby(topology, cls, settings.TREK_POI_INTERSECTION_MARGIN)
         else:
             area = topology.geom.buffer(settings.TREK_POI_INTERSECTION_MARGIN)
             qs = cls.objects.existing().filter(geom__intersects=area)
@@ -0,0 +1,154 @@
+-------------------------------------------------------------------------------
+-- Objects near treks (see geotrek.trekking.models.TrekProximity)
+-- POIs and services (when not attached to paths), touristic contents and
+-- events are stored within the largest margin, and filtered when read.
+-------------------------------------------------------------------------------
+
+DROP VIEW IF EXISTS rando.o_v_proximite_itineraire;
+
+CREATE OR REPLACE VIEW rando.o_v_proximite_itineraire AS (
+	SELECT e.id, e.geom,
+	       GREATEST(COALESCE(p.distance, 0), {{TOURISM_INTERSECTION_MARGIN}}, {{TREK_POI_INTERSECTION_MARGIN}}) AS rayon
+	FROM o_t_itineraire AS i
+	JOIN e_t_evenement AS e ON i.evenement = e.id
+	LEFT JOIN o_b_pratique AS p ON i.pratique = p.id
+	WHERE e.supprime = FALSE AND e.geom IS NOT NULL
+);
+
+DROP VIEW IF EXISTS rando.o_v_proximite_objet;
+
+CREATE OR REPLACE VIEW rando.o_v_proximite_objet AS (
+	SELECT e.kind::varchar AS kind, e.id, e.geom::geometry AS geom
+	FROM e_t_evenement AS e
+	WHERE e.kind IN ('POI', 'SERVICE') AND e.supprime = FALSE AND NOT {{TREKKING_TOPOLOGY_ENABLED}}
+	UNION ALL
+	SELECT 'TOURISTICCONTENT'::varchar, c.id, c.geom::geometry
+	FROM t_t_contenu_touristique AS c
+	WHERE c.supprime = FALSE
+	UNION ALL
+	SELECT 'TOURISTICEVENT'::varchar, v.id, v.geom::geometry
+	FROM t_t_evenement_touristique AS v
+	WHERE v.supprime = FALSE
+);
+
+
+CREATE OR REPLACE FUNCTION rando.ft_proximite_itineraire(tid integer) RETURNS void AS $$
+BEGIN
+    DELETE FROM o_r_itineraire_proximite WHERE itineraire = tid;
+    INSERT INTO o_r_itineraire_proximite (itineraire, kind, objet, position, distance)
+        SELECT t.id, o.kind, o.id,
+               CASE WHEN GeometryType(t.geom) = 'LINESTRING'
+                    THEN ST_LineLocatePoint(t.geom, ST_ClosestPoint(t.geom, o.geom)) ELSE 0 END,
+               ST_Distance(t.geom, o.geom)
+        FROM o_v_proximite_itineraire t, o_v_proximite_objet o
+        WHERE t.id = tid AND ST_DWithin(t.geom, o.geom, t.rayon);
+END;
+$$ LANGUAGE plpgsql;
+
+
+CREATE OR REPLACE FUNCTION rando.ft_proximite_objet(okind varchar, oid integer) RETURNS void AS $$
+BEGIN
+    DELETE FROM o_r_itineraire_proximite WHERE kind = okind AND objet = oid;
+    INSERT INTO o_r_itineraire_proximite (itineraire, kind, objet, position, distance)
+        SELECT t.id, o.kind, o.id,
+               CASE WHEN GeometryType(t.geom) = 'LINESTRING'
+                    THEN ST_LineLocatePoint(t.geom, ST_ClosestPoint(t.geom, o.geom)) ELSE 0 END,
+               ST_Distance(t.geom, o.geom)
+        FROM o_v_proximite_itineraire t, o_v_proximite_objet o
+        WHERE o.kind = okind AND o.id = oid AND ST_DWithin(t.geom, o.geom, t.rayon);
+END;
+$$ LANGUAGE plpgsql;
+
+
+-------------------------------------------------------------------------------
+-- Refresh when treks, POIs or services change
+-------------------------------------------------------------------------------
+
+DROP TRIGGER IF EXISTS e_t_evenement_proximite_iu_tgr ON e_t_evenement;
+DROP TRIGGER IF EXISTS e_t_evenement_proximite_d_tgr ON e_t_evenement;
+
+CREATE OR REPLACE FUNCTION rando.evenement_proximite_iud() RETURNS trigger SECURITY DEFINER AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        DELETE FROM o_r_itineraire_proximite WHERE itineraire = OLD.id OR (kind = OLD.kind AND objet = OLD.id);
+    ELSIF NEW.kind = 'TREK' THEN
+        PERFORM ft_proximite_itineraire(NEW.id);
+    ELSIF NEW.kind IN ('POI', 'SERVICE') THEN
+        PERFORM ft_proximite_objet(NEW.kind, NEW.id);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER e_t_evenement_proximite_iu_tgr
+AFTER INSERT OR UPDATE OF geom, supprime ON e_t_evenement
+FOR EACH ROW WHEN (NEW.kind IN ('TREK', 'POI', 'SERVICE'))
+EXECUTE PROCEDURE evenement_proximite_iud();
+
+CREATE TRIGGER e_t_evenement_proximite_d_tgr
+AFTER DELETE ON e_t_evenement
+FOR EACH ROW WHEN (OLD.kind IN ('TREK', 'POI', 'SERVICE'))
+EXECUTE PROCEDURE evenement_proximite_iud();
+
+
+DROP TRIGGER IF EXISTS o_t_itineraire_proximite_iu_tgr ON o_t_itineraire;
+
+CREATE OR REPLACE FUNCTION rando.itineraire_proximite_iu() RETURNS trigger SECURITY DEFINER AS $$
+BEGIN
+    PERFORM ft_proximite_itineraire(NEW.evenement);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER o_t_itineraire_proximite_iu_tgr
+AFTER INSERT OR UPDATE OF pratique ON o_t_itineraire
+FOR EACH ROW EXECUTE PROCEDURE itineraire_proximite_iu();
+
+
+DROP TRIGGER IF EXISTS o_b_pratique_proximite_u_tgr ON o_b_pratique;
+
+CREATE OR REPLACE FUNCTION rando.pratique_proximite_u() RETURNS trigger SECURITY DEFINER AS $$
+BEGIN
+    PERFORM ft_proximite_itineraire(i.evenement) FROM o_t_itineraire i WHERE i.pratique = NEW.id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER o_b_pratique_proximite_u_tgr
+AFTER UPDATE OF distance ON o_b_pratique
+FOR EACH ROW EXECUTE PROCEDURE pratique_proximite_u();
+
+
+-------------------------------------------------------------------------------
+-- Refresh when touristic contents or events change
+-------------------------------------------------------------------------------
+
+DROP TRIGGER IF EXISTS t_t_contenu_touristique_proximite_iud_tgr ON t_t_contenu_touristique;
+DROP TRIGGER IF EXISTS t_t_evenement_touristique_proximite_iud_tgr ON t_t_evenement_touristique;
+
+CREATE OR REPLACE FUNCTION rando.tourisme_proximite_iud() RETURNS trigger SECURITY DEFINER AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        DELETE FROM o_r_itineraire_proximite WHERE kind = TG_ARGV[0] AND objet = OLD.id;
+    ELSE
+        PERFORM ft_proximite_objet(TG_ARGV[0], NEW.id);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER t_t_contenu_touristique_proximite_iud_tgr
+AFTER INSERT OR UPDATE OF geom, supprime OR DELETE ON t_t_contenu_touristique
+FOR EACH ROW EXECUTE PROCEDURE tourisme_proximite_iud('TOURISTICCONTENT');
+
+CREATE TRIGGER t_t_evenement_touristique_proximite_iud_tgr
+AFTER INSERT OR UPDATE OF geom, supprime OR DELETE ON t_t_evenement_touristique
+FOR EACH ROW EXECUTE PROCEDURE tourisme_proximite_iud('TOURISTICEVENT');
+
+
+-------------------------------------------------------------------------------
+-- Margins may have changed in settings: compute everything again
+-------------------------------------------------------------------------------
+
+DELETE FROM o_r_itineraire_proximite;
+SELECT ft_proximite_itineraire(id) FROM o_v_proximite_itineraire;
@@ -77,4 +77,14 @@ class LoadPOITest(TestCase):
     def test_pois_are_attached_to_paths(self):
         geom = GEOSGeometry('POINT(1 1)')
         poi = self.cmd.create_poi(geom, 'bridge', 'infra')
+        self.cmd.attach_pois()
         self.assertEquals([self.path], list(poi.paths.all()))
+
+    def test_pois_are_attached_by_batches(self):
+        self.cmd.batch_size = 2
+        poi1 = self.cmd.create_poi(GEOSGeometry('POINT(1 1)'), 'bridge', 'infra')
+        self.assertEquals([], list(poi1.paths.all()))
+        poi2 = self.cmd.create_poi(GEOSGeometry('POINT(1 1)'), 'bridge', 'infra')
+        self.assertEquals([self.path], list(poi1.paths.all()))
+        self.assertEquals([self.path], list(poi2.paths.all()))
+        self.assertEquals([], self.cmd.pending)
@@ -12,7 +12,8 @@ from geotrek.core.factories import PathFactory
 from geotrek.zoning.factories import DistrictFactory, CityFactory
 from geotrek.trekking.factories import (POIFactory, TrekFactory,
                                         TrekWithPOIsFactory, ServiceFactory)
-from geotrek.trekking.models import Trek, OrderedTrekChild
+from geotrek.trekking.models import Trek, OrderedTrekChild, TrekProximity
+from geotrek.tourism.factories import TouristicContentFactory
 
 
 class TrekTest(TranslationResetMixin, TestCase):
@@ -320,6 +321,40 @@ class TrekUpdateGeomTest(TestCase):
         self.assertEqual(db_trek.ambiance_en, 'Very special ambiance, for test purposes.')
 
 
+class TrekProximityTest(TestCase):
+    def setUp(self):
+        path = PathFactory.create(geom=LineString((0, 0), (1000, 0)))
+        self.trek = TrekFactory.create(no_path=True)
+        self.trek.add_path(path)
+        self.content1 = TouristicContentFactory.create(geom='SRID=%s;POINT(800 10)' % settings.SRID)
+        self.content2 = TouristicContentFactory.create(geom='SRID=%s;POINT(100 20)' % settings.SRID)
+
+    def test_contents_are_ordered_along_trek(self):
+        self.assertEqual(list(self.trek.touristic_contents), [self.content2, self.content1])
+        proximity = TrekProximity.objects.get(trek=self.trek.pk, object=self.content1.pk)
+        self.assertAlmostEqual(proximity.position, 0.8)
+        self.assertAlmostEqual(proximity.distance, 10)
+
+    def test_contents_are_read_in_one_query(self):
+        with self.assertNumQueries(1):
+            list(self.trek.published_touristic_contents)
+
+    @override_settings(TOURISM_INTERSECTION_MARGIN=15)
+    def test_contents_are_filtered_by_distance(self):
+        self.assertEqual(list(self.trek.touristic_contents), [self.content1])
+        self.assertEqual(list(self.content2.treks), [])
+
+    def test_proximity_follows_contents(self):
+        self.content1.geom = 'SRID=%s;POINT(800 5000)' % settings.SRID
+        self.content1.save()
+        self.content2.delete()
+        self.assertEqual(list(self.trek.touristic_contents), [])
+
+    def test_proximity_follows_treks(self):
+        self.trek.delete()
+        self.assertEqual(list(self.content1.treks), [])
+
+
 class TrekItinerancyTest(TestCase):
     def test_next_previous(self):
         trekA = TrekFactory(name=u"A")
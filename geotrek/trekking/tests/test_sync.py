@@ -1,13 +1,18 @@
 # -*- coding: utf-8 -*-
+import gzip
 import os
 import json
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
 from landez.sources import DownloadError
 import mock
 import shutil
 from io import BytesIO
+import sqlite3
+import tempfile
+import threading
 import zipfile
 
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase
 from django.conf import settings
 from django.core import management
 from django.core.management.base import CommandError
@@ -15,11 +20,14 @@ from django.http import HttpResponse, StreamingHttpResponse
 from django.test.utils import override_settings
 
 from geotrek.common.factories import RecordSourceFactory, TargetPortalFactory, AttachmentFactory
-from geotrek.common.utils.testdata import get_dummy_uploaded_image, get_dummy_uploaded_file
+from geotrek.common.utils.testdata import (get_dummy_uploaded_image, get_dummy_uploaded_file,
+                                           SyncWorkersTestMixin)
 from geotrek.infrastructure.factories import InfrastructureFactory
 from geotrek.sensitivity.factories import SensitiveAreaFactory
 from geotrek.signage.factories import SignageFactory
 from geotrek.trekking.factories import TrekFactory, TrekWithPublishedPOIsFactory
+from geotrek.trekking.management.commands.sync_rando import (ZipTilesBuilder, MBTilesBuilder, SyncZipFile,
+                                                             fix2028_chunks)
 from geotrek.trekking import models as trek_models
 from geotrek.tourism.factories import InformationDeskFactory, TouristicContentFactory, TouristicEventFactory
 
@@ -101,6 +109,129 @@ class SyncRandoTilesTest(TestCase):
         shutil.rmtree('tmp')
 
 
+class StubTileHandler(BaseHTTPRequestHandler):
+    paths = []
+
+    def do_GET(self):
+        self.paths.append(self.path)
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.end_headers()
+        self.wfile.write('I am a png')
+
+    def log_message(self, *args):
+        pass
+
+
+@override_settings(MOBILE_TILES_CACHE_EXPIRY=3600, MOBILE_TILES_CONCURRENCY=3)
+class StubTileServerTestCase(TestCase):
+    def setUp(self):
+        StubTileHandler.paths = []
+        self.server = HTTPServer(('localhost', 0), StubTileHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.tiles_url = 'http://localhost:{}/{{z}}/{{x}}/{{y}}.png'.format(self.server.server_address[1])
+        self.tiles_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        shutil.rmtree(self.tiles_dir)
+
+
+class ZipTilesBuilderTest(StubTileServerTestCase):
+    def build(self):
+        output = BytesIO()
+        with override_settings(MOBILE_TILES_URL=[self.tiles_url]):
+            with zipfile.ZipFile(output, 'w') as zfile:
+                tiles = ZipTilesBuilder(zfile, prefix='tiles/', tiles_url=self.tiles_url, tiles_dir=self.tiles_dir,
+                                        tiles_headers={}, ignore_errors=True)
+                tiles.add_coverage(bbox=(-170, -80, 170, 80), zoomlevels=[0, 1])
+                tiles.run()
+        return zipfile.ZipFile(output)
+
+    def test_tiles_are_downloaded_once(self):
+        zfile = self.build()
+        self.assertEqual(len(zfile.namelist()), 5)
+        self.assertEqual(zfile.read('tiles/0/0/0.png'), 'I am a png')
+        self.assertEqual(len(StubTileHandler.paths), 5)
+        zfile = self.build()
+        self.assertEqual(len(zfile.namelist()), 5)
+        self.assertEqual(len(StubTileHandler.paths), 5)
+
+    def test_identical_tiles_are_stored_once(self):
+        self.build()
+        objects = [name for dirpath, dirnames, names in os.walk(os.path.join(self.tiles_dir, 'objects'))
+                   for name in names]
+        self.assertEqual(len(objects), 1)
+
+    @override_settings(MOBILE_TILES_CACHE_EXPIRY=0)
+    def test_cache_disabled(self):
+        self.build()
+        self.build()
+        self.assertEqual(len(StubTileHandler.paths), 10)
+
+
+class MBTilesBuilderTest(StubTileServerTestCase):
+    def build(self, filename, exclude=frozenset()):
+        with override_settings(MOBILE_TILES_URL=[self.tiles_url]):
+            tiles = MBTilesBuilder(filename, exclude=exclude, tiles_url=self.tiles_url, tiles_dir=self.tiles_dir,
+                                   tiles_headers={}, ignore_errors=True)
+            tiles.add_coverage(bbox=(-170, -80, 170, 80), zoomlevels=[0, 1])
+            tiles.run()
+        return tiles
+
+    def test_mbtiles(self):
+        filename = os.path.join(self.tiles_dir, 'global.mbtiles')
+        self.build(filename)
+        db = sqlite3.connect(filename)
+        self.assertEqual(db.execute("SELECT COUNT(*) FROM tiles").fetchone()[0], 5)
+        self.assertEqual(db.execute("SELECT COUNT(*) FROM images").fetchone()[0], 1)
+        self.assertEqual(str(db.execute("SELECT tile_data FROM tiles WHERE zoom_level = 0").fetchone()[0]),
+                         'I am a png')
+        self.assertEqual(dict(db.execute("SELECT name, value FROM metadata"))['format'], 'png')
+        db.close()
+
+    def test_mbtiles_exclude(self):
+        filename = os.path.join(self.tiles_dir, 'trek.mbtiles')
+        self.build(filename, exclude=frozenset([(0, 0, 0), (1, 0, 0)]))
+        db = sqlite3.connect(filename)
+        rows = db.execute("SELECT zoom_level, tile_column, tile_row FROM tiles ORDER BY tile_column, tile_row")
+        self.assertEqual(list(rows), [(1, 0, 0), (1, 1, 0), (1, 1, 1)])
+        db.close()
+
+
+class SyncZipFileTest(TestCase):
+    def test_compression_by_type(self):
+        output = BytesIO()
+        with SyncZipFile(output, 'w') as zfile:
+            zfile.writestr('api/en/treks.geojson', '{}')
+            zfile.writestr('media/paperclip/picture.jpg', 'I am a jpg')
+        zfile = zipfile.ZipFile(output)
+        self.assertEqual(zfile.getinfo('api/en/treks.geojson').compress_type, zipfile.ZIP_DEFLATED)
+        self.assertEqual(zfile.getinfo('media/paperclip/picture.jpg').compress_type, zipfile.ZIP_STORED)
+
+    def test_explicit_compression(self):
+        output = BytesIO()
+        with SyncZipFile(output, 'w') as zfile:
+            zfile.writestr('api/en/treks.geojson', '{}', compress_type=zipfile.ZIP_STORED)
+        zfile = zipfile.ZipFile(output)
+        self.assertEqual(zfile.getinfo('api/en/treks.geojson').compress_type, zipfile.ZIP_STORED)
+
+    def test_duplicate_entries(self):
+        output = BytesIO()
+        with SyncZipFile(output, 'w') as zfile:
+            zfile.writestr('api/en/treks.geojson', '{}')
+            zfile.writestr('api/en/treks.geojson', '[]')
+        zfile = zipfile.ZipFile(output)
+        self.assertEqual(zfile.namelist(), ['api/en/treks.geojson'])
+        self.assertEqual(zfile.read('api/en/treks.geojson'), '{}')
+
+    def test_fix2028_across_chunks(self):
+        self.assertEqual(b''.join(fix2028_chunks(['toto\\u20', '28tata\\u2029'])), 'toto\\ntata\\n')
+
+
 class SyncRandoFailTest(TestCase):
     @classmethod
     def setUpClass(cls):
@@ -120,6 +251,12 @@ class SyncRandoFailTest(TestCase):
                                     skip_tiles=True, verbosity=2)
         self.assertEqual(e.exception.message, "url parameter should start with http:// or https://")
 
+    def test_fail_workers(self):
+        with self.assertRaises(CommandError) as e:
+            management.call_command('sync_rando', 'tmp', url='http://localhost:8000',
+                                    skip_tiles=True, workers=0, verbosity=2)
+        self.assertEqual(e.exception.message, "workers parameter should be at least 1")
+
     def test_language_not_in_db(self):
         with self.assertRaises(CommandError) as e:
             management.call_command('sync_rando', 'tmp', url='http://localhost:8000',
@@ -164,6 +301,23 @@ class SyncRandoFailTest(TestCase):
         shutil.rmtree('tmp')
 
 
+class SyncWorkersTest(SyncWorkersTestMixin, TransactionTestCase):
+    command = 'sync_rando'
+    options = {'languages': 'en,fr', 'with_events': True, 'skip_tiles': True, 'skip_pdf': True}
+
+    def setUp(self):
+        trek = TrekWithPublishedPOIsFactory.create(published=True)
+        AttachmentFactory.create(content_object=trek, attachment_file=get_dummy_uploaded_image())
+        TrekFactory.create(published=True)
+        TouristicContentFactory(geom='SRID=%s;POINT(700001 6600001)' % settings.SRID, published=True)
+        TouristicEventFactory(geom='SRID=%s;POINT(700001 6600001)' % settings.SRID, published=True)
+
+    @mock.patch('geotrek.trekking.management.commands.sync_rando.Pool')
+    def test_no_workers_in_celery_task(self, mocked_pool):
+        self.sync('tmp_serial', workers=2, task=mock.MagicMock())
+        self.assertFalse(mocked_pool.called)
+
+
 class SyncTest(TestCase):
     def setUp(self):
         self.source_a = RecordSourceFactory()
@@ -270,6 +424,78 @@ class SyncTest(TestCase):
                 # \u2028 is translated to \n
                 self.assertEquals(treks['features'][0]['properties']['description'], u'toto\ntata')
 
+    def test_sync_memoize_language_independent_results(self):
+        self.trek_1.published_fr = True
+        self.trek_1.save()
+        self.trek_2.delete()
+        self.trek_3.delete()
+        self.trek_4.delete()
+        output = BytesIO()
+        with mock.patch('geotrek.trekking.models.Trek.prepare_map_image'):
+            management.call_command('sync_rando', 'tmp', url='http://localhost:8000', languages='en,fr',
+                                    skip_tiles=True, skip_pdf=True, verbosity=1, stdout=output)
+        self.assertIn('Cache profiles: 1/2 hits (50%)', output.getvalue())
+        self.assertIn('Cache dems: 1/2 hits (50%)', output.getvalue())
+        profile_en = os.path.join('tmp', 'api', 'en', 'treks', str(self.trek_1.pk), 'profile.json')
+        profile_fr = os.path.join('tmp', 'api', 'fr', 'treks', str(self.trek_1.pk), 'profile.json')
+        self.assertTrue(os.path.samefile(profile_en, profile_fr))
+
+    def test_sync_incremental(self):
+        with mock.patch('geotrek.trekking.models.Trek.prepare_map_image'):
+            management.call_command('sync_rando', 'tmp', url='http://localhost:8000', languages='en',
+                                    incremental=True, skip_tiles=True, skip_pdf=True, verbosity=2, stdout=BytesIO())
+        self.assertTrue(os.path.exists(os.path.join('tmp', 'sync_rando.json')))
+        self.trek_2.save()
+        output = BytesIO()
+        with mock.patch('geotrek.trekking.models.Trek.prepare_map_image'):
+            management.call_command('sync_rando', 'tmp', url='http://localhost:8000', languages='en',
+                                    incremental=True, skip_tiles=True, skip_pdf=True, verbosity=2, stdout=output)
+        self.assertIn('sync_trek:en:{}\x1b[0m \x1b[32munchanged'.format(self.trek_1.pk), output.getvalue())
+        self.assertNotIn('sync_trek:en:{}\x1b[0m \x1b[32munchanged'.format(self.trek_2.pk), output.getvalue())
+        self.assertTrue(os.path.exists(os.path.join('tmp', 'api', 'en', 'treks', str(self.trek_1.pk), 'profile.json')))
+        self.assertTrue(os.path.exists(os.path.join('tmp', 'zip', 'treks', 'en', '{}.zip'.format(self.trek_1.pk))))
+        with zipfile.ZipFile(os.path.join('tmp', 'zip', 'treks', 'en', 'global.zip')) as global_zip:
+            self.assertIn('api/en/treks/{}/pois.geojson'.format(self.trek_1.pk), global_zip.namelist())
+
+    def test_sync_report(self):
+        report = os.path.join(tempfile.mkdtemp(), 'report.json')
+        with mock.patch('geotrek.trekking.models.Trek.prepare_map_image'):
+            management.call_command('sync_rando', 'tmp', url='http://localhost:8000', languages='en',
+                                    report=report, skip_tiles=True, skip_pdf=True, verbosity=0)
+        with open(report) as f:
+            data = json.load(f)
+        shutil.rmtree(os.path.dirname(report))
+        self.assertEqual(list(data['languages'].keys()), ['en'])
+        self.assertGreater(data['steps']['view']['generated'], 0)
+        self.assertGreater(data['steps']['view']['bytes'], 0)
+        self.assertEqual(data['steps']['job']['generated'], data['steps']['job']['count'])
+        self.assertIn('zip', data['steps'])
+        durations = [view['duration'] for view in data['slowest']['view']]
+        self.assertEqual(durations, sorted(durations, reverse=True))
+
+    def test_sync_progress(self):
+        task = mock.MagicMock()
+        with mock.patch('geotrek.trekking.models.Trek.prepare_map_image'):
+            management.call_command('sync_rando', 'tmp', url='http://localhost:8000', languages='en,fr',
+                                    task=task, skip_tiles=True, skip_pdf=True, verbosity=0)
+        progress = [kwargs['meta']['current'] for args, kwargs in task.update_state.call_args_list]
+        self.assertEqual(progress, sorted(progress))
+        self.assertEqual(progress[-1], 100)
+        self.assertGreater(len(set(progress)), 3)
+
+    def test_sync_precompress(self):
+        with mock.patch('geotrek.trekking.models.Trek.prepare_map_image'):
+            management.call_command('sync_rando', 'tmp', url='http://localhost:8000', languages='en',
+                                    precompress=True, skip_tiles=True, skip_pdf=True, verbosity=0)
+        with open(os.path.join('tmp', 'api', 'en', 'treks.geojson'), 'rb') as f:
+            content = f.read()
+        with gzip.open(os.path.join('tmp', 'api', 'en', 'treks.geojson.gz'), 'rb') as f:
+            self.assertEqual(f.read(), content)
+        self.assertFalse(os.path.exists(os.path.join('tmp', 'api', 'en', 'treks', str(self.trek_1.pk),
+                                                     'profile.png.gz')))
+        with zipfile.ZipFile(os.path.join('tmp', 'zip', 'treks', 'en', 'global.zip')) as global_zip:
+            self.assertNotIn('api/en/treks.geojson.gz', global_zip.namelist())
+
     @mock.patch('geotrek.trekking.views.TrekViewSet.list')
     def test_streaminghttpresponse(self, mocke):
         output = BytesIO()